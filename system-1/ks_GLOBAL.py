@@ -27,26 +27,23 @@ TEXT_CONTENT_DIR = "Text_Content/Ch02/"
 # 2. Three variables are set:
 #    X_FILENAMES = a list of text strings corresponding to filenames on disk.
 #    X_LOCATION = the path to the files, relative to the main program file.
-#    X_SO_LIST = the tuple of sound_object files that ends up getting created.
-#                (The lists are converted to tuples for speed and safety.)
+#    X_SO_LIST = the table of sound_object files that ends up getting created.
+#                (A ks_load.SoundTable: it acts like a tuple of sound_objects,
+#                but the files are only loaded when the table is first used.)
 
 # NUMBER_SO_LIST - list of sound-objects that are the numbers 0 to 9
 
 NUMBER_FILENAMES = ("00_f.wav", "01_f.wav", "02_f.wav", "03_f.wav", "04_f.wav",
                     "05_f.wav", "06_f.wav", "07_f.wav", "08_f.wav", "09_f.wav")
 NUMBER_LOCATION = WAVE_DIR_PROVIDED + "numbers/"
-NUMBER_SO_LIST = list()
-ks_load.load_sound_objects(NUMBER_FILENAMES, NUMBER_LOCATION, NUMBER_SO_LIST)
-NUMBER_SO_LIST = tuple(NUMBER_SO_LIST)
+NUMBER_SO_LIST = ks_load.SoundTable(NUMBER_FILENAMES, NUMBER_LOCATION)
 
 # CH_NAME_SO_LIST - chapter names put into sound_objects
 
 CH_NAME_FILENAMES = ("Ch01.wav", "Ch02.wav", "Ch03.wav", "Ch04.wav", "Ch05.wav", "Ch06.wav",
                     "Ch07.wav")
 CH_NAME_LOCATION = WAVE_DIR_PROVIDED + NORMAN_DIR + CHAPTER_NAME_DIR
-CH_NAME_SO_LIST = list()
-ks_load.load_sound_objects(CH_NAME_FILENAMES, CH_NAME_LOCATION, CH_NAME_SO_LIST)
-CH_NAME_SO_LIST = tuple(CH_NAME_SO_LIST)
+CH_NAME_SO_LIST = ks_load.SoundTable(CH_NAME_FILENAMES, CH_NAME_LOCATION)
 
 # READ_ITEM_LIST - read-item names put into sound_objects.
 # This is the sequence of items for reading the entire chapter.
@@ -66,6 +63,4 @@ READ_ITEM_FILENAMES = ("000_CN_34.wav", "001_TS_34.wav", "002_RP_34.wav", "003_S
 	"054_SH_39.wav", "055_TS_39.wav", "056_RP_39.wav", "057_TS_39.wav", "058_RP_39.wav", 
 	"059_TS_40.wav", "060_RP_40.wav", "061_TS_40.wav", "062_RP_40.wav")
 READ_ITEM_LOCATION = WAVE_DIR_PROVIDED + NORMAN_DIR + TEXT_CONTENT_DIR
-READ_ITEM_SO_LIST = list()
-ks_load.load_sound_objects(READ_ITEM_FILENAMES, READ_ITEM_LOCATION, READ_ITEM_SO_LIST)
-READ_ITEM_SO_LIST = tuple(READ_ITEM_SO_LIST)
+READ_ITEM_SO_LIST = ks_load.SoundTable(READ_ITEM_FILENAMES, READ_ITEM_LOCATION)
@@ -0,0 +1,347 @@
+################################################################################
+# ks_bench - Benchmarks for the key_sounds programs.
+################################################################################
+# Run from the same directory as ks_main.py:
+#   python3 ks_bench.py playback <wave file>
+#       Plays the wave file with the original 10 ms polling loop and with
+#       play_sounds() waiting on the play-queue itself, and reports the
+#       stop-to-silence latency and the CPU used while the sound plays.
+#       (Needs an audio device, like ks_main.py does.)
+#   python3 ks_bench.py load <directory>
+#       Loads every wave file in the directory one after another, and then on
+#       ks_pcm.load_waves()'s pool of threads, and reports the total time and
+#       the slowest files for each.
+#   python3 ks_bench.py startup [book directory ...]
+#       Starts the program's sounds up in a fresh python, with the sound tables
+#       loaded up front and loaded lazily (see ks_load.SoundTable), and reports
+#       the time from start-up to the first prompt being put on the play-queue.
+#       (For system-2/3, the first prompt comes after the books are opened;
+#       the default book is the one ks_main.py opens.)
+#   python3 ks_bench.py launch <wave file>
+#       Launches the play_sounds() process with each start method, and as a
+#       thread (see ks_launch.py), and reports the time from launching it to it
+#       taking the first sound off the play-queue, the memory it did not share
+#       with the keystroke process (on Linux), and how long stopping the sound
+#       it plays takes. (Needs an audio device, like ks_main.py does.)
+#   python3 ks_bench.py commands <wave file>
+#       Sends each kind of command to the play_sounds() process, and reports
+#       the round trip: from sending it, to play_sounds() having carried it out
+#       (SoundQueue.join() returning). PLAY is timed as a PLAY and a STOP.
+#       (Needs an audio device, like ks_main.py does.)
+################################################################################
+
+# Packages
+import multiprocessing
+import os
+import queue
+import subprocess
+import sys
+import time
+
+# Local imports - "ks" stands for "key_sounds".
+import ks_launch
+import ks_load
+import ks_log
+import ks_o
+import ks_pcm
+import ks_play
+import ks_reg
+import ks_stop
+import ks_trace
+
+################################################################################
+# Helpers.
+################################################################################
+
+# Load a single wave file as a sound_object.
+def load_sound(filename):
+    directory, name = os.path.split(filename)
+    return ks_o.sound_object(directory, name)
+
+# Take everything logged so far off a log queue, as a list of (text, time).
+def drain_log(log_q, timeout=1.0):
+    entries = list()
+    while True:
+        try:
+            entries.append(log_q.get(timeout=timeout))
+        except queue.Empty:
+            return entries
+        log_q.task_done()
+
+# Start a play_sounds() consumer process, and return everything it needs.
+def start_consumer():
+    sound_q = ks_play.SoundQueue()
+    log_q = multiprocessing.JoinableQueue()
+    consumer = multiprocessing.Process(target=ks_play.play_sounds,
+        args=(sound_q, log_q, ks_reg.snapshot()))
+    consumer.daemon = True
+    consumer.start()
+    return consumer, sound_q, log_q
+
+# Start a poll_sounds() process instead, and return the same.
+def start_poller():
+    sound_q = PollQueue()
+    log_q = multiprocessing.JoinableQueue()
+    consumer = multiprocessing.Process(target=poll_sounds,
+        args=(sound_q, log_q, ks_reg.snapshot()))
+    consumer.daemon = True
+    consumer.start()
+    return consumer, sound_q, log_q
+
+# The play-queue of poll_sounds(): sound ids on a JoinableQueue, and the
+#   stop-playing event that the original stop_sounds() set to stop a sound.
+#   (Just enough of a SoundQueue for bench_playback() and ks_stop.stop_sounds().)
+class PollQueue:
+
+    def __init__(self):
+        self.queue = multiprocessing.JoinableQueue()
+        self.stop_playing_e = multiprocessing.Event()
+
+    def put(self, s_obj):
+        self.queue.put(s_obj.id)
+
+    def stop(self):
+        self.stop_playing_e.set()
+
+    def join(self):
+        self.queue.join()
+
+# The original play_sounds() loop, as it was before it waited on the
+#   play-queue: while a sound plays, it checks the stop-playing event every
+#   10 ms. Kept as the baseline for bench_playback(), logging what
+#   play_sounds() logs for it. (The original's hold-queue event is left out,
+#   as nothing here is cleared off the queue.)
+def poll_sounds(input_q, log_q, sounds):
+    ks_reg.install(sounds)
+    while True:
+        sound_obj = ks_reg.lookup(input_q.queue.get())
+        input_q.stop_playing_e.clear()
+        object_playing = sound_obj.waveobject.play()
+        cpu_start = time.process_time()
+        while object_playing.is_playing():
+            if input_q.stop_playing_e.is_set():
+                object_playing.stop()
+                ks_log.log("SOUNDS: STOP sounded " + sound_obj.name + " - stop event", log_q)
+                input_q.stop_playing_e.clear()
+                break
+            time.sleep(0.01)
+        ks_log.log("SOUNDS: CPU {:.6f} seconds playing ".format(
+            time.process_time() - cpu_start) + sound_obj.name, log_q)
+        input_q.queue.task_done()
+
+# Print the 50th, 95th and maximum of some times, in milliseconds.
+def print_times(label, times):
+    times = sorted(times)
+    if not times:
+        print("{:<28} (no samples)".format(label))
+        return
+    p50 = times[len(times) // 2]
+    p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+    print("{:<28} p50 {:8.3f} ms   p95 {:8.3f} ms   max {:8.3f} ms".format(
+        label, p50 * 1000, p95 * 1000, times[-1] * 1000))
+
+################################################################################
+# bench_playback() - Stop latency and CPU use of the playback loop.
+# For each kind of wait, the sound is started and stopped part way through
+#   (trials) times, to measure the time from stop_sounds() being called to the
+#   consumer stopping the sound; then it is played through once, to measure
+#   the CPU used by the consumer while it just waits for a sound to finish.
+################################################################################
+def bench_playback(filename, trials=20):
+    sound = load_sound(filename)
+    play_for = min(0.5, sound.duration() / 2)
+
+    for label, start in (("polling every 10 ms", start_poller), ("waiting on the queue", start_consumer)):
+        consumer, sound_q, log_q = start()
+
+        for trial in range(trials):
+            sound_q.put(sound)
+            time.sleep(play_for)
+            ks_stop.stop_sounds(sound_q, log_q)
+            sound_q.join()
+        sound_q.put(sound)
+        sound_q.join()
+
+        entries = drain_log(log_q)
+        consumer.terminate()
+
+        # Pair each stop request with the stop that followed it.
+        latencies = list()
+        stop_requested = None
+        for text, t in entries:
+            if text == "stop_sounds: START":
+                stop_requested = t
+            elif text.startswith("SOUNDS: STOP sounded") and stop_requested is not None:
+                latencies.append(t - stop_requested)
+                stop_requested = None
+        cpu = [float(text.split()[2]) for text, t in entries if text.startswith("SOUNDS: CPU")]
+
+        print(label)
+        print_times("  stop-to-silence latency", latencies)
+        if not cpu:
+            print("  CPU while playing: (no samples)")
+            continue
+        print("  CPU while playing {:.2f} s: {:.2f} ms ({:.3f}% of one core)".format(
+            sound.duration(), cpu[-1] * 1000, 100 * cpu[-1] / sound.duration()))
+
+################################################################################
+# bench_load() - Time to load a directory of wave files, serially and in parallel.
+# The files are loaded once first, untimed, so that every timed load reads
+#   them from the operating system's file cache, and not some from the disk.
+################################################################################
+def bench_load(directory):
+    filenames = sorted(f for f in os.listdir(directory) if f.endswith(".wav"))
+    ks_load.load_sound_objects(filenames, directory, list())
+
+    for label, workers in (("one after another", 1), ("in parallel", None)):
+        ks_pcm.LOAD_WORKERS = workers
+        del ks_pcm.LOAD_TIMES[:]
+        del ks_pcm.LOAD_TOTALS[:]
+        ks_load.load_sound_objects(filenames, directory, list())
+        print(label)
+        ks_load.print_load_times(top=5)
+
+################################################################################
+# bench_startup() - Time from start-up to the first prompt.
+# Each run is a fresh python, running STARTUP_SCRIPT, which imports ks_main.py
+#   (without running it) and then plays the first prompt the way ks_main.py
+#   does, into a play-queue with nothing reading it.
+################################################################################
+STARTUP_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import ks_load
+ks_load.LAZY_TABLES = {lazy}
+import ks_main, ks_o, ks_play
+sound_q = ks_play.SoundQueue()
+sound_q.queue.cancel_join_thread()   # nothing will read it
+if hasattr(ks_main, "play_intro"):
+    ks_main.play_intro(sound_q)
+else:
+    ks_o.AudiobookPlayer({books!r}, sound_q)
+print(time.perf_counter() - start)
+"""
+
+def bench_startup(*books, runs=5):
+    books = list(books) or ['wav_files_provided/Book_01_norman/']
+    for label, lazy in (("sound tables loaded up front", False), ("sound tables loaded lazily", True)):
+        script = STARTUP_SCRIPT.format(lazy=lazy, books=books)
+        times = [float(subprocess.check_output([sys.executable, "-c", script]))
+                 for run in range(runs)]
+        print_times(label, times)
+
+################################################################################
+# bench_launch() - Start-up time, memory and stop latency of each way of
+#   launching the consumer (see ks_launch.py), a thread included.
+# Each launch is traced (see ks_trace.py) as a key pressed at the moment the
+#   consumer is created, so the GET stage is the consumer's whole cold start.
+# The memory is what the consumer did not share with the keystroke process:
+#   for a process, its private memory; for a thread, what this process grew by.
+# Once the consumer is playing the sound, it is stopped, and timed from
+#   SoundQueue.stop() to SoundQueue.join() returning. Then it is shut down.
+################################################################################
+def bench_launch(filename, runs=5):
+    sound = load_sound(filename)
+    ks_launch.preload()
+    for method in ks_launch.LAUNCH_METHODS[1:]:
+        ks_launch.use(method)
+        times = list()
+        private = list()
+        stops = list()
+        for run in range(runs):
+            trace_q = multiprocessing.Queue()
+            sound_q = ks_launch.sound_queue(trace_q)
+            before = private_memory(os.getpid())
+            ks_trace.key_pressed(trace_q)
+            consumer = ks_launch.process(ks_play.play_sounds,
+                args=(sound_q, None, ks_reg.snapshot()))
+            consumer.daemon = True
+            consumer.start()
+            sound_q.put(sound)
+            stamps = dict()
+            while ks_trace.GET not in stamps:
+                key_number, stage, t = trace_q.get()
+                stamps[stage] = t
+            times.append(stamps[ks_trace.GET] - stamps[ks_trace.KEY])
+            if method == "thread":
+                after = private_memory(os.getpid())
+                private.append(None if None in (before, after) else after - before)
+            else:
+                private.append(private_memory(consumer.pid))
+
+            time.sleep(min(0.1, sound.duration() / 2))
+            start = time.perf_counter()
+            sound_q.stop()
+            sound_q.join()
+            stops.append(time.perf_counter() - start)
+
+            sound_q.shutdown()
+            consumer.join()
+        print(method)
+        print_times("  launch to first GET", times)
+        if None not in private:
+            print("{:<28} {:.1f} MB".format("  private memory", max(private) / 1024))
+        print_times("  stop to stopped", stops)
+
+################################################################################
+# bench_commands() - Round trip of each command through the play_sounds() process.
+# Every command is sent (trials) times, and timed from being sent to
+#   SoundQueue.join() returning, once play_sounds() has carried it out and
+#   called task_done(). The playlist is loaded first, and then paused, so that
+#   SEEK and RESUME have something to move in without playing it for long.
+################################################################################
+def bench_commands(filename, trials=50):
+    sound = load_sound(filename)
+    consumer, sound_q, log_q = start_consumer()
+    sound_q.load_playlist([sound])
+    sound_q.pause()
+    sound_q.join()
+
+    commands = (("PLAY, STOP", lambda: (sound_q.put(sound), sound_q.stop())),
+                ("ENQUEUE_MANY, STOP", lambda: (sound_q.put_many([sound, sound]), sound_q.stop())),
+                ("STOP", sound_q.stop),
+                ("FLUSH", sound_q.flush),
+                ("SEEK, PAUSE", lambda: (sound_q.seek(0), sound_q.pause())),
+                ("RESUME, PAUSE", lambda: (sound_q.resume(), sound_q.pause())),
+                ("PAUSE", sound_q.pause))
+    for label, send in commands:
+        times = list()
+        for trial in range(trials):
+            start = time.perf_counter()
+            send()
+            sound_q.join()
+            times.append(time.perf_counter() - start)
+        print_times(label, times)
+
+    sound_q.shutdown()
+    # (The consumer cannot exit until everything it logged has been taken.)
+    drain_log(log_q)
+    consumer.join()
+
+# The memory (in kB) of a process that is not shared with any other process,
+#   or None if the system does not say.
+def private_memory(pid):
+    try:
+        with open("/proc/{}/smaps_rollup".format(pid)) as f:
+            return sum(int(line.split()[1]) for line in f
+                       if line.startswith(("Private_Clean:", "Private_Dirty:")))
+    except OSError:
+        return None
+
+################################################################################
+# Run a benchmark, as chosen on the command line.
+################################################################################
+
+BENCHMARKS = {
+    "playback": bench_playback,
+    "load": bench_load,
+    "startup": bench_startup,
+    "launch": bench_launch,
+    "commands": bench_commands,
+}
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print("Usage: python3 ks_bench.py {} [arguments]".format("|".join(BENCHMARKS)))
+        sys.exit(1)
+    BENCHMARKS[sys.argv[1]](*sys.argv[2:])
@@ -0,0 +1,111 @@
+################################################################################
+# ks_launch - How the play_sounds() consumer is started: as a process or a thread.
+################################################################################
+# Used by ks_main.py, a program that uses keystrokes to play wave files.
+#
+# ks_main.py starts play_sounds() in a second process, or, with "thread", in a
+#   thread of its own process. How the consumer gets its sounds depends on the
+#   start method (LAUNCH_METHODS), chosen with use():
+#   None          multiprocessing's default for the platform. With "spawn"
+#                 (macOS, Windows) the child is a fresh python: it imports
+#                 every module again and is sent the registry snapshot.
+#   "fork"        Pre-fork. preload() first loads every sound table in the
+#                 keystroke process (see ks_load.load_all_tables()), and then
+#                 the child is forked from it. The child starts with all of the
+#                 modules imported and all of the sounds loaded, shares every
+#                 page with the parent copy-on-write, and has nothing to load.
+#                 gc.freeze() is called just before the fork, so the garbage
+#                 collector does not write to (and so copy) the inherited
+#                 objects. Not available on Windows.
+#   "forkserver"  A server process is started once, with PRELOAD already
+#                 imported, and the child is forked from it. The registry
+#                 snapshot is still sent, but the audio itself is not: a sound
+#                 only carries its region of the PCM arena (see ks_pcm.py),
+#                 which the child maps. Not available on Windows.
+#   "thread"      No second process at all. play_sounds() runs in a thread, and
+#                 uses the very same sound_objects, by reference: there is no
+#                 registry to hand over, no second interpreter to start or to
+#                 hold in memory, and the play-queue is a plain queue.Queue, so
+#                 nothing put on it is pickled. (simpleaudio and sounddevice
+#                 play in their own threads, outside the GIL, and readchar
+#                 waits for keys outside it too, so the two threads do not get
+#                 in each other's way.)
+# The queues handed to the consumer must be created after use() is called, so
+#   that they belong to the same start method: make the play-queue with
+#   sound_queue(), and the log and trace queues with joinable_queue().
+# Sounds loaded lazily with ks_pcm.LAZY_BUDGET are still decoded when they are
+#   first played, whatever the method.
+#
+# Compare the methods (start-up time, memory and stop latency) with:
+#   python3 ks_bench.py launch <wave file>
+################################################################################
+
+# Packages
+import gc
+import multiprocessing
+import threading
+
+# Local imports - "ks" stands for "key_sounds".
+import ks_load
+import ks_play
+
+# The start methods that can be given to use().
+LAUNCH_METHODS = (None, "spawn", "fork", "forkserver", "thread")
+
+# The start method chosen with use().
+METHOD = None
+
+# The modules the fork server imports before it forks the consumer.
+PRELOAD = ["ks_GLOBAL", "ks_load", "ks_o", "ks_pcm", "ks_play"]
+
+################################################################################
+# preload() - Load every sound up front, before the consumer is launched, so
+#   that a forked consumer inherits all of them. Returns the number of sounds
+#   loaded. (Call it before taking the registry snapshot.) A thread shares the
+#   sounds as they load, so nothing is loaded for one.
+################################################################################
+def preload():
+    if METHOD == "thread":
+        return 0
+    return ks_load.load_all_tables()
+
+################################################################################
+# use() - Start every process from now on with the given method (one of
+#   LAUNCH_METHODS; None leaves the platform's default).
+################################################################################
+def use(method):
+    global METHOD
+    if method not in LAUNCH_METHODS:
+        raise ValueError('Unknown launch method "{}"'.format(method))
+    METHOD = method
+    if method is not None and method != "thread":
+        multiprocessing.set_start_method(method, force=True)
+    if method == "forkserver":
+        multiprocessing.set_forkserver_preload(PRELOAD)
+
+################################################################################
+# sound_queue() - A new play-queue (see ks_play.SoundQueue), for the consumer.
+################################################################################
+def sound_queue(trace_q=None):
+    return ks_play.SoundQueue(trace_q, local=(METHOD == "thread"))
+
+################################################################################
+# joinable_queue() - A new multiprocessing.JoinableQueue, for the consumer to
+#   log (or trace) to. (One works for a thread, too; and ks_log.output_log()
+#   reads the log queue from a process of its own.)
+################################################################################
+def joinable_queue():
+    return multiprocessing.JoinableQueue()
+
+################################################################################
+# process() - A (not yet started) Process that runs target(*args), or, with
+#   "thread", a Thread. (Either one is started, and joined, the same way.)
+################################################################################
+def process(target, args):
+    if METHOD == "thread":
+        return threading.Thread(target=target, args=args)
+    if multiprocessing.get_start_method() == "fork" and hasattr(gc, "freeze"):
+        # Move everything allocated so far out of the collector's reach, so
+        #   the child never touches (and copies) the pages it inherits.
+        gc.freeze()
+    return multiprocessing.Process(target=target, args=args)
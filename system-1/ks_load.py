@@ -6,10 +6,14 @@
 ################################################################################
 
 # Packages
+import os
 import simpleaudio
 
 # Local imports - "ks" stands for "key_sounds".
+import ks_log
+import ks_norm
 import ks_o    # key_sounds sound_object
+import ks_pcm
 
 ################################################################################
 # load_sound_objects() - Function to create sound objects for soundfiles on disk.
@@ -19,8 +23,127 @@ import ks_o    # key_sounds sound_object
 #   • object_list_name: the (empty) list of sound_objects used in the program
 # Note: It is important that object_list_name is "changed in place" such as with
 #   append(), and not replaced with a new object.
+# The files are decoded in parallel (see ks_pcm.load_waves()), but the
+#   sound_objects are created, and appended, in the order of list_of_filenames.
 ################################################################################
 def load_sound_objects(list_of_filenames, directory_location, object_list_name):
-    for f in list_of_filenames:
-        object_list_name.append(ks_o.sound_object(directory_location, f))
+    audio = ks_pcm.load_waves([os.path.join(directory_location, f)
+                               for f in list_of_filenames])
+    for f, a in zip(list_of_filenames, audio):
+        object_list_name.append(ks_o.sound_object(directory_location, f, audio=a))
 
+# Set to False to load every SoundTable as soon as it is created, the way the
+#   module-level lists of sound_objects always used to be loaded.
+LAZY_TABLES = True
+
+# Every SoundTable created so far, so they can all be loaded at once (see
+#   load_all_tables()).
+TABLES = list()
+
+################################################################################
+# SoundTable - A tuple of sound_objects that is only loaded when first used.
+# Input parameters: like load_sound_objects(): list_of_filenames, directory_location
+# Indexing, slicing and iterating work as they do on a tuple of sound_objects,
+#   and load all of the table's sounds (with load_sound_objects()) the first time.
+#   len() does not load them.
+# So a module can set up all of its sounds when it is imported, at no cost,
+#   and a program only ever loads the ones it uses. (This matters twice over
+#   with the "spawn" start method, where the play_sounds() process imports the
+#   modules all over again.)
+################################################################################
+class SoundTable:
+
+    def __init__(self, list_of_filenames, directory_location):
+        self.filenames = tuple(list_of_filenames)
+        self.location = directory_location
+        self.sounds = None
+        TABLES.append(self)
+        if not LAZY_TABLES:
+            self.load()
+
+    # Returns the tuple of sound_objects, loading them if need be.
+    def load(self):
+        if self.sounds is None:
+            sounds = list()
+            load_sound_objects(self.filenames, self.location, sounds)
+            self.sounds = tuple(sounds)
+        return self.sounds
+
+    def __getitem__(self, i):
+        return self.load()[i]
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __len__(self):
+        return len(self.filenames)
+
+    # A SoundRef to the sound at index i, without loading anything yet.
+    def ref(self, i):
+        return SoundRef(self, i)
+
+################################################################################
+# SoundRef - Stands in for one sound_object of a SoundTable, for module-level
+#   names like PRESS_SPACE = MISC_SO_LIST.ref(0). The table is loaded when any
+#   attribute of the sound (such as its id) is first looked up.
+################################################################################
+class SoundRef:
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def __getattr__(self, name):
+        # (Only called for attributes a SoundRef does not have itself.)
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.table[self.index], name)
+
+################################################################################
+# load_all_tables() - Load every SoundTable that has not been loaded yet.
+# Returns the number of sounds that were loaded.
+################################################################################
+def load_all_tables():
+    count = 0
+    for table in TABLES:
+        if table.sounds is None:
+            count += len(table.load())
+    return count
+
+################################################################################
+# print_load_times() - Print how long loading the sounds took.
+# Prints the total, how much memory sharing identical audio saved (see
+#   ks_pcm.py), which files were converted (see ks_norm.py), and then the time
+#   for each file, slowest first (only the slowest [top] files, if top is given).
+################################################################################
+def print_load_times(top=None):
+    times = sorted(ks_pcm.LOAD_TIMES, key=lambda t: t[1], reverse=True)
+    print("Loaded {} files in {:.3f} s ({:.3f} s of decoding, on {} threads)".format(
+        len(times), sum(ks_pcm.LOAD_TOTALS), sum(t[1] for t in times),
+        ks_pcm.LOAD_WORKERS or "the default number of"))
+    if ks_pcm.ARENA is not None:
+        print("{} duplicate files shared audio already loaded, saving {:.1f} MB".format(
+            ks_pcm.ARENA.shared, ks_pcm.ARENA.saved / (1024 * 1024)))
+    ks_norm.print_conversions()
+    for filename, seconds in times[:top]:
+        print("  {:8.3f} ms  {}".format(seconds * 1000, filename))
+
+
+################################################################################
+# log_load_times() - Log how long loading the sounds has taken so far, how
+#   much memory sharing identical audio saved, and how many files were
+#   converted, like print_load_times() prints them, but just the totals, for
+#   ks_main.py to log as it runs.
+#   Logging is off if log_q is None (see ks_log.py).
+################################################################################
+def log_load_times(log_q):
+    ks_log.log("LOAD: {} files in {:.3f} s ({:.3f} s of decoding)".format(
+        len(ks_pcm.LOAD_TIMES), sum(ks_pcm.LOAD_TOTALS),
+        sum(seconds for filename, seconds in ks_pcm.LOAD_TIMES)), log_q)
+    if ks_pcm.ARENA is not None:
+        ks_log.log("LOAD: {} duplicate files shared audio, saving {} bytes".format(
+            ks_pcm.ARENA.shared, ks_pcm.ARENA.saved), log_q)
+    if ks_norm.CONVERTED:
+        ks_log.log("LOAD: converted {} files to {} ({} from the cache)".format(
+            len(ks_norm.CONVERTED), ks_norm.CANONICAL_FORMAT,
+            sum(cached for filename, fmt, cached in ks_norm.CONVERTED)), log_q)
@@ -48,7 +48,9 @@
 # The use of this software pattern permits threading to be used in a relatively
 #   simple and straightforward manner, with minimal programming overhead.
 #   The only coordination needed, and used, is thread-safe message passing.
-# Additional communication is accomplished with two multiprocessing.Events.
+# Every command, stopping included, is a message on the queue (see
+#   ks_play.SoundQueue); a generation counter on the queue lets it be stopped
+#   in one step.
 ################################################################################
 
 ################################################################################
@@ -59,10 +61,10 @@
 ################################################################################
 
 # Packages
-import multiprocessing  # standard python package
 import time            # standard python package
 import readchar  # version 2.0.1
 # Also uses simpleaudio-1.0.2
+# And, only for continuous playback (see prefetch_depth below), sounddevice.
 
 
 # Local imports
@@ -75,6 +77,10 @@ import ks_log
 import ks_play
 import ks_stop
 import ks_GLOBAL
+import ks_launch
+import ks_reg
+import ks_trace
+import ks_compose
 
 # Local imports - "ks" stands for "key_sounds".
 import ks_load
@@ -98,62 +104,58 @@ CHAPTER_NUMBER=6
 ################################################################################
 # Load sound files.
 ################################################################################
+# Each X_SO_LIST is a ks_load.SoundTable, which only loads its files the first
+#   time it is used, and each named sound below is a reference into a table.
+#   So importing this module loads nothing, and the first prompt only waits
+#   for the sounds it needs.
 
 # BOOK_NUMBER_SO_LIST - book titles put into sound_objects
 
 # I had to put same book title wave files twice, otherwise it was giving error
 BOOK_NUMBER_FILENAMES = ("Book_Title.wav", "Book_Title.wav")
 BOOK_NUMBER_LOCATION = WAVE_DIR_PROVIDED + NORMAN_DIR
-BOOK_NUMBER_SO_LIST = list()
-ks_load.load_sound_objects(
-    BOOK_NUMBER_FILENAMES, BOOK_NUMBER_LOCATION, BOOK_NUMBER_SO_LIST)
-BOOK_NUMBER_SO_LIST = tuple(BOOK_NUMBER_SO_LIST)
+BOOK_NUMBER_SO_LIST = ks_load.SoundTable(BOOK_NUMBER_FILENAMES, BOOK_NUMBER_LOCATION)
 
 # CHAPTER_NUMBER_SO_LIST - list of chapter numbers and put into sound_objects
 
 CHAPTER_NUMBER_FILENAMES = ("chapter_one.wav", "chapter_two.wav", "chapter_three.wav", "chapter_four.wav", "chapter_five.wav",
                             "chapter_six.wav", "chapter_seven.wav")
 CHAPTER_NUMBER_LOCATION = MY_WAVE_DIR + CHAPTER_NUMBER_DIR
-CHAPTER_NUMBER_SO_LIST = list()
-ks_load.load_sound_objects(
-    CHAPTER_NUMBER_FILENAMES, CHAPTER_NUMBER_LOCATION, CHAPTER_NUMBER_SO_LIST)
-CHAPTER_NUMBER_SO_LIST = tuple(CHAPTER_NUMBER_SO_LIST)
+CHAPTER_NUMBER_SO_LIST = ks_load.SoundTable(CHAPTER_NUMBER_FILENAMES, CHAPTER_NUMBER_LOCATION)
 
 # MISC_SO_LIST - list of miscellaneous auditory messages and put into sound-objects
 
 MISC_FILENAMES = ("press_space_to_select.wav", "press_j_to_schroll_backward.wav", "press_k_to_schroll_forward.wav", "press_l_for_help.wav",  "press_sc_to_quit.wav",  "press_l_again_for_help.wav",
                   "press_sc_again_to_quit.wav",     "exiting_program.wav", "not_available.wav", "you_selected.wav", "select_book.wav", "select_chapter.wav", "select_page.wav", "quit_message.wav", "continue_to_read.wav", "Press_J_to_go_to_the_previous_menu.wav", "select_another_chapter.wav", "press_sc_and_j_to_go_back.wav","press_space_to_select_book.wav","press_space_to_select_chapter.wav", "press_j_or_k_to_scroll_books.wav","press_j_or_k_to_scroll_chapters.wav", "press_j_previous_item.wav","press_k_next_item.wav")
 MISC_LOCATION = MY_WAVE_DIR + MISC_DIR
-MISC_SO_LIST = list()
-ks_load.load_sound_objects(MISC_FILENAMES, MISC_LOCATION, MISC_SO_LIST)
-MISC_SO_LIST = tuple(MISC_SO_LIST)
+MISC_SO_LIST = ks_load.SoundTable(MISC_FILENAMES, MISC_LOCATION)
 
 # Global Variables of the miscellaneous auditory sound objects
 
-PRESS_SPACE = MISC_SO_LIST[0]
-PRESS_J = MISC_SO_LIST[1]
-PRESS_K = MISC_SO_LIST[2]
-PRESS_L = MISC_SO_LIST[3]
-PRESS_SC = MISC_SO_LIST[4]
-PRESS_L_AGAIN = MISC_SO_LIST[5]
-PRESS_SC_AGAIN = MISC_SO_LIST[6]
-EXITING_PROGRAM = MISC_SO_LIST[7]
-NOT_AVAILABLE = MISC_SO_LIST[8]
-YOU_SELECTED = MISC_SO_LIST[9]
-SELECT_BOOK = MISC_SO_LIST[10]
-SELECT_CHAPTER = MISC_SO_LIST[11]
-SELECT_PAGE = MISC_SO_LIST[12]
-QUIT_MESSAGE = MISC_SO_LIST[13]
-CONTINUE_READING = MISC_SO_LIST[14]
-PRESS_J_PREVIOUS_MENU = MISC_SO_LIST[15]
-SELECT_ANOTHER_CHAPTER = MISC_SO_LIST[16]
-PRESS_SC_J_TO_GO_BACK = MISC_SO_LIST[17]
-PRESS_SPACE_SELECT_BOOK = MISC_SO_LIST[18]
-PRESS_SPACE_SELECT_CHAPTER = MISC_SO_LIST[19]
-SCROLL_BOOK = MISC_SO_LIST[20]
-SCROLL_CHAPTER = MISC_SO_LIST[21]
-PREVIOUS_ITEM = MISC_SO_LIST[22]
-NEXT_ITEM = MISC_SO_LIST[23]
+PRESS_SPACE = MISC_SO_LIST.ref(0)
+PRESS_J = MISC_SO_LIST.ref(1)
+PRESS_K = MISC_SO_LIST.ref(2)
+PRESS_L = MISC_SO_LIST.ref(3)
+PRESS_SC = MISC_SO_LIST.ref(4)
+PRESS_L_AGAIN = MISC_SO_LIST.ref(5)
+PRESS_SC_AGAIN = MISC_SO_LIST.ref(6)
+EXITING_PROGRAM = MISC_SO_LIST.ref(7)
+NOT_AVAILABLE = MISC_SO_LIST.ref(8)
+YOU_SELECTED = MISC_SO_LIST.ref(9)
+SELECT_BOOK = MISC_SO_LIST.ref(10)
+SELECT_CHAPTER = MISC_SO_LIST.ref(11)
+SELECT_PAGE = MISC_SO_LIST.ref(12)
+QUIT_MESSAGE = MISC_SO_LIST.ref(13)
+CONTINUE_READING = MISC_SO_LIST.ref(14)
+PRESS_J_PREVIOUS_MENU = MISC_SO_LIST.ref(15)
+SELECT_ANOTHER_CHAPTER = MISC_SO_LIST.ref(16)
+PRESS_SC_J_TO_GO_BACK = MISC_SO_LIST.ref(17)
+PRESS_SPACE_SELECT_BOOK = MISC_SO_LIST.ref(18)
+PRESS_SPACE_SELECT_CHAPTER = MISC_SO_LIST.ref(19)
+SCROLL_BOOK = MISC_SO_LIST.ref(20)
+SCROLL_CHAPTER = MISC_SO_LIST.ref(21)
+PREVIOUS_ITEM = MISC_SO_LIST.ref(22)
+NEXT_ITEM = MISC_SO_LIST.ref(23)
 # For additional global variables, see GLOBAL.py
 
 
@@ -179,24 +181,17 @@ def play_current_state(state, sound_q):
 def play_help(state, sound_q):
     if (state == 0):
         # User in "BOOK SELECTION STATE", precede help messages with 'Select book'\
-        sound_q.put(SELECT_BOOK)
-        sound_q.put(SCROLL_BOOK)
-        sound_q.put(PRESS_L)
-        sound_q.put(PRESS_SC)
-        sound_q.put(PRESS_SPACE_SELECT_BOOK)
+        sequence = [SELECT_BOOK, SCROLL_BOOK, PRESS_L, PRESS_SC, PRESS_SPACE_SELECT_BOOK]
     elif (state == 1):
         # User in "CHAPTER SELECTION STATE", precede help messages with just 'SELECT CHAPTER'
-        sound_q.put(SELECT_CHAPTER)
-        sound_q.put(SCROLL_CHAPTER)
-        sound_q.put(PRESS_L)
-        sound_q.put(PRESS_SC)
-        sound_q.put(PRESS_SPACE_SELECT_CHAPTER)
+        sequence = [SELECT_CHAPTER, SCROLL_CHAPTER, PRESS_L, PRESS_SC, PRESS_SPACE_SELECT_CHAPTER]
     elif (state == 2):
         # User in "CONTINUE READING STATE" , play usual help_messages
-        sound_q.put(PREVIOUS_ITEM)
-        sound_q.put(NEXT_ITEM)
-        sound_q.put(PRESS_L)
-        sound_q.put(PRESS_SC)
+        sequence = [PREVIOUS_ITEM, NEXT_ITEM, PRESS_L, PRESS_SC]
+    else:
+        sequence = []
+    # Played as one sound, if it can be (see ks_compose.py).
+    sound_q.put_many(ks_compose.compose(sequence, sound_q))
 
 ################################################################################
 # Plays the complete Introductory Help Message of the user
@@ -205,11 +200,8 @@ def play_help(state, sound_q):
 # preceded with just 'Select Book'
 ################################################################################
 def play_intro(sound_q):
-    sound_q.put(SELECT_BOOK)
-    sound_q.put(SCROLL_BOOK)
-    sound_q.put(PRESS_L)
-    sound_q.put(PRESS_SC)
-    sound_q.put(PRESS_SPACE_SELECT_BOOK)
+    sound_q.put_many(ks_compose.compose([SELECT_BOOK, SCROLL_BOOK, PRESS_L, PRESS_SC,
+                                         PRESS_SPACE_SELECT_BOOK], sound_q))
 
 
 ################################################################################
@@ -219,9 +211,9 @@ def play_intro(sound_q):
 def play_read_items(bookNumber, chapterNumber, sound_q):
     sound_q.put(CONTINUE_READING)
     sound_q.put(BOOK_NUMBER_SO_LIST[bookNumber])
-    # Put all of the text for the chapter 2 on the play-queue.
-    for s_obj in ks_GLOBAL.READ_ITEM_SO_LIST:
-        sound_q.put(s_obj)
+    # Load all of the text for the chapter 2 as the playlist, and play it.
+    # (The J and K keys then move around in it, see keystroke_processor().)
+    sound_q.load_playlist(ks_GLOBAL.READ_ITEM_SO_LIST)
 
 def write_file(begin, elapsed,keyStrokes,ksNumber):
 
@@ -234,13 +226,11 @@ def write_file(begin, elapsed,keyStrokes,ksNumber):
 ################################################################################
 # Function to process user input. (This is a "producer".)
 # Catch the keystrokes from the user, and process the keystrokes.
-# Inputs: sound_q: a JoinableQueue of sound-objects.
+# Inputs: sound_q: a SoundQueue of sound-objects (see ks_play.py).
 #         log_q: a JoinableQueue for capturing timestamped events.
-#         hold_q_e: a stop-modifying-the-queue multiprocessing.Event
-#         stop_play_e: a stop-playing-sounds multiprocessing.Event
 ################################################################################
 
-def keystroke_processor(sound_q, log_q, hold_q_e, stop_play_e):
+def keystroke_processor(sound_q, log_q):
 
     # Initialize the current system state and the book, chapter, read_item variables
     # system state: 0 when the system is at the "START" state and also in
@@ -262,6 +252,7 @@ def keystroke_processor(sound_q, log_q, hold_q_e, stop_play_e):
 
         # Wait for the next keystroke.
         key = readchar.readkey()
+        ks_trace.key_pressed(sound_q.trace_q)
 
 
         # Process each keystroke as specified here.
@@ -271,6 +262,7 @@ def keystroke_processor(sound_q, log_q, hold_q_e, stop_play_e):
             keystrokes += str(key)
             keystrokes += "\n"
             ksNumber += 1
+            ks_trace.stamp(sound_q.trace_q, ks_trace.DISPATCH)
             systemState += 1
             # if user is in now in the read_items state, play the "Continue to read,
             # <Book_title> <read_items_of_chapter 2>..."
@@ -278,14 +270,14 @@ def keystroke_processor(sound_q, log_q, hold_q_e, stop_play_e):
                 # if user selects chapter 2
                 if (chapterNumber == 1):
                     # Stop any currently playing sounds, and clear the queue.
-                    ks_stop.stop_sounds(sound_q, log_q, hold_q_e, stop_play_e)
+                    ks_stop.stop_sounds(sound_q, log_q)
                     # to continue plaing the read items of chapter 2
                     play_read_items(bookNumber, chapterNumber, sound_q)
                     continue
                 # if user selects any other chapter than chapter 2,
                 else:
                     # Stop any currently playing sounds, and clear the queue.
-                    ks_stop.stop_sounds(sound_q, log_q, hold_q_e, stop_play_e)
+                    ks_stop.stop_sounds(sound_q, log_q)
                     # Play "NOT_AVAILABLE" and "Press <;> and then press <J> to
                     # go to select another chapter"
                     sound_q.put(NOT_AVAILABLE)
@@ -295,7 +287,7 @@ def keystroke_processor(sound_q, log_q, hold_q_e, stop_play_e):
             if (systemState > 2):
                 systemState = 0
             # Stop any currently playing sounds, and clear the queue.
-            ks_stop.stop_sounds(sound_q, log_q, hold_q_e, stop_play_e)
+            ks_stop.stop_sounds(sound_q, log_q)
             # Announce the current state to the user
             play_current_state(systemState, sound_q)
 
@@ -305,6 +297,7 @@ def keystroke_processor(sound_q, log_q, hold_q_e, stop_play_e):
             keystrokes += str(key)
             keystrokes += "\n"
             ksNumber += 1
+            ks_trace.stamp(sound_q.trace_q, ks_trace.DISPATCH)
             # if user in BOOK SELECTION STATE, decrement the bookNumber
             if (systemState == 0):
                 bookNumber -= 1
@@ -312,7 +305,7 @@ def keystroke_processor(sound_q, log_q, hold_q_e, stop_play_e):
                 if(bookNumber < 0):
                     bookNumber = 1
                 # Stop any currently playing sounds, and clear the queue.
-                ks_stop.stop_sounds(sound_q, log_q, hold_q_e, stop_play_e)
+                ks_stop.stop_sounds(sound_q, log_q)
                 # Put current book's name in the play-queue.
                 sound_q.put(BOOK_NUMBER_SO_LIST[bookNumber])
             # if the user is in the state of "CHAPTER SELECTION STATE" then decrease
@@ -323,7 +316,7 @@ def keystroke_processor(sound_q, log_q, hold_q_e, stop_play_e):
                 if(chapterNumber < 0):
                     chapterNumber = CHAPTER_NUMBER
                 # Stop any currently playing sounds, and clear the queue.
-                ks_stop.stop_sounds(sound_q, log_q, hold_q_e, stop_play_e)
+                ks_stop.stop_sounds(sound_q, log_q)
                 # Put current chapter's name in the play-queue.
                 sound_q.put(ks_GLOBAL.CH_NAME_SO_LIST[chapterNumber])
            # if the user is in the state of CONTINUE READING STATE then user can
@@ -335,10 +328,9 @@ def keystroke_processor(sound_q, log_q, hold_q_e, stop_play_e):
                     if(readItemNumber < 0):
                         readItemNumber = READ_ITEMS_NUMBER
                     # Stop any currently playing sounds, and clear the queue.
-                    ks_stop.stop_sounds(sound_q, log_q, hold_q_e, stop_play_e)
-                    # start reading from the previous read items  in the play-queue.
-                    for s_obj in ks_GLOBAL.READ_ITEM_SO_LIST[readItemNumber:]:
-                        sound_q.put(s_obj)
+                    ks_stop.stop_sounds(sound_q, log_q)
+                    # start reading from the previous read item in the playlist.
+                    sound_q.seek(readItemNumber)
 
         # if user presses <K> : the forward key
         elif (key == 'k' or key == 'K'):
@@ -346,6 +338,7 @@ def keystroke_processor(sound_q, log_q, hold_q_e, stop_play_e):
             keystrokes += str(key)
             keystrokes += "\n"
             ksNumber += 1
+            ks_trace.stamp(sound_q.trace_q, ks_trace.DISPATCH)
             # if user in BOOK SELECTION STATE, increment the bookNumber
             if (systemState == 0):
                 bookNumber += 1
@@ -353,7 +346,7 @@ def keystroke_processor(sound_q, log_q, hold_q_e, stop_play_e):
                 if(bookNumber > 1):
                     bookNumber = 0
                 # Stop any currently playing sounds, and clear the queue.
-                ks_stop.stop_sounds(sound_q, log_q, hold_q_e, stop_play_e)
+                ks_stop.stop_sounds(sound_q, log_q)
                 # Put current book's name in the play-queue.
                 sound_q.put(BOOK_NUMBER_SO_LIST[bookNumber])
             # if the user is in the CHAPTER SELECTION STATE then increase the chapter number
@@ -363,7 +356,7 @@ def keystroke_processor(sound_q, log_q, hold_q_e, stop_play_e):
                 if(chapterNumber > CHAPTER_NUMBER):
                     chapterNumber = 0
                 # Stop any currently playing sounds, and clear the queue.
-                ks_stop.stop_sounds(sound_q, log_q, hold_q_e, stop_play_e)
+                ks_stop.stop_sounds(sound_q, log_q)
                 # Put current chapter's name in the play-queue.
                 sound_q.put(ks_GLOBAL.CH_NAME_SO_LIST[chapterNumber])
            # if the user is in the CONTINUE READING STATE then schroll to next read_items
@@ -375,28 +368,33 @@ def keystroke_processor(sound_q, log_q, hold_q_e, stop_play_e):
                     if(readItemNumber > READ_ITEMS_NUMBER):
                         readItemNumber = 0
                     # Stop any currently playing sounds, and clear the queue.
-                    ks_stop.stop_sounds(sound_q, log_q, hold_q_e, stop_play_e)
-                    # start reading from next read items  in the play-queue.
-                    for s_obj in ks_GLOBAL.READ_ITEM_SO_LIST[readItemNumber:]:
-                        sound_q.put(s_obj)
+                    ks_stop.stop_sounds(sound_q, log_q)
+                    # start reading from the next read item in the playlist.
+                    sound_q.seek(readItemNumber)
 
         # User presses the help key: <L>
         elif (key == 'l' or key == 'L'):
             keystrokes += str(key)
             keystrokes += "\n"
             ksNumber += 1
+            ks_trace.stamp(sound_q.trace_q, ks_trace.DISPATCH)
             # Stop any currently playing sounds, and clear the queue.
-            ks_stop.stop_sounds(sound_q, log_q, hold_q_e, stop_play_e)
+            ks_stop.stop_sounds(sound_q, log_q)
             # play help messages according to the current state
             play_help(systemState, sound_q)
+            # then, if reading chapter 2, carry on reading from the very word
+            #   the help interrupted.
+            if (systemState == 2 and chapterNumber == 1):
+                sound_q.resume()
 
         # User presses QUIT key : <;>
         elif (key == ';'):
             keystrokes += str(key)
             keystrokes += "\n"
             ksNumber += 1
+            ks_trace.stamp(sound_q.trace_q, ks_trace.DISPATCH)
             # Stop any currently playing sounds, and clear the queue.
-            ks_stop.stop_sounds(sound_q, log_q, hold_q_e, stop_play_e)
+            ks_stop.stop_sounds(sound_q, log_q)
             # if user is in either CHAPTER SELECTION STATE or CONTINUE READING STATE,
             # play "Press <;> again to quit; press <J> To go to the previous menu")
             if (systemState == 1 or systemState == 2):
@@ -408,15 +406,17 @@ def keystroke_processor(sound_q, log_q, hold_q_e, stop_play_e):
                 sound_q.put(PRESS_SC_AGAIN)
             # Wait for the next keystroke.
             key = readchar.readkey()
+            ks_trace.key_pressed(sound_q.trace_q)
             # user presses QUIT key <;> again
             if (key == ';'):
                 keystrokes += str(key)
                 keystrokes += "\n"
                 ksNumber += 1
+                ks_trace.stamp(sound_q.trace_q, ks_trace.DISPATCH)
 
 
                 # Stop any currently playing sounds, and clear the queue.
-                ks_stop.stop_sounds(sound_q, log_q, hold_q_e, stop_play_e)
+                ks_stop.stop_sounds(sound_q, log_q)
                 # Provide a audio prompt for exiting the program
                 sound_q.put(EXITING_PROGRAM)
                 end = time.time()
@@ -427,6 +427,7 @@ def keystroke_processor(sound_q, log_q, hold_q_e, stop_play_e):
                 keystrokes += str(key)
                 keystrokes += "\n"
                 ksNumber += 1
+                ks_trace.stamp(sound_q.trace_q, ks_trace.DISPATCH)
                 # if user is in either CHAPTER SELECTION STATE or CONTINUE READING STATE,
                 # lead the user to previous state, and instruct what to select"
                 # for example, if user is in CONTINUE READING STATE, this <J> key will take
@@ -434,7 +435,7 @@ def keystroke_processor(sound_q, log_q, hold_q_e, stop_play_e):
                 if (systemState == 1 or systemState == 2):
                     systemState -= 1
                     # Stop any currently playing sounds, and clear the queue.
-                    ks_stop.stop_sounds(sound_q, log_q, hold_q_e, stop_play_e)
+                    ks_stop.stop_sounds(sound_q, log_q)
                     # Announce the current state to the user
                     play_current_state(systemState, sound_q)
             ## resolved the matter 2. Funtionality "Some keypresses resulted in no response, such as pressing a non-semi-colon after pressing the semicolon to quit"
@@ -443,8 +444,9 @@ def keystroke_processor(sound_q, log_q, hold_q_e, stop_play_e):
                 keystrokes += str(key)
                 keystrokes += "\n"
                 ksNumber += 1
+                ks_trace.stamp(sound_q.trace_q, ks_trace.DISPATCH)
                 # Stop any currently playing sounds, and clear the queue.
-                ks_stop.stop_sounds(sound_q, log_q, hold_q_e, stop_play_e)
+                ks_stop.stop_sounds(sound_q, log_q)
                 # play help messages according to the current state
                 sound_q.put(PRESS_L)
 
@@ -452,6 +454,7 @@ def keystroke_processor(sound_q, log_q, hold_q_e, stop_play_e):
         else:
             # Wait for the next keystroke.
             key = readchar.readkey()
+            ks_trace.key_pressed(sound_q.trace_q)
 
 ################################################################################
 # Set up and start the program.
@@ -464,40 +467,75 @@ if __name__ == '__main__':
     # Load sounds.
     # ks_load.load_sounds()
 
-    # Create a sound-objects-to-play queue.
-    sound_queue = multiprocessing.JoinableQueue()
+    # How to start the play_sounds() process (see ks_launch.py). With "fork" or
+    #   "forkserver", every sound is loaded first, here, so that the process
+    #   starts with them all and never loads (or copies) any of them itself.
+    # With "thread", play_sounds() runs in a thread of this process instead,
+    #   sharing the sounds, with no second process at all.
+    # (This comes first: the queues below must be made for the chosen method.)
+    # The var is initialized to 'None' to use the platform's default start method.
+    # launch_method = "fork"
+    # launch_method = "thread"
+    launch_method = None
+    ks_launch.use(launch_method)
+
+    # Create a latency-trace queue, to time each keystroke through to its sound.
+    # (The 50th, 95th and 99th percentiles are printed at the end, see ks_trace.py.)
+    # The var is initialized to 'None' to turn the tracing off.
+    # trace_queue = ks_launch.joinable_queue()
+    trace_queue = None
+
+    # Create a sound-ids-to-play queue.
+    sound_queue = ks_launch.sound_queue(trace_queue)
 
     # Create a timestamp-log queue.
     # (If logging is to be done, it must be done with a JoinableQueue() because
     #   there is no way to directly recturn data from the play_sounds() subprocess.)
     # The var is initialized to 'None' to suppress the logging.
-    # log_queue = multiprocessing.JoinableQueue()
+    # log_queue = ks_launch.joinable_queue()
     log_queue = None
 
-    # Create a "hold the queue" message-passing event.
-    # Permits the keystroke-catching process to tell the sound-playing process to
-    #   temporarily stop removing items from the queue.
-    hold_queue_e = multiprocessing.Event()
-
-    # Create a "stop-playing" message-passing event.
-    # Permits the keystroke-catching process to tell the sound-playing process to
-    #   stop playing a sound that may be playing.
-    stop_playing_e = multiprocessing.Event()
-
-    # Launch the play_sounds() consumer process in a second process.
-    cons_p1 = multiprocessing.Process(target=ks_play.play_sounds,
-                                      args=(sound_queue, log_queue, hold_queue_e, stop_playing_e))
+    # Continuous playback: play back-to-back sounds gaplessly, through one output
+    #   stream, feeding the stream this many sounds ahead. (Needs sounddevice.)
+    # The var is initialized to 'None' to play each sound on its own instead.
+    # prefetch_depth = 2
+    prefetch_depth = None
+
+    # Decode-ahead: while each sentence of a playlist plays, get this many of
+    #   the next ones ready on a background thread (see ks_play.Prefetcher).
+    # The var is initialized to 'None' to get each sound ready as it is played.
+    # decode_ahead = 3
+    decode_ahead = None
+
+    # Launch the play_sounds() consumer process in a second process (or thread).
+    # Sounds that have been loaded so far are handed over in the registry
+    #   snapshot; sounds loaded later are handed over as they are first played.
+    if launch_method is not None:
+        ks_launch.preload()
+    ks_load.log_load_times(log_queue)
+    cons_p1 = ks_launch.process(ks_play.play_sounds,
+                                args=(sound_queue, log_queue, ks_reg.snapshot(),
+                                      prefetch_depth, decode_ahead))
     cons_p1.daemon = True
     cons_p1.start()
 
     # Start up the keystroke catcher, in the main process, not in a new process.
     # The main program sits on this line until the "break" from keystroke_processor()
-    keystroke_processor(sound_queue, log_queue, hold_queue_e, stop_playing_e)
+    keystroke_processor(sound_queue, log_queue)
 
     # After returning from the keystroke catching and processing loop...
     # Block (stop) this main process until all queue items have be processed by
     #   the consumer process.
     sound_queue.join()
+    # Then tell it to finish, and wait for it to.
+    sound_queue.shutdown()
+    cons_p1.join()
+
+    # Log the time spent loading sounds, those loaded as they were needed included.
+    ks_load.log_load_times(log_queue)
+
+    # Print the keystroke latencies if trace_queue was initialized as a Queue.
+    ks_trace.summary(trace_queue)
 
     # Output the timestamp-log queue if log_queue was initialized as a JoinableQueue.
     ks_log.output_log(log_queue)
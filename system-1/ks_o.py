@@ -6,21 +6,82 @@
 ################################################################################
 
 # Packages
+import os
 import simpleaudio # simpleaudio-1.0.2
 
+# Local imports - "ks" stands for "key_sounds".
+import ks_pcm
+import ks_reg
+
 ################################################################################
 # A sound_object has the following member variables:
 #   waveobject: a simpleaudio WaveObject, which can get played with play()
 #   name: a string of the filename (including the ".wav" extension)
+#   id: the sound's id in the sound registry (see ks_reg.py)
+#   num_channels, bytes_per_sample, sample_rate, num_frames: the audio format
+#   pcm: the (path, offset, nbytes) region of the PCM arena holding the audio
+#        (None if the sound is lazily loaded)
+#   filepath: the path of the wave file on disk
+# The audio is decoded once into the shared PCM arena (see ks_pcm.py). A
+#   sound_object holds only the region, so it pickles to a few bytes, and the
+#   waveobject plays straight out of the arena without copying.
+# If lazy loading is turned on (ks_pcm.LAZY_BUDGET), only the wave header is
+#   read here, and the audio is decoded on the first play() or prefetch().
+# If the audio is passed in, already decoded (e.g. by ks_pcm.load_waves()),
+#   the wave file is not read at all.
 ################################################################################
 
 class sound_object:
 
-    def __init__(self, path, filename):
-        # Create a simpleaudio.WaveObject for playing the sound using the filename.
-        self.waveobject = simpleaudio.WaveObject.from_wave_file(path + filename)
+    def __init__(self, path, filename, audio=None):
+        self.filepath = os.path.join(path, filename)
+        if audio is not None:
+            # Already decoded: (num_channels, bytes_per_sample, sample_rate, num_frames, pcm)
+            (self.num_channels, self.bytes_per_sample, self.sample_rate,
+                self.num_frames, self.pcm) = audio
+        elif ks_pcm.LAZY_BUDGET is None:
+            # Decode the wave file into the shared PCM arena.
+            (self.num_channels, self.bytes_per_sample, self.sample_rate,
+                self.num_frames, self.pcm) = ks_pcm.load_wave(self.filepath)
+        else:
+            # Just read the format; the audio is decoded when it is needed.
+            (self.num_channels, self.bytes_per_sample, self.sample_rate,
+                self.num_frames) = ks_pcm.read_header(self.filepath)
+            self.pcm = None
         # object name
         self.name = filename # For tracing and debugging.
+        # Register the sound; only this id gets sent to the play_sounds() process.
+        self.id = ks_reg.register(self)
+
+    # A simpleaudio.WaveObject for playing the sound, straight out of the arena.
+    @property
+    def waveobject(self):
+        return self.waveobject_from(0)
+
+    # A simpleaudio.WaveObject for playing the sound from a frame onwards.
+    def waveobject_from(self, frame):
+        return simpleaudio.WaveObject(self.audio_data(frame), self.num_channels,
+                                      self.bytes_per_sample, self.sample_rate)
+
+    # A zero-copy memoryview of the decoded audio, from a frame onwards.
+    def audio_data(self, frame=0):
+        if self.pcm is None:
+            audio = memoryview(ks_pcm.cache().get(self.filepath))
+        else:
+            audio = ks_pcm.view(*self.pcm)
+        return audio[frame * self.num_channels * self.bytes_per_sample:]
+
+    # Decode a lazily loaded sound ahead of playing it (or, if it is already
+    #   decoded, read its audio into memory, see ks_pcm.warm()).
+    def prefetch(self):
+        if self.pcm is None:
+            ks_pcm.cache().get(self.filepath)
+        else:
+            ks_pcm.warm(*self.pcm)
+
+    # The length of the sound, from a frame onwards, in seconds.
+    def duration(self, frame=0):
+        return (self.num_frames - frame) / self.sample_rate
 
 ################################################################################
 # Student-defined classes below.
@@ -0,0 +1,474 @@
+################################################################################
+# ks_pcm - The shared PCM arena, where the decoded audio of every sound lives.
+################################################################################
+# Used by ks_main.py, a program that uses keystrokes to play wave files.
+#
+# The keystroke process and the play_sounds() process both need the decoded
+#   audio. Rather than each process holding its own copy, the audio is decoded
+#   once, into the arena, and each sound_object holds only a (path, offset,
+#   nbytes) region of it. The arena is a set of memory-mapped files ("segments"),
+#   so every process that maps a segment shares the same pages: resident memory
+#   stays at one copy of each sound, however many times it is queued.
+#
+# With the "fork" start method the play_sounds() process inherits the mappings.
+#   With "spawn" it maps each segment, read-only, the first time it plays a
+#   sound from it (see view()).
+#
+# Lazy loading. If LAZY_BUDGET is set, sounds are not decoded when they are
+#   created: only the wave header is read (see read_header()). The audio is
+#   decoded the first time the sound is played or prefetched, by whichever
+#   process does so, and kept in a PCMCache. Once the cache holds more than
+#   LAZY_BUDGET bytes, the least-recently-played sounds are dropped from it
+#   (and decoded again if they are ever played again).
+#
+# Parallel loading. load_waves() decodes a whole list of wave files at once, on
+#   a pool of threads (reading a file lets other threads run), and then stores
+#   them in the arena one by one, in the order they were listed, so the result
+#   does not depend on which thread finished first.
+#
+# Deduplication. The arena stores each distinct piece of audio only once: it
+#   keeps a content hash of everything stored in it, and a sound whose decoded
+#   audio is byte-for-byte the same as one already stored (the same file loaded
+#   twice, or a copy of it under another name, or in another book) just gets
+#   the same region. So memory grows with the distinct audio, not with the
+#   number of sounds. PCMArena.shared and .saved count what this saved.
+#
+# Freeing. A region can be given back with free(), once no sound uses it (see
+#   release(), and SoundQueue.release() in ks_play.py). Each region counts the
+#   sounds stored in it, and once the last one is freed, its pages are handed
+#   back to the system (on Linux), and the space is reused by the next sound
+#   stored that fits in it.
+#
+# Format. If ks_norm.CANONICAL_FORMAT is set, every wave file is converted to
+#   it as it is decoded (see ks_norm.py), and read_header() reports the format
+#   and length it will have once converted. So every sound_object, and every
+#   region of the arena, is in the one format.
+#
+# Trimming. If a wave file has trim points (see ks_trim.py), only the audio
+#   between them is decoded into the arena, and read_header() reports the
+#   trimmed length.
+#
+# Loudness. If ks_gain.TARGET_DB is set, each sound that has been measured
+#   (see ks_gain.py) is scaled to that loudness, once, as it is decoded.
+################################################################################
+
+# Packages
+import atexit
+import collections
+import concurrent.futures
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+import time
+import wave
+
+# Local imports - "ks" stands for "key_sounds".
+import ks_gain
+import ks_norm
+import ks_trim
+
+# Size of each arena segment, in bytes. A sound bigger than this gets a
+#   segment of its own. (Pages are only used once audio is written to them.)
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+# Where the segment files go. /dev/shm keeps them in memory on Linux.
+ARENA_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+# The memory-mapped segments this process has open, keyed by path.
+MAPS = dict()
+
+# This process's arena, created by arena() when the first sound is loaded.
+ARENA = None
+
+# Lazy loading budget, in bytes, or None to decode every sound as it is created.
+# E.g. LAZY_BUDGET = 32 * 1024 * 1024 keeps at most 32 MB of decoded audio.
+LAZY_BUDGET = None
+
+# This process's cache of lazily loaded audio, created by cache().
+CACHE = None
+
+# How many threads load_waves() decodes on; None for Python's default (which
+#   goes by the number of CPUs), or 1 to decode one file after another.
+LOAD_WORKERS = None
+
+# The time it took to decode each file, as a list of (filename, seconds), and
+#   the time each whole load_waves() call took, as a list of seconds.
+LOAD_TIMES = list()
+LOAD_TOTALS = list()
+
+################################################################################
+# PCMArena - Allocates regions of the memory-mapped segments.
+# store() copies some audio into the arena and returns the region it went to,
+#   or, if the same audio is already in the arena, just returns its region.
+# Only the process that created the arena writes to it, and only that process
+#   removes the segment files when it exits.
+################################################################################
+class PCMArena:
+
+    def __init__(self, segment_size=SEGMENT_SIZE):
+        self.segment_size = segment_size
+        self.prefix = os.path.join(ARENA_DIR, "ks_pcm_{}_".format(os.getpid()))
+        self.pid = os.getpid()
+        self.segments = list()  # paths of the segment files, in order
+        self.used = 0           # bytes used in the last segment
+        self.regions = dict()   # content hash -> region, of everything stored
+        self.shared = 0         # how many times stored audio was reused
+        self.saved = 0          # bytes not stored, because they were reused
+        self.refs = dict()      # region -> [content hash, sounds stored in it]
+        self.holes = list()     # (path, offset, size) of the freed space, in order
+        self.freed = 0          # bytes freed
+        atexit.register(self.close)
+
+    # digest: the content_hash() of data, if it has already been worked out.
+    def store(self, data, digest=None):
+        if digest is None:
+            digest = content_hash(data)
+        region = self.regions.get(digest)
+        if region is not None:
+            self.shared += 1
+            self.saved += len(data)
+            self.refs[region][1] += 1
+            return region
+
+        nbytes = len(data)
+        # Keep every region 8-byte aligned.
+        size = (nbytes + 7) & ~7
+        hole = self.fill(size)
+        if hole is not None:
+            path, offset = hole
+        else:
+            if not self.segments or self.used + nbytes > len(MAPS[self.segments[-1]]):
+                self.new_segment(max(self.segment_size, nbytes))
+            path = self.segments[-1]
+            offset = self.used
+            self.used += size
+        MAPS[path][offset:offset + nbytes] = data
+        region = (path, offset, nbytes)
+        self.regions[digest] = region
+        self.refs[region] = [digest, 1]
+        return region
+
+    # Take size bytes from the first freed space big enough, and return its
+    #   (path, offset), or None if there is none.
+    def fill(self, size):
+        for i, (path, offset, hole_size) in enumerate(self.holes):
+            if hole_size >= size:
+                if hole_size == size:
+                    del self.holes[i]
+                else:
+                    self.holes[i] = (path, offset + size, hole_size - size)
+                return path, offset
+        return None
+
+    # One sound stored in a region no longer uses it. Once none do, the space
+    #   is freed. (A region that is not in the arena, e.g. of a bundle, is left.)
+    def free(self, region):
+        ref = self.refs.get(region)
+        if ref is None:
+            return
+        ref[1] -= 1
+        if ref[1]:
+            return
+        del self.refs[region]
+        del self.regions[ref[0]]
+        path, offset, nbytes = region
+        self.freed += nbytes
+
+        # Add the space to the holes, joined up with any next to it.
+        hole = (path, offset, (nbytes + 7) & ~7)
+        holes = list()
+        for other in self.holes:
+            if other[0] == path and other[1] + other[2] == hole[1]:
+                hole = (path, other[1], other[2] + hole[2])
+            elif other[0] == path and hole[1] + hole[2] == other[1]:
+                hole = (path, hole[1], hole[2] + other[2])
+            else:
+                holes.append(other)
+        holes.append(hole)
+        self.holes = sorted(holes)
+
+        # Hand the whole pages in it back to the system. (They read as zeros
+        #   until they are written to again.)
+        path, offset, size = hole
+        start = -(-offset // mmap.PAGESIZE) * mmap.PAGESIZE
+        end = (offset + size) // mmap.PAGESIZE * mmap.PAGESIZE
+        if end > start and hasattr(mmap, "MADV_REMOVE"):
+            try:
+                MAPS[path].madvise(mmap.MADV_REMOVE, start, end - start)
+            except OSError:
+                pass
+
+    def new_segment(self, size):
+        path = self.prefix + str(len(self.segments))
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_RDWR, 0o600)
+        try:
+            os.ftruncate(fd, size)
+            MAPS[path] = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.segments.append(path)
+        self.used = 0
+
+    def close(self):
+        if os.getpid() != self.pid:
+            return
+        for path in self.segments:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+################################################################################
+# content_hash() - A hash of some audio, to tell identical audio apart.
+################################################################################
+def content_hash(data):
+    return hashlib.blake2b(data, digest_size=20).digest()
+
+################################################################################
+# arena() - This process's PCMArena, created the first time it is needed.
+################################################################################
+def arena():
+    global ARENA
+    if ARENA is None:
+        ARENA = PCMArena()
+    return ARENA
+
+################################################################################
+# release() - Let go of the audio of a sound that is no longer used: free its
+#   region of the arena, or, if it is loaded lazily (region is None), drop it
+#   from the cache. (Only the process that made the arena frees its regions;
+#   see PCMArena.)
+# Input parameters: region, filename: the sound's pcm and filepath.
+################################################################################
+def release(region, filename):
+    if region is None:
+        if CACHE is not None:
+            CACHE.discard(filename)
+    elif ARENA is not None and ARENA.pid == os.getpid():
+        ARENA.free(region)
+
+################################################################################
+# view() - A zero-copy memoryview of a region of the arena.
+# Input parameters: path, offset, nbytes: the region, as returned by store().
+# Maps the segment (read-only) if this process has not mapped it yet.
+################################################################################
+def view(path, offset, nbytes):
+    segment = MAPS.get(path)
+    if segment is None:
+        with open(path, "rb") as f:
+            segment = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        MAPS[path] = segment
+    return memoryview(segment)[offset:offset + nbytes]
+
+################################################################################
+# warm() - Read a region (of the arena, or of a bundle) into memory ahead of
+#   playing it, so that playing it does not wait on the disk. Touches one byte
+#   of every page of it.
+################################################################################
+def warm(path, offset, nbytes):
+    view(path, offset, nbytes)[::mmap.PAGESIZE].tobytes()
+
+################################################################################
+# load_wave() - Decode a wave file into the arena.
+# Returns a tuple: (num_channels, bytes_per_sample, sample_rate, num_frames, region)
+#   where region is the (path, offset, nbytes) the audio was stored in.
+################################################################################
+def load_wave(filename):
+    (num_channels, bytes_per_sample, sample_rate, num_frames, frames,
+        digest, seconds) = decode(filename, lazy=False)
+    return (num_channels, bytes_per_sample, sample_rate, num_frames,
+            arena().store(frames, digest))
+
+################################################################################
+# read_header() - Read just the format of a wave file, without decoding it.
+# Returns a tuple: (num_channels, bytes_per_sample, sample_rate, num_frames)
+#   of the audio as it will be decoded (trimmed, and converted to
+#   ks_norm.CANONICAL_FORMAT).
+################################################################################
+def read_header(filename):
+    wave_read = wave.open(filename, "rb")
+    try:
+        sample_rate = wave_read.getframerate()
+        num_frames = wave_read.getnframes()
+        trim = ks_trim.points(filename)
+        if trim is not None:
+            num_frames = trim[1] - trim[0]
+        num_channels, bytes_per_sample, to_rate = ks_norm.target(
+            (wave_read.getnchannels(), wave_read.getsampwidth(), sample_rate))
+        return (num_channels, bytes_per_sample, to_rate,
+                ks_norm.frame_count(num_frames, sample_rate, to_rate))
+    finally:
+        wave_read.close()
+
+################################################################################
+# settings() - What decode() and read_header() make of the wave files in some
+#   directories, besides the files themselves: the canonical format, the trim
+#   sidecar of each directory (see ks_trim.py), and the target loudness and
+#   its sidecar (see ks_gain.py). Each sidecar goes by its modification time
+#   (None if there is none).
+# Input parameters: top: a directory; directories: the directories the files
+#   are in, relative to top.
+# Returns them in a form that can be saved as JSON, and compared as read back,
+#   to tell if anything decoded with them is out of date.
+################################################################################
+def settings(top, directories):
+    def mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    fmt = ks_norm.CANONICAL_FORMAT
+    return {"format": None if fmt is None else list(fmt),
+            "trim": ks_trim.TRIM_SILENCE and {
+                d: mtime(os.path.join(top, d, ks_trim.SIDECAR_NAME)) for d in sorted(directories)},
+            "gain": None if ks_gain.TARGET_DB is None else [
+                ks_gain.TARGET_DB, ks_gain.MAX_GAIN_DB, mtime(ks_gain.SIDECAR_PATH)]}
+
+################################################################################
+# read_frames() - Decode a wave file into a bytes object (not into the arena).
+# A trimmed file is decoded as a slice of all of its audio (see decode()), so
+#   the slice is copied: whatever keeps the result (a PCMCache) keeps only the
+#   trimmed audio, and holds just as many bytes as it counts.
+################################################################################
+def read_frames(filename):
+    frames = decode(filename, lazy=False)[4]
+    return bytes(frames) if isinstance(frames, memoryview) else frames
+
+################################################################################
+# decode() - Decode a wave file, or just read its header if loading is lazy.
+# Returns a tuple:
+#   (num_channels, bytes_per_sample, sample_rate, num_frames, frames, digest, seconds)
+#   where frames (and its content_hash(), digest) is None if loading is lazy,
+#   and seconds is how long it took. The audio is trimmed (see ks_trim.py),
+#   converted to ks_norm.CANONICAL_FORMAT, if one is set, and brought to
+#   ks_gain.TARGET_DB, if one is set.
+# Runs on one of load_waves()'s threads, so it does not touch the arena. (The
+#   hashing and converting are done here too, so they are spread over the threads.)
+################################################################################
+def decode(filename, lazy=None):
+    if lazy is None:
+        lazy = LAZY_BUDGET is not None
+    if lazy:
+        start = time.perf_counter()
+        return read_header(filename) + (None, None, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    wave_read = wave.open(filename, "rb")
+    try:
+        fmt = (wave_read.getnchannels(), wave_read.getsampwidth(), wave_read.getframerate())
+        frames = wave_read.readframes(wave_read.getnframes())
+    finally:
+        wave_read.close()
+    digest = content_hash(frames)
+    gain_db = ks_gain.gain(digest)
+    trim = ks_trim.points(filename)
+    if trim is not None:
+        # A zero-copy slice; the arena (or the cache) takes just this part.
+        frame_size = fmt[0] * fmt[1]
+        frames = memoryview(frames)[trim[0] * frame_size:trim[1] * frame_size]
+        digest = content_hash(frames)
+    decoded = frames
+    fmt, frames = ks_norm.normalise(filename, fmt, frames, digest)
+    if gain_db is not None:
+        frames = ks_gain.apply(frames, fmt, gain_db)
+    if frames is not decoded:
+        # The arena goes by the audio it actually holds.
+        digest = content_hash(frames)
+    num_channels, bytes_per_sample, sample_rate = fmt
+    num_frames = len(frames) // (num_channels * bytes_per_sample)
+    return (num_channels, bytes_per_sample, sample_rate, num_frames, frames, digest,
+            time.perf_counter() - start)
+
+################################################################################
+# load_waves() - Decode a list of wave files into the arena, in parallel.
+# Returns a list with a tuple for each file, in the same order:
+#   (num_channels, bytes_per_sample, sample_rate, num_frames, region)
+#   like load_wave() (region is None if loading is lazy).
+# The times taken are added to LOAD_TIMES and LOAD_TOTALS.
+################################################################################
+def load_waves(filenames):
+    start = time.perf_counter()
+    loaded = list()
+    with concurrent.futures.ThreadPoolExecutor(LOAD_WORKERS) as pool:
+        # map() hands the results back in order, as they come in.
+        for filename, decoded in zip(filenames, pool.map(decode, filenames)):
+            (num_channels, bytes_per_sample, sample_rate, num_frames, frames,
+                digest, seconds) = decoded
+            LOAD_TIMES.append((filename, seconds))
+            region = None if frames is None else arena().store(frames, digest)
+            loaded.append((num_channels, bytes_per_sample, sample_rate, num_frames, region))
+    LOAD_TOTALS.append(time.perf_counter() - start)
+    return loaded
+
+################################################################################
+# PCMCache - Lazily decoded audio, keyed by filename, least-recently-played first.
+# get() returns the decoded audio of a file, decoding it if it is not cached.
+#   Each get() counts as a play, and moves the file to the back of the line.
+# When more than budget bytes are cached, files are dropped from the front of
+#   the line. The newest file is always kept, even if it alone is over budget.
+#   (A sound that is playing when it gets dropped plays to the end, because
+#   the memoryview being played keeps its audio alive.)
+# get() may be called from more than one thread (see ks_play.Prefetcher). A
+#   file being decoded by one thread is waited for, not decoded again; but the
+#   lock is only held to look files up, never while decoding, so getting a
+#   file that is cached never waits on another file being decoded.
+################################################################################
+class PCMCache:
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.buffers = collections.OrderedDict()
+        self.size = 0   # bytes cached
+        self.lock = threading.Lock()
+        self.loading = dict()   # filename -> Event set once it is decoded
+
+    def get(self, filename):
+        while True:
+            with self.lock:
+                frames = self.buffers.get(filename)
+                if frames is not None:
+                    self.buffers.move_to_end(filename)
+                    return frames
+                loading = self.loading.get(filename)
+                if loading is None:
+                    # Nobody is decoding it: decode it here.
+                    loading = self.loading[filename] = threading.Event()
+                    break
+            # Somebody is: wait for them, and look again.
+            loading.wait()
+
+        try:
+            frames = read_frames(filename)
+            with self.lock:
+                self.buffers[filename] = frames
+                self.size += len(frames)
+                self.evict()
+        finally:
+            with self.lock:
+                del self.loading[filename]
+            loading.set()
+        return frames
+
+    def evict(self):
+        while self.size > self.budget and len(self.buffers) > 1:
+            filename, frames = self.buffers.popitem(last=False)
+            self.size -= len(frames)
+
+    # Drop a file from the cache, if it is in it.
+    def discard(self, filename):
+        with self.lock:
+            frames = self.buffers.pop(filename, None)
+            if frames is not None:
+                self.size -= len(frames)
+
+################################################################################
+# cache() - This process's PCMCache, created the first time it is needed.
+################################################################################
+def cache():
+    global CACHE
+    if CACHE is None:
+        CACHE = PCMCache(LAZY_BUDGET)
+    return CACHE
@@ -0,0 +1,91 @@
+################################################################################
+# ks_reg - The sound registry.
+################################################################################
+# Used by ks_main.py, a program that uses keystrokes to play wave files.
+#
+# Every sound_object is registered here when it is created, and is given a
+#   small integer id: its position in the registry. The keystroke process puts
+#   only these ids on the play-queue, and the play_sounds() process looks them
+#   up in its own copy of the registry. The audio itself is never pickled and
+#   sent through the queue, so a keypress costs a few bytes of IPC, not the
+#   megabytes of a long wave file.
+#
+# The registry is built at startup, before the play_sounds() process is
+#   launched. A snapshot() of it is passed to play_sounds(), which install()s
+#   it. (With the "fork" start method the child already has the registry and
+#   nothing gets copied; with "spawn" it is pickled exactly once.)
+#
+# Sounds that are only loaded later (see ks_load.SoundTable) are handed over
+#   as they are needed: before putting anything on the play-queue, the
+#   SoundQueue sends play_sounds() the sounds that are unannounced(), and
+#   play_sounds() adopt()s them into its copy of the registry.
+#
+# Sounds that are unloaded (see Audiobook.unload() in ks_o.py) are release()d,
+#   so the registry does not keep them alive. Their ids are not reused. They
+#   go through the play-queue (see SoundQueue.release() in ks_play.py): the
+#   play_sounds() process releases them when it gets to them, and only then
+#   does the keystroke process.
+################################################################################
+
+# The registry. A sound's id is its index in this list.
+SOUNDS = list()
+
+# How many of the sounds have been handed over to play_sounds().
+ANNOUNCED = 0
+
+################################################################################
+# register() - Add a sound_object to the registry and return its id.
+# Called from sound_object.__init__(), so every sound gets an id as it loads.
+################################################################################
+def register(s_obj):
+    SOUNDS.append(s_obj)
+    return len(SOUNDS) - 1
+
+################################################################################
+# lookup() - Return the sound_object that was registered with sound_id.
+################################################################################
+def lookup(sound_id):
+    return SOUNDS[sound_id]
+
+################################################################################
+# snapshot() - A copy of the registry to hand to the play_sounds() process.
+################################################################################
+def snapshot():
+    global ANNOUNCED
+    ANNOUNCED = len(SOUNDS)
+    return tuple(SOUNDS)
+
+################################################################################
+# unannounced() - The sounds registered since they were last handed over, as a
+#   tuple (usually empty). They count as handed over once this returns them.
+################################################################################
+def unannounced():
+    global ANNOUNCED
+    sounds = tuple(s for s in SOUNDS[ANNOUNCED:] if s is not None)
+    ANNOUNCED = len(SOUNDS)
+    return sounds
+
+################################################################################
+# adopt() - Add a sound_object that was registered in another process, under
+#   the id it was given there.
+################################################################################
+def adopt(s_obj):
+    if s_obj.id >= len(SOUNDS):
+        SOUNDS.extend([None] * (s_obj.id + 1 - len(SOUNDS)))
+    SOUNDS[s_obj.id] = s_obj
+
+################################################################################
+# release() - Remove some sound_objects from the registry. Looking up the id of
+#   a released sound gives None.
+################################################################################
+def release(sounds):
+    for s_obj in sounds:
+        SOUNDS[s_obj.id] = None
+
+################################################################################
+# install() - Replace this process's registry with a snapshot().
+# Note: The list is "changed in place", and not replaced with a new object,
+#   so that any module holding a reference to SOUNDS sees the change.
+################################################################################
+def install(sounds):
+    SOUNDS[:] = sounds
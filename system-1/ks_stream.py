@@ -0,0 +1,228 @@
+################################################################################
+# ks_stream - A continuous output stream, for gapless playback.
+################################################################################
+# Used by ks_play.py, when play_sounds() is asked for continuous playback.
+#
+# simpleaudio opens a new output stream for every sound it plays, which leaves
+#   an audible gap between one sound and the next. A PCMStream instead keeps
+#   one output stream open, and the audio device pulls the sounds from it
+#   back to back, with no gap and no per-sound setup.
+#
+# The sounds fed to the stream are kept in a ring of zero-copy memoryviews of
+#   their audio, in the order they are to be played. The device's callback
+#   copies from the front of the ring, and drops a sound from the ring once it
+#   has been played through. A sound that was flushed by stop_sounds() (one
+#   whose generation is no longer the queue's generation, see SoundQueue in
+#   ks_play.py) is dropped by the callback too, without being played, so a stop
+#   takes effect at the very next callback.
+#
+# The ring is the narration channel. A stream also has a cue channel, for UI
+#   sounds (see SoundQueue.cue() in ks_play.py): the cues are played one after
+#   another, as the narration is, but mixed in over the narration, which
+#   carries on where it is. While a cue plays, the narration is ducked to
+#   DUCK_GAIN. The mixing is done in
+#   the callback, with NumPy, one device buffer at a time; NumPy is imported
+#   only when the first cue is. Cues are stopped by clear_cues(), the same way
+#   the narration is by stop_sounds(), with their own generation counter.
+#
+# Needs the sounddevice package (and the PortAudio library under it). It is
+#   imported only when a stream is opened, so the programs run without it as
+#   long as continuous playback is not turned on.
+################################################################################
+
+# Packages
+import collections
+import threading
+import time
+
+# Local imports - "ks" stands for "key_sounds".
+import ks_norm
+
+# sounddevice sample formats, by bytes per sample.
+DTYPES = {1: 'uint8', 2: 'int16', 3: 'int24', 4: 'int32'}
+
+# How loud the narration is while a cue plays over it (1.0 to not duck it).
+DUCK_GAIN = 0.3
+
+################################################################################
+# PCMStream - An open output stream, and the ring of sounds it is playing.
+# Inputs: num_channels, bytes_per_sample, sample_rate: the format of the stream.
+#           Every sound fed to it must be in this format.
+#         generation: the play-queue's shared generation counter
+#           (SoundQueue.generation), to tell which sounds have been flushed.
+#         on_start: if given, called as on_start(item, heard_at) when a sound
+#           starts playing, heard_at being the time.monotonic() time it will
+#           be heard. (It is called from the device's thread; keep it short.)
+#         cue_generation: the play-queue's shared cue generation counter
+#           (SoundQueue.cue_generation), to tell which cues have been cleared.
+#           Needed only if cue() is used.
+################################################################################
+class PCMStream:
+
+    def __init__(self, num_channels, bytes_per_sample, sample_rate, generation,
+                 on_start=None, cue_generation=None):
+        import sounddevice
+
+        self.format = (num_channels, bytes_per_sample, sample_rate)
+        self.byte_rate = num_channels * bytes_per_sample * sample_rate
+        # Unsigned 8-bit audio is silent at 128, everything else at 0.
+        self.silence = b'\x80' if bytes_per_sample == 1 else b'\x00'
+        # The raw shared counter, so the callback can read it without a lock.
+        self.generation = generation.get_obj()
+        self.cue_generation = cue_generation and cue_generation.get_obj()
+        # The ring of sounds being played: [item, generation, audio, bytes played]
+        self.ring = collections.deque()
+        # The cues to play over them, in the same form.
+        self.cues = collections.deque()
+        self.numpy = None
+        # Sounds dropped from the ring: (item, time it is done being heard)
+        self.finished = collections.deque()
+        self.lock = threading.Lock()
+        self.on_start = on_start
+
+        self.stream = sounddevice.RawOutputStream(samplerate=sample_rate,
+            channels=num_channels, dtype=DTYPES[bytes_per_sample],
+            latency='low', callback=self.callback)
+        self.stream.start()
+
+    # Add a sound to the end of the ring. item is handed back by collect().
+    def feed(self, item, generation, audio):
+        with self.lock:
+            self.ring.append([item, generation, audio, 0])
+
+    # Add a sound to the end of the cues, to be played over the ring. item is
+    #   handed back by collect().
+    def cue(self, item, generation, audio):
+        if self.numpy is None:
+            # (Imported here, so it is never first imported by the callback.)
+            import numpy
+            self.numpy = numpy
+        with self.lock:
+            self.cues.append([item, generation, audio, 0])
+
+    # Drop the sounds in the ring that test(item) is true of, without playing
+    #   the rest of them. With keep_playing, the sound being played is kept.
+    def drop(self, test, keep_playing=False):
+        with self.lock:
+            ring = collections.deque()
+            for sound in self.ring:
+                if test(sound[0]) and not (keep_playing and sound[3] > 0):
+                    self.finished.append((sound[0], 0))
+                else:
+                    ring.append(sound)
+            self.ring = ring
+
+    # True if test(item) is true of any sound fed to the stream (or cued) that
+    #   has not been collected yet.
+    def holds(self, test):
+        with self.lock:
+            return (any(test(sound[0]) for sound in self.ring) or
+                    any(test(cue[0]) for cue in self.cues) or
+                    any(test(item) for item, done_at in self.finished))
+
+    # The number of sounds in the ring that have not been played through yet.
+    def depth(self):
+        return len(self.ring)
+
+    # True while anything fed to the stream has not been collected yet.
+    def busy(self):
+        return bool(self.ring or self.cues or self.finished)
+
+    # Return the items the stream is done with: played through, or flushed.
+    def collect(self):
+        now = time.monotonic()
+        items = list()
+        with self.lock:
+            self.drop_flushed()
+            while self.finished and self.finished[0][1] <= now:
+                items.append(self.finished.popleft()[0])
+        return items
+
+    # Seconds until the stream is next done with a sound (None if it is idle).
+    def next_due(self):
+        now = time.monotonic()
+        with self.lock:
+            self.drop_flushed()
+            if self.finished:
+                return max(self.finished[0][1] - now, 0)
+            playing = [sounds[0] for sounds in (self.ring, self.cues) if sounds]
+            if playing:
+                return (min(len(audio) - played for item, generation, audio, played in playing)
+                        / self.byte_rate + self.stream.latency)
+        return None
+
+    def close(self):
+        self.stream.stop()
+        self.stream.close()
+
+    # Drop every flushed sound from the ring, and every cleared cue.
+    #   (Call with the lock held.)
+    def drop_flushed(self):
+        generation = self.generation.value
+        if any(sound[1] != generation for sound in self.ring):
+            ring = collections.deque()
+            for sound in self.ring:
+                if sound[1] == generation:
+                    ring.append(sound)
+                else:
+                    self.finished.append((sound[0], 0))
+            self.ring = ring
+        generation = self.cue_generation.value if self.cues else None
+        if any(cue[1] != generation for cue in self.cues):
+            cues = collections.deque()
+            for cue in self.cues:
+                if cue[1] == generation:
+                    cues.append(cue)
+                else:
+                    self.finished.append((cue[0], 0))
+            self.cues = cues
+
+    # Called by sounddevice, in its own thread, whenever the device needs audio.
+    def callback(self, outdata, frames, time_info, status):
+        size = len(outdata)
+        filled = 0
+        heard_at = time.monotonic() + self.stream.latency
+        with self.lock:
+            # Flushed by stop_sounds(): drop them without playing them.
+            self.drop_flushed()
+            while filled < size and self.ring:
+                sound = self.ring[0]
+                item, generation, audio, played = sound
+                n = min(size - filled, len(audio) - played)
+                if played == 0 and self.on_start is not None:
+                    self.on_start(item, heard_at + filled / self.byte_rate)
+                outdata[filled:filled + n] = audio[played:played + n]
+                filled += n
+                sound[3] += n
+                if sound[3] == len(audio):
+                    self.ring.popleft()
+                    self.finished.append((item, heard_at))
+            if filled < size:
+                outdata[filled:] = self.silence * (size - filled)
+            if self.cues:
+                self.mix_cues(outdata, heard_at)
+
+    # Mix the cues into a buffer of narration (or silence), ducking the
+    #   narration. (Call with the lock held.)
+    def mix_cues(self, outdata, heard_at):
+        numpy = self.numpy
+        size = len(outdata)
+        bytes_per_sample = self.format[1]
+        mixed = ks_norm.to_float(numpy, bytes(outdata), bytes_per_sample)
+        mixed *= DUCK_GAIN
+        filled = 0
+        while filled < size and self.cues:
+            cue = self.cues[0]
+            item, generation, audio, played = cue
+            n = min(size - filled, len(audio) - played)
+            if played == 0 and self.on_start is not None:
+                self.on_start(item, heard_at + filled / self.byte_rate)
+            samples = ks_norm.to_float(numpy, audio[played:played + n], bytes_per_sample)
+            mixed[filled // bytes_per_sample:(filled + n) // bytes_per_sample] += samples
+            filled += n
+            cue[3] += n
+            if cue[3] == len(audio):
+                self.cues.popleft()
+                self.finished.append((item, heard_at + filled / self.byte_rate))
+        # (from_float() clips anything the mix pushed out of range.)
+        outdata[:] = ks_norm.from_float(numpy, mixed, bytes_per_sample).tobytes()
@@ -0,0 +1,55 @@
+################################################################################
+# conftest - What the tests in this directory share (see test_ks_*.py).
+################################################################################
+# No audio device is needed, nor even simpleaudio: if it is not installed, an
+#   empty module stands in for it, put in place before the modules under test
+#   import it. The timed_audio fixture then gives it a WaveObject that just
+#   keeps time (over the real one, if it is installed).
+################################################################################
+
+# Packages
+import sys
+import time
+import types
+
+import pytest
+
+try:
+    import simpleaudio
+except ImportError:
+    simpleaudio = types.ModuleType("simpleaudio")
+    sys.modules["simpleaudio"] = simpleaudio
+
+################################################################################
+# Helpers.
+################################################################################
+
+# Stands in for simpleaudio.WaveObject: "plays" for as long as its audio lasts.
+class TimedWave:
+
+    def __init__(self, audio_data, num_channels, bytes_per_sample, sample_rate):
+        self.duration = len(audio_data) / (num_channels * bytes_per_sample * sample_rate)
+
+    def play(self):
+        return TimedPlay(self.duration)
+
+class TimedPlay:
+
+    def __init__(self, duration):
+        self.ends = time.monotonic() + duration
+
+    def is_playing(self):
+        return time.monotonic() < self.ends
+
+    def stop(self):
+        self.ends = 0
+
+################################################################################
+# Fixtures.
+################################################################################
+
+# Sounds are played by TimedWave. (Use it before launching a consumer, so
+#   that a forked consumer has it too.)
+@pytest.fixture
+def timed_audio(monkeypatch):
+    monkeypatch.setattr(simpleaudio, "WaveObject", TimedWave, raising=False)
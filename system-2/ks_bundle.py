@@ -0,0 +1,196 @@
+################################################################################
+# ks_bundle - Packed, memory-mapped audiobook bundles.
+################################################################################
+# Used by ks_o.py, to open an Audiobook quickly.
+#
+# A book directory holds a Book_Title.wav, a Chapter_Names/ directory, and a
+#   Text_Content/ChNN/ directory of sentence files for each chapter. Opening a
+#   book from the directory means listing every chapter, and opening and
+#   decoding every wave file in it, one at a time.
+#
+# A bundle packs all of that into one file, BUNDLE_NAME, in the book directory:
+#   • a header: MAGIC, then the offset of the audio data and the length of the
+#     index (two little-endian 64-bit numbers),
+#   • the index, in JSON: the book title, and for each chapter its number, its
+#     name, and its sentences, with their sequence number, page and cc. Each
+#     sound has its filename, its format, and the offset and length of its
+#     audio within the data. And the "inputs" the bundle was made from: the
+#     modification time of each directory in the book's manifest, and the
+#     settings the audio was decoded with (see ks_manifest.py),
+#   • the data: the decoded audio of every sound, back to back (8-byte aligned).
+#     Sounds with identical audio share one copy of it.
+# Opening a book from a bundle is just an index read. The audio is played
+#   straight out of the bundle, memory-mapped read-only (see ks_pcm.view()),
+#   so nothing is decoded, and only the pages that get played are read in.
+#
+# The audio is stored as ks_pcm decodes it, so in ks_norm.CANONICAL_FORMAT if
+#   one is set, trimmed, and brought to the target loudness. If any of the
+#   inputs has changed since (a wave file added, removed or renamed, or a
+#   setting or sidecar changed), load() makes the bundle again before using it,
+#   just as ks_manifest.load() scans the book again. Checking costs a stat of
+#   each directory, not of each file; a wave file edited in place (which
+#   changes no directory) needs the bundle made again by hand. A bundle that
+#   cannot be read is made again too, and if that fails, the book is opened
+#   from its wave files.
+# Make a bundle with:
+#   python3 ks_bundle.py <book directory>
+################################################################################
+
+# Packages
+import json
+import os
+import struct
+import sys
+import wave
+
+# Local imports - "ks" stands for "key_sounds".
+import ks_manifest
+import ks_pcm
+
+# The name of the bundle file, in the book directory.
+BUNDLE_NAME = "book.ksb"
+
+# The first bytes of every bundle, and the header that follows them.
+MAGIC = b"KSBUNDL1"
+HEADER = struct.Struct("<8sQQ")   # magic, data offset, index length
+
+# What reading a damaged bundle, or packing a book with damaged files, raises.
+ERRORS = (OSError, EOFError, ValueError, KeyError, TypeError, struct.error, wave.Error)
+
+################################################################################
+# bundle_path() - Where the bundle of a book directory goes.
+################################################################################
+def bundle_path(book_path):
+    return os.path.join(book_path, BUNDLE_NAME)
+
+################################################################################
+# pack() - Pack a book directory into a bundle.
+# Finds the book's files from its manifest, as ks_o.Audiobook does (see
+#   ks_manifest.py). Returns the path of the bundle.
+################################################################################
+def pack(book_path):
+    blobs = list()     # the decoded audio of each distinct sound, in order
+    offsets = dict()   # content hash -> offset, of each blob
+    size = 0           # bytes of data so far
+
+    # Decode a file from the manifest, and return its index entry.
+    def add(record, **fields):
+        nonlocal size
+        filepath = os.path.join(book_path, record["path"])
+        (num_channels, bytes_per_sample, sample_rate, num_frames, frames,
+            digest, seconds) = ks_pcm.decode(filepath, lazy=False)
+        if digest not in offsets:
+            offsets[digest] = size
+            blobs.append(frames)
+            size += (len(frames) + 7) & ~7
+        directory, filename = os.path.split(record["path"])
+        fields.update({"dir": directory, "filename": filename, "channels": num_channels,
+                       "width": bytes_per_sample, "rate": sample_rate, "frames": num_frames,
+                       "offset": offsets[digest], "nbytes": len(frames)})
+        return fields
+
+    manifest = ks_manifest.load(book_path)
+    index = {"title": add(manifest["title"]), "chapters": list()}
+    for chapter in manifest["chapters"]:
+        index["chapters"].append({
+            "number": chapter["chapter"],
+            "name": add(chapter["name"]),
+            "sentences": [add(sentence, seq=sentence["seq"], page=sentence["page"],
+                              cc=sentence["cc"])
+                          for sentence in chapter["sentences"]]})
+    index["inputs"] = {"dirs": manifest["dirs"],
+                       "settings": ks_manifest.settings(book_path, manifest["dirs"])}
+
+    index_bytes = json.dumps(index).encode("utf-8")
+    data_offset = (HEADER.size + len(index_bytes) + 7) & ~7
+
+    # Write to a temporary file and then rename it, so a half-written bundle is never opened.
+    path = bundle_path(book_path)
+    with open(path + ".tmp", "wb") as f:
+        f.write(HEADER.pack(MAGIC, data_offset, len(index_bytes)))
+        f.write(index_bytes)
+        for frames in blobs:
+            f.write(b"\0" * (-f.tell() % 8))
+            f.write(frames)
+    os.replace(path + ".tmp", path)
+    return path
+
+################################################################################
+# load() - The index of a book directory's bundle (see read_index()), or None
+#   if it has none. A bundle that is out of date (see up_to_date()), or cannot
+#   be read, is made again first, or, if it cannot be, None.
+################################################################################
+def load(book_path):
+    path = bundle_path(book_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        index = read_index(path)
+        if up_to_date(book_path, index):
+            return index
+    except ERRORS:
+        pass
+    try:
+        pack(book_path)
+        return read_index(path)
+    except ERRORS:
+        return None
+
+################################################################################
+# up_to_date() - True if a bundle's index was made from the book directory as
+#   it is now: the same directories, decoded with the same settings, checked
+#   just as ks_manifest.load() checks a manifest. (A bundle made before the
+#   inputs were kept is out of date.)
+################################################################################
+def up_to_date(book_path, index):
+    inputs = index.get("inputs")
+    if inputs is None:
+        return False
+    try:
+        if any(os.stat(os.path.join(book_path, d)).st_mtime_ns != mtime
+               for d, mtime in inputs["dirs"].items()):
+            return False
+    except OSError:
+        return False
+    return inputs["settings"] == ks_manifest.settings(book_path, inputs["dirs"])
+
+################################################################################
+# read_index() - Read the index of a bundle.
+# Returns the index, with the offset of each sound made relative to the start
+#   of the file (so that it can go straight to ks_pcm.view()).
+################################################################################
+def read_index(path):
+    with open(path, "rb") as f:
+        magic, data_offset, index_length = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError('"{}" is not an audiobook bundle'.format(path))
+        index = json.loads(f.read(index_length).decode("utf-8"))
+        size = os.fstat(f.fileno()).st_size
+
+    entries = [index["title"]]
+    for chapter in index["chapters"]:
+        entries.append(chapter["name"])
+        entries.extend(chapter["sentences"])
+    for entry in entries:
+        entry["offset"] += data_offset
+        if entry["offset"] + entry["nbytes"] > size:
+            raise ValueError('"{}" is cut short'.format(path))
+    return index
+
+################################################################################
+# audio() - The audio of an index entry, in the form sound_object takes it:
+#   (num_channels, bytes_per_sample, sample_rate, num_frames, region)
+################################################################################
+def audio(path, entry):
+    return (entry["channels"], entry["width"], entry["rate"], entry["frames"],
+            (path, entry["offset"], entry["nbytes"]))
+
+################################################################################
+# Make a bundle, as asked on the command line.
+################################################################################
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("Usage: python3 ks_bundle.py <book directory>")
+        sys.exit(1)
+    print("Wrote", pack(sys.argv[1]))
@@ -0,0 +1,170 @@
+################################################################################
+# ks_gain - Evens out the loudness of the sounds.
+################################################################################
+# Used by ks_pcm.py, whenever it decodes a wave file.
+#
+# The prompts, the sound effects and the narration were all recorded at
+#   different levels. If TARGET_DB is set, each sound is scaled, once, as it
+#   is decoded, so that they all play back at about that loudness. Nothing is
+#   done to the audio as it is played.
+#
+# The loudness of each file is measured offline, by running:
+#   python3 ks_gain.py <directory> [<directory> ...]
+# which goes through every wave file in the directories (and in the
+#   directories under them), and saves the loudness and peak of each in one
+#   sidecar file, SIDECAR_PATH, under the content hash of its decoded audio
+#   (the same hash ks_pcm.py keeps of it). Files already measured are skipped,
+#   so re-running it only measures files that are new or have changed (and a
+#   file that is only copied or renamed is not measured again).
+#
+# The loudness is the RMS level of the file, in dBFS, over only the blocks of
+#   BLOCK_SECONDS that are louder than GATE_DB, so that the silence in a file
+#   does not make it seem quieter than it sounds.
+# A sound's gain is TARGET_DB less its loudness, but never more than
+#   MAX_GAIN_DB, and never so much that its peak would clip. A file that has
+#   not been measured is left as it is.
+#
+# The measuring and the scaling need NumPy.
+################################################################################
+
+# Packages
+import hashlib
+import json
+import os
+import sys
+import threading
+import wave
+
+# Local imports - "ks" stands for "key_sounds".
+import ks_norm
+
+# The loudness, in dBFS, to bring every sound to, or None to leave every
+#   sound at the level it was recorded at.
+# E.g. TARGET_DB = -20.0
+TARGET_DB = None
+
+# The most a sound is ever made louder, in dB.
+MAX_GAIN_DB = 20.0
+
+# The sidecar file of measurements, shared by every directory.
+SIDECAR_PATH = os.path.join(ks_norm.CACHE_DIR, "loudness.json")
+
+# Blocks quieter than this, in dBFS, are left out of the loudness.
+GATE_DB = -50.0
+
+# The loudness is measured over blocks of this many seconds.
+BLOCK_SECONDS = 0.4
+
+# The measurements, read from the sidecar the first time they are needed.
+MEASUREMENTS = None
+MEASUREMENTS_LOCK = threading.Lock()
+
+################################################################################
+# gain() - The gain to apply to some audio, in dB, given the content hash of
+#   the audio as it was decoded from its file. None if it is to be left as it is.
+################################################################################
+def gain(digest):
+    global MEASUREMENTS
+    if TARGET_DB is None:
+        return None
+    with MEASUREMENTS_LOCK:
+        if MEASUREMENTS is None:
+            MEASUREMENTS = read_sidecar()
+    measured = MEASUREMENTS.get(digest.hex())
+    if measured is None or measured["loudness"] is None:
+        return None
+    gain_db = min(TARGET_DB - measured["loudness"], MAX_GAIN_DB, -measured["peak"])
+    return gain_db if abs(gain_db) >= 0.1 else None
+
+# The measurements in the sidecar: content hash (hex) -> {"loudness", "peak"}.
+def read_sidecar():
+    try:
+        with open(SIDECAR_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+################################################################################
+# apply() - Scale some audio by a gain, in dB. Returns the scaled audio, as bytes.
+# Input parameters: frames: the audio; fmt: its format, as
+#   (num_channels, bytes_per_sample, sample_rate); gain_db: the gain.
+################################################################################
+def apply(frames, fmt, gain_db):
+    import numpy
+
+    samples = ks_norm.to_float(numpy, frames, fmt[1]) * numpy.float32(10 ** (gain_db / 20))
+    return ks_norm.from_float(numpy, samples, fmt[1]).tobytes()
+
+################################################################################
+# measure() - The loudness and peak of some audio, in dBFS.
+# The audio is cut into blocks of BLOCK_SECONDS, and the power of every block
+#   is worked out at once, with NumPy.
+# Returns {"loudness": ..., "peak": ...}; the loudness is None if every block
+#   is quieter than GATE_DB.
+################################################################################
+def measure(frames, fmt):
+    import numpy
+
+    num_channels, bytes_per_sample, sample_rate = fmt
+    samples = ks_norm.to_float(numpy, frames, bytes_per_sample)
+    peak = float(numpy.abs(samples).max()) if len(samples) else 0.0
+
+    block = max(1, int(sample_rate * BLOCK_SECONDS)) * num_channels
+    num_blocks = -(-len(samples) // block)
+    padded = numpy.zeros(num_blocks * block, numpy.float32)
+    padded[:len(samples)] = samples
+    power = numpy.square(padded.reshape(num_blocks, block)).mean(axis=1)
+    # (The last block is padded with silence, so it only counts by its own length.)
+    if num_blocks:
+        power[-1] *= block / (len(samples) - (num_blocks - 1) * block)
+    loud = power[power >= 10 ** (GATE_DB / 10)]
+
+    return {"loudness": float(10 * numpy.log10(loud.mean())) if len(loud) else None,
+            "peak": float(20 * numpy.log10(peak)) if peak > 0 else -200.0}
+
+################################################################################
+# index() - Measure the wave files in some directories, and the directories
+#   under them, and save the measurements in the sidecar.
+# Files whose audio has already been measured are skipped.
+# Returns the number of files measured.
+################################################################################
+def index(*tops):
+    global MEASUREMENTS
+    measurements = read_sidecar()
+    measured = 0
+    for top in tops:
+        for directory, dirnames, filenames in os.walk(top):
+            for name in sorted(f for f in filenames if f.endswith(".wav")):
+                fmt, frames = read_wave(os.path.join(directory, name))
+                # (The same hash as ks_pcm.content_hash(), which gain() is given.)
+                digest = hashlib.blake2b(frames, digest_size=20).hexdigest()
+                if digest not in measurements:
+                    measurements[digest] = measure(frames, fmt)
+                    measured += 1
+
+    os.makedirs(os.path.dirname(SIDECAR_PATH), exist_ok=True)
+    with open(SIDECAR_PATH + ".tmp", "w") as f:
+        json.dump(measurements, f)
+    os.replace(SIDECAR_PATH + ".tmp", SIDECAR_PATH)
+    with MEASUREMENTS_LOCK:
+        MEASUREMENTS = None
+    return measured
+
+# The format and the decoded audio of a wave file, as it is on disk.
+def read_wave(filename):
+    wave_read = wave.open(filename, "rb")
+    try:
+        fmt = (wave_read.getnchannels(), wave_read.getsampwidth(), wave_read.getframerate())
+        return fmt, wave_read.readframes(wave_read.getnframes())
+    finally:
+        wave_read.close()
+
+################################################################################
+# Measure some directories, as asked on the command line.
+################################################################################
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: python3 ks_gain.py <directory> [<directory> ...]")
+        sys.exit(1)
+    print("Measured", index(*sys.argv[1:]), "files")
@@ -35,7 +35,9 @@
 # The use of this software pattern permits threading to be used in a relatively
 #   simple and straightforward manner, with minimal programming overhead.
 #   The only coordination needed, and used, is thread-safe message passing.
-# Additional communication is accomplished with two multiprocessing.Events.
+# Every command, stopping included, is a message on the queue (see
+#   ks_play.SoundQueue); a generation counter on the queue lets it be stopped
+#   in one step.
 ################################################################################
 
 ################################################################################
@@ -46,10 +48,10 @@
 ################################################################################
 
 # Packages
-import multiprocessing # standard python package
 import time            # standard python package
 import readchar # version 2.0.1
 # Also uses simpleaudio-1.0.2
+# And, only for continuous playback (see prefetch_depth below), sounddevice.
 
 # Local imports
 # These are other python source code files required for this program to run.
@@ -62,6 +64,10 @@ import ks_play
 import ks_stop
 import ks_GLOBAL
 import ks_o
+import ks_launch
+import ks_load
+import ks_reg
+import ks_trace
 
 # Global variables
 
@@ -76,21 +82,17 @@ def write_file(begin, elapsed,keyStrokes,ksNumber):
 ################################################################################
 # Function to process user input. (This is a "producer".)
 # Catch the keystrokes from the user, and process the keystrokes.
-# Inputs: sound_q: a JoinableQueue of sound-objects.
-#         log_q: a JoinableQueue for capturing timestamped events.
-#         hold_q_e: a stop-modifying-the-queue multiprocessing.Event
-#         stop_play_e: a stop-playing-sounds multiprocessing.Event
+# Inputs: player: the AudiobookPlayer, which holds the queue
+#           shared with the play_sounds() process.
 ################################################################################
 
-def keystroke_processor(sound_q, log_q, hold_q_e, stop_play_e):
+def keystroke_processor(player):
 
     # Provide a visual prompt for input, though this should not be relied upon.
     # The user should be trained the basic i/o scheme of the interface before
     #   starting to use it. The point is to avoid any sort of visual display.
     print("Press <SPACE>, <J>, <K>, <L>, or <;>. Press <;> to quit.")
 
-    books = ['wav_files_provided/Book_01_norman/']
-    player = ks_o.AudiobookPlayer(books, sound_q, hold_q_e, stop_play_e, log_q)
     begin = time.time()
     keystrokes=""
     ksNumber=0
@@ -100,6 +102,7 @@ def keystroke_processor(sound_q, log_q, hold_q_e, stop_play_e):
 
         # Wait for the next keystroke.
         key = readchar.readkey()
+        ks_trace.key_pressed(player.sound_q.trace_q)
 
         # Process each keystroke as specified here.
         # Button "0"
@@ -107,6 +110,7 @@ def keystroke_processor(sound_q, log_q, hold_q_e, stop_play_e):
             keystrokes += str(key)
             keystrokes += "\n"
             ksNumber += 1
+            ks_trace.stamp(player.sound_q.trace_q, ks_trace.DISPATCH)
             player.on_button(0)
 
         # Button "1"
@@ -114,8 +118,9 @@ def keystroke_processor(sound_q, log_q, hold_q_e, stop_play_e):
             keystrokes += str(key)
             keystrokes += "\n"
             ksNumber += 1
+            ks_trace.stamp(player.sound_q.trace_q, ks_trace.DISPATCH)
             # # Stop any currently playing sounds, and clear the queue.
-            # ks_stop.stop_sounds(sound_q, log_q, hold_q_e, stop_play_e)
+            # ks_stop.stop_sounds(sound_q, log_q)
             # # Play "Chapter 1"
             # sound_q.put(ks_GLOBAL.CH_NAME_SO_LIST[0])
             player.on_button(1)
@@ -125,6 +130,7 @@ def keystroke_processor(sound_q, log_q, hold_q_e, stop_play_e):
             keystrokes += str(key)
             keystrokes += "\n"
             ksNumber += 1
+            ks_trace.stamp(player.sound_q.trace_q, ks_trace.DISPATCH)
             # Put "Chapter 2" in the play-queue.
             # sound_q.put(ks_GLOBAL.CH_NAME_SO_LIST[1])
             player.on_button(2)
@@ -134,6 +140,7 @@ def keystroke_processor(sound_q, log_q, hold_q_e, stop_play_e):
             keystrokes += str(key)
             keystrokes += "\n"
             ksNumber += 1
+            ks_trace.stamp(player.sound_q.trace_q, ks_trace.DISPATCH)
             # Put all of the text for the chapter on the play-queue.
             # for s_obj in ks_GLOBAL.READ_ITEM_SO_LIST:
             #     sound_q.put(s_obj)
@@ -146,8 +153,9 @@ def keystroke_processor(sound_q, log_q, hold_q_e, stop_play_e):
             keystrokes += str(key)
             keystrokes += "\n"
             ksNumber += 1
+            ks_trace.stamp(player.sound_q.trace_q, ks_trace.DISPATCH)
             # Stop any currently playing sounds, and clear the queue.
-            # ks_stop.stop_sounds(sound_q, log_q, hold_q_e, stop_play_e)
+            # ks_stop.stop_sounds(sound_q, log_q)
             # # Play " Chapter 4"
             # sound_q.put(ks_GLOBAL.CH_NAME_SO_LIST[3])
             # break # Break out of the loop.
@@ -176,39 +184,85 @@ if __name__ == '__main__':
     # Load sounds.
     # ks_load.load_sounds()
 
-    # Create a sound-objects-to-play queue.
-    sound_queue = multiprocessing.JoinableQueue()
+    # How to start the play_sounds() process (see ks_launch.py). With "fork" or
+    #   "forkserver", every sound is loaded first, here, so that the process
+    #   starts with them all and never loads (or copies) any of them itself.
+    # With "thread", play_sounds() runs in a thread of this process instead,
+    #   sharing the sounds, with no second process at all.
+    # (This comes first: the queues below must be made for the chosen method.)
+    # The var is initialized to 'None' to use the platform's default start method.
+    # launch_method = "fork"
+    # launch_method = "thread"
+    launch_method = None
+    ks_launch.use(launch_method)
+
+    # Create a latency-trace queue, to time each keystroke through to its sound.
+    # (The 50th, 95th and 99th percentiles are printed at the end, see ks_trace.py.)
+    # The var is initialized to 'None' to turn the tracing off.
+    # trace_queue = ks_launch.joinable_queue()
+    trace_queue = None
+
+    # Create a sound-ids-to-play queue.
+    sound_queue = ks_launch.sound_queue(trace_queue)
     # Create a timestamp-log queue.
     # (If logging is to be done, it must be done with a JoinableQueue() because
     #   there is no way to directly recturn data from the play_sounds() subprocess.)
     # The var is initialized to 'None' to suppress the logging.
-    # log_queue = multiprocessing.JoinableQueue()
+    # log_queue = ks_launch.joinable_queue()
     log_queue = None
 
-    # Create a "hold the queue" message-passing event.
-    # Permits the keystroke-catching process to tell the sound-playing process to
-    #   temporarily stop removing items from the queue.
-    hold_queue_e = multiprocessing.Event()
+    # Continuous playback: play back-to-back sounds gaplessly, through one output
+    #   stream, feeding the stream this many sounds ahead. (Needs sounddevice.)
+    # The var is initialized to 'None' to play each sound on its own instead.
+    # prefetch_depth = 2
+    prefetch_depth = None
+
+    # Decode-ahead: while each sentence of a playlist plays, get this many of
+    #   the next ones ready on a background thread (see ks_play.Prefetcher).
+    # The var is initialized to 'None' to get each sound ready as it is played.
+    # decode_ahead = 3
+    decode_ahead = None
 
-    # Create a "stop-playing" message-passing event.
-    # Permits the keystroke-catching process to tell the sound-playing process to
-    #   stop playing a sound that may be playing.
-    stop_playing_e = multiprocessing.Event()
+    # Cue overlay: play the prompts and sound effects over the narration, ducking
+    #   it, instead of stopping it (see ks_o.AudiobookPlayer). Needs continuous
+    #   playback (prefetch_depth, above); without it, this is left off.
+    # The var is initialized to 'False' to stop the narration for every prompt.
+    # overlay_cues = True
+    overlay_cues = False
 
-    # Launch the play_sounds() consumer process in a second process.
-    cons_p1 = multiprocessing.Process(target=ks_play.play_sounds,
-                args=(sound_queue, log_queue, hold_queue_e, stop_playing_e))
+    # Load the books and sound effects. This is done before the consumer is
+    #   launched so that the sound registry is complete when it is handed over.
+    books = ['wav_files_provided/Book_01_norman/']
+    player = ks_o.AudiobookPlayer(books, sound_queue, log_queue,
+                                  overlay_cues and prefetch_depth is not None)
+
+    # Launch the play_sounds() consumer process in a second process (or thread).
+    if launch_method is not None:
+        ks_launch.preload()
+    ks_load.log_load_times(log_queue)
+    cons_p1 = ks_launch.process(ks_play.play_sounds,
+                args=(sound_queue, log_queue, ks_reg.snapshot(),
+                      prefetch_depth, decode_ahead))
     cons_p1.daemon=True
     cons_p1.start()
 
     # Start up the keystroke catcher, in the main process, not in a new process.
     # The main program sits on this line until the "break" from keystroke_processor()
-    keystroke_processor(sound_queue, log_queue, hold_queue_e, stop_playing_e)
+    keystroke_processor(player)
 
     # After returning from the keystroke catching and processing loop...
     # Block (stop) this main process until all queue items have be processed by
     #   the consumer process.
     sound_queue.join()
+    # Then tell it to finish, and wait for it to.
+    sound_queue.shutdown()
+    cons_p1.join()
+
+    # Log the time spent loading sounds, those loaded as they were needed included.
+    ks_load.log_load_times(log_queue)
+
+    # Print the keystroke latencies if trace_queue was initialized as a Queue.
+    ks_trace.summary(trace_queue)
 
     # Output the timestamp-log queue if log_queue was initialized as a JoinableQueue.
     ks_log.output_log(log_queue)
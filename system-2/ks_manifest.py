@@ -0,0 +1,139 @@
+################################################################################
+# ks_manifest - A cached listing of the files in an audiobook directory.
+################################################################################
+# Used by ks_o.py and ks_bundle.py, to find an Audiobook's files.
+#
+# Finding a book's files means listing Text_Content/, every chapter directory
+#   in it, and matching every filename against the sentence-file pattern. The
+#   manifest does this once, and saves what it found in MANIFEST_NAME, in the
+#   book directory. Every later start reads that one file instead.
+#
+# The manifest, in JSON:
+#   "dirs": the modification time of each directory that was listed
+#           (Chapter_Names/, Text_Content/, and every chapter directory)
+#   "settings": the settings the durations were worked out with (see
+#               ks_pcm.settings()), as trimming and converting change them
+#   "title": the record of Book_Title.wav
+#   "chapters": for each chapter, in order, its "chapter" number, the record of
+#               its "name" file, and the records of its "sentences", in order
+# A record has the file's "path" (relative to the book directory), "size",
+#   "mtime" and "duration" (seconds), and for a sentence, its "chapter", "seq",
+#   "cc" and "page", parsed from its filename.
+#
+# Adding, removing or renaming a file changes the modification time of its
+#   directory, so the manifest is scanned again whenever any listed directory
+#   has changed. (Editing a file in place does not; the size and mtime in its
+#   record say which version was listed.) It is scanned again, too, if the
+#   settings have changed, so that every duration is as the file is played.
+################################################################################
+
+# Packages
+import json
+import os
+import re
+
+# Local imports - "ks" stands for "key_sounds".
+import ks_pcm
+
+# The name of the manifest file, in the book directory.
+MANIFEST_NAME = "manifest.json"
+
+# Bumped whenever the layout of the manifest changes, so old ones get rescanned.
+VERSION = 1
+
+################################################################################
+# load() - The manifest of a book directory.
+# Reads the saved manifest if it is still up to date; otherwise scans the
+#   directory and saves a new one (if the directory can be written to).
+################################################################################
+def load(book_path):
+    path = os.path.join(book_path, MANIFEST_NAME)
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+        if manifest.get("version") == VERSION and all(
+                os.stat(os.path.join(book_path, d)).st_mtime_ns == mtime
+                for d, mtime in manifest["dirs"].items()) and (
+                manifest.get("settings") == settings(book_path, manifest["dirs"])):
+            return manifest
+    except (OSError, ValueError, KeyError):
+        pass
+
+    manifest = scan(book_path)
+    try:
+        # Write to a temporary file and then rename it, so a half-written
+        #   manifest is never read.
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(path + ".tmp", path)
+    except OSError:
+        pass
+    return manifest
+
+################################################################################
+# scan() - List a book directory, and return its manifest.
+# Finds the files the way ks_o.Audiobook always has: every directory in
+#   Text_Content/ is a chapter (numbered by the "ChNN" in its name), with its
+#   name in Chapter_Names/ChNN.wav, and every file in it that matches the
+#   "<seq>_<cc>_<page>.wav" pattern is a sentence.
+################################################################################
+def scan(book_path):
+    dirs = dict()
+
+    # Record a directory's modification time.
+    def listed(directory):
+        dirs[directory] = os.stat(os.path.join(book_path, directory)).st_mtime_ns
+
+    # Return the record of a file.
+    def record(filepath, **fields):
+        st = os.stat(os.path.join(book_path, filepath))
+        num_channels, bytes_per_sample, sample_rate, num_frames = ks_pcm.read_header(
+            os.path.join(book_path, filepath))
+        fields.update({"path": filepath, "size": st.st_size, "mtime": st.st_mtime_ns,
+                       "duration": num_frames / sample_rate})
+        return fields
+
+    manifest = {"version": VERSION, "dirs": dirs, "title": record("Book_Title.wav"),
+                "chapters": list()}
+
+    tc_dir = "Text_Content"
+    listed(tc_dir)
+    listed("Chapter_Names")
+    for chapter in sorted(os.listdir(os.path.join(book_path, tc_dir))):
+        if chapter.startswith('.'):
+            continue
+        mcn = re.search(r'Ch(\d{2})', chapter)
+        if mcn is None:
+            raise ValueError('Unable to parse chapter number from chapter "{}"'.format(chapter))
+        ch_num = int(mcn.groups()[0])
+        ch_dir = os.path.join(tc_dir, chapter)
+        listed(ch_dir)
+        sentences = list()
+        for sentence in sorted(os.listdir(os.path.join(book_path, ch_dir))):
+            m = re.search(r'([0-9]{3})_(CN|SH|TS|RP)_([0-9]{2})\.wav', sentence)
+            if m is not None:
+                seq, cc, page = m.groups()
+                sentences.append(record(os.path.join(ch_dir, sentence), chapter=ch_num,
+                                        seq=int(seq), cc=cc, page=int(page)))
+        manifest["chapters"].append({
+            "chapter": ch_num,
+            "name": record(os.path.join("Chapter_Names", "{}.wav".format(chapter))),
+            "sentences": sentences})
+    manifest["settings"] = settings(book_path, dirs)
+    return manifest
+
+# The ks_pcm.settings() of the files in a book: those in its listed
+#   directories, and Book_Title.wav.
+def settings(book_path, dirs):
+    return ks_pcm.settings(book_path, set(dirs) | {""})
+
+################################################################################
+# records() - Every record in a manifest, in order: the title, and then each
+#   chapter's name followed by its sentences.
+################################################################################
+def records(manifest):
+    yield manifest["title"]
+    for chapter in manifest["chapters"]:
+        yield chapter["name"]
+        for sentence in chapter["sentences"]:
+            yield sentence
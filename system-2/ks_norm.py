@@ -0,0 +1,167 @@
+################################################################################
+# ks_norm - Converts every sound to one canonical format as it is loaded.
+################################################################################
+# Used by ks_pcm.py, whenever it decodes a wave file.
+#
+# The wave files come from several places (wav_files_provided/,
+#   project_wav_files/, sfx/), and not all of them have the same sample rate,
+#   sample width and number of channels. Anything that plays sounds back to
+#   back through one stream (see ks_stream.py) needs them all in one format.
+#   If CANONICAL_FORMAT is set, every sound is converted to it when it is
+#   decoded, so playback never has to convert anything.
+#
+# The conversion is done with NumPy, on whole sounds at once:
+#   • samples are scaled to floats, whatever their width,
+#   • channels are mixed down to mono, or mono copied to every channel,
+#   • the sample rate is changed by linear interpolation (which is plenty for
+#     speech and short cues),
+#   • and the samples are scaled back to the canonical width, and clipped.
+#
+# Converting takes far longer than decoding, so each converted sound is saved
+#   in CACHE_DIR, under the content hash of the original audio and the two
+#   formats. A file is only ever converted once (until it is changed); after
+#   that its conversion is read straight from the cache.
+#
+# NumPy is imported only when a sound is actually converted, so the programs
+#   run without it as long as CANONICAL_FORMAT is None, or every file is
+#   already in it.
+################################################################################
+
+# Packages
+import hashlib
+import os
+import tempfile
+
+# The format every sound is converted to, as
+#   (num_channels, bytes_per_sample, sample_rate),
+#   or None to play every sound in the format it was recorded in.
+# E.g. CANONICAL_FORMAT = (2, 2, 44100) for 16-bit stereo at 44.1 kHz.
+CANONICAL_FORMAT = None
+
+# Where converted sounds are saved.
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "key_sounds")
+
+# The files converted so far, as a list of (filename, original format, cached)
+#   where cached is True if the conversion was read from CACHE_DIR.
+CONVERTED = list()
+
+################################################################################
+# target() - The format a sound in the given format is played in.
+################################################################################
+def target(fmt):
+    return fmt if CANONICAL_FORMAT is None else CANONICAL_FORMAT
+
+################################################################################
+# frame_count() - The number of frames a sound of num_frames, at sample_rate,
+#   has once converted to target_rate.
+################################################################################
+def frame_count(num_frames, sample_rate, target_rate):
+    return (num_frames * target_rate + sample_rate // 2) // sample_rate
+
+################################################################################
+# normalise() - Convert decoded audio to CANONICAL_FORMAT.
+# Input parameters:
+#   • filename: the wave file the audio came from (for CONVERTED).
+#   • fmt: the (num_channels, bytes_per_sample, sample_rate) of frames.
+#   • frames: the decoded audio.
+#   • digest: a content hash of frames, if one has already been worked out.
+# Returns (format, frames): the audio in CANONICAL_FORMAT, or just what it was
+#   given if there is no canonical format or the audio is already in it.
+# Safe to call from several threads at once (see ks_pcm.load_waves()).
+################################################################################
+def normalise(filename, fmt, frames, digest=None):
+    canonical = target(fmt)
+    if canonical == fmt:
+        return fmt, frames
+
+    if digest is None:
+        digest = hashlib.blake2b(frames, digest_size=20).digest()
+    path = os.path.join(CACHE_DIR, "{}_{}x{}x{}_{}x{}x{}.pcm".format(
+        digest.hex(), *(fmt + canonical)))
+    try:
+        with open(path, "rb") as f:
+            converted = f.read()
+        CONVERTED.append((filename, fmt, True))
+        return canonical, converted
+    except OSError:
+        pass
+
+    converted = convert(frames, fmt, canonical)
+    CONVERTED.append((filename, fmt, False))
+    try:
+        # Write to a temporary file and then rename it, so a half-written
+        #   conversion is never read.
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(converted)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+    return canonical, converted
+
+################################################################################
+# convert() - Convert audio from one format to another, with NumPy.
+# Input parameters: frames: the audio; fmt, to_fmt: the formats, each as
+#   (num_channels, bytes_per_sample, sample_rate).
+# Returns the converted audio, as bytes.
+################################################################################
+def convert(frames, fmt, to_fmt):
+    import numpy
+
+    num_channels, bytes_per_sample, sample_rate = fmt
+    to_channels, to_bytes, to_rate = to_fmt
+
+    # One row per frame, one column per channel, each sample from -1 to 1.
+    samples = to_float(numpy, frames, bytes_per_sample).reshape(-1, num_channels)
+
+    if to_channels != num_channels:
+        if to_channels == 1:
+            samples = samples.mean(axis=1, keepdims=True)
+        else:
+            # Mono goes to every channel; otherwise the channels are reused in turn.
+            samples = samples[:, numpy.arange(to_channels) % num_channels]
+
+    if to_rate != sample_rate:
+        num_frames = frame_count(len(samples), sample_rate, to_rate)
+        at = numpy.arange(num_frames) * (sample_rate / to_rate)
+        frames_in = numpy.arange(len(samples))
+        samples = numpy.column_stack([numpy.interp(at, frames_in, samples[:, c])
+                                      for c in range(to_channels)])
+
+    return from_float(numpy, samples, to_bytes).tobytes()
+
+# Samples of any width, as float32 from -1 to 1. (8-bit wave audio is unsigned.)
+def to_float(numpy, frames, bytes_per_sample):
+    if bytes_per_sample == 1:
+        return (numpy.frombuffer(frames, numpy.uint8).astype(numpy.float32) - 128) / 128
+    if bytes_per_sample == 3:
+        b = numpy.frombuffer(frames, numpy.uint8).reshape(-1, 3).astype(numpy.int32)
+        ints = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+        return ((ints ^ 0x800000) - 0x800000).astype(numpy.float32) / 0x800000
+    dtype = numpy.int16 if bytes_per_sample == 2 else numpy.int32
+    scale = float(1 << (8 * bytes_per_sample - 1))
+    return numpy.frombuffer(frames, dtype).astype(numpy.float32) / scale
+
+# Float samples from -1 to 1, as an array of samples of the given width.
+def from_float(numpy, samples, bytes_per_sample):
+    scale = float(1 << (8 * bytes_per_sample - 1))
+    ints = numpy.clip(numpy.rint(samples.ravel() * scale), -scale, scale - 1)
+    if bytes_per_sample == 1:
+        return (ints + 128).astype(numpy.uint8)
+    if bytes_per_sample == 3:
+        return ints.astype("<i4").view(numpy.uint8).reshape(-1, 4)[:, :3]
+    return ints.astype(numpy.int16 if bytes_per_sample == 2 else "<i4")
+
+################################################################################
+# print_conversions() - Print which files were converted, and from what.
+################################################################################
+def print_conversions():
+    if not CONVERTED:
+        return
+    print("Converted {} files to {} channels, {}-bit, {} Hz ({} from the cache)".format(
+        len(CONVERTED), CANONICAL_FORMAT[0], 8 * CANONICAL_FORMAT[1], CANONICAL_FORMAT[2],
+        sum(cached for filename, fmt, cached in CONVERTED)))
+    for filename, (num_channels, bytes_per_sample, sample_rate), cached in sorted(CONVERTED):
+        print("  from {} channels, {}-bit, {} Hz  {}".format(
+            num_channels, 8 * bytes_per_sample, sample_rate, filename))
@@ -6,84 +6,812 @@
 ################################################################################
 
 # Packages
+import collections
+import multiprocessing
+import queue
+import threading
 import time
 
 # Local imports - "ks" stands for "key_sounds".
 import ks_log
+import ks_norm
+import ks_pcm
+import ks_reg
+import ks_trace
+
+################################################################################
+# Command - What a message on the play-queue asks play_sounds() to do.
+# Static enum class, like ks_o.Button.
+################################################################################
+class Command:
+    PLAY          = 0   # play one sound (the message carries its id)
+    LOAD_PLAYLIST = 1   # load a playlist and play it (carries the ids, and where to start)
+    SEEK          = 2   # play the playlist from an index (carries the index, and frame)
+    NEXT          = 3   # play the playlist from the sound after the last one played
+    PREV          = 4   # play the playlist from the sound before the last one played
+    RESUME        = 5   # play the playlist from the frame it was stopped at
+    REGISTER      = 6   # take in sounds loaded since the registry was handed over
+    CUE           = 7   # play one sound over whatever else is playing (carries its id)
+    ENQUEUE_MANY  = 8   # play several sounds, one after another (carries their ids)
+    STOP          = 9   # stop what is playing now, and drop everything queued before it
+    FLUSH         = 10  # drop everything queued before it, but let what is playing finish
+    PAUSE         = 11  # stop the playlist where it is (see RESUME)
+    SHUTDOWN      = 12  # stop everything, and end play_sounds()
+    RELEASE       = 13  # let go of sounds that were unloaded (carries their ids)
+
+################################################################################
+# SoundQueue - The play-queue shared by the keystroke and play_sounds processes.
+# A thin wrapper around a multiprocessing.JoinableQueue that carries small
+#   (generation, command, argument) messages rather than whole sound_objects.
+#   It is the only channel between the two processes: every request, stopping
+#   included, is a message, and play_sounds() carries them out in the order
+#   they were sent, in one loop (see Command for the whole protocol).
+#   • put() takes a sound_object and puts only its id on the queue.
+#     put_many() puts several in one message; get() hands them out one by one.
+#   • load_playlist(), seek(), next(), prev() and resume() send playlist
+#     commands (see Playlist, below). A seek costs one message, however long
+#     the playlist.
+#   • cue() sends a sound to be played on the cue channel: over the narration
+#     (the playlist, or sounds put()), without stopping it. clear_cues() stops
+#     the cues, but not the narration. (Mixing needs continuous playback; see
+#     play_sounds_continuous(). Otherwise a cue is played like any other sound.)
+#   • get() takes a message off the queue and returns it, with the id of a
+#     sound to PLAY or CUE looked up and replaced by the registered sound_object.
+#   • stop(), flush(), pause() and shutdown() send the control commands.
+#   • release() lets go of sounds that are unloaded, once play_sounds() is
+#     done with them: play_sounds() drops them from its registry when it gets
+#     to the RELEASE, after everything sent before it, and then says so in
+#     released; only then does reclaim() (called by every send()) release them
+#     here, and free their audio (see ks_pcm.release()).
+# Each message is tagged with the queue's generation when it is put on the queue.
+#   stop() empties the queue in constant time, however many sounds are on it,
+#   by starting a new generation: everything already on the queue is now stale,
+#   and play_sounds() drops stale sounds as it gets them instead of playing them.
+#   (The STOP message itself just wakes play_sounds() up, to stop the sound it
+#   is playing; a continuous stream notices the new generation by itself.)
+# now_playing (a NowPlaying, below) is where play_sounds() tells the keystroke
+#   process how far through the playlist it has got.
+# trace_q: a queue for latency tracing (see ks_trace.py), or None to not trace.
+#   Each message carries the number of the key it was sent for, when tracing.
+# local: True if play_sounds() runs in a thread of this same process (see
+#   ks_launch.py). The queue is then a plain queue.Queue, and the two share
+#   one registry, so no sounds are handed over with REGISTER.
+# The rest of the JoinableQueue interface is passed straight through.
+################################################################################
+class SoundQueue:
+
+    def __init__(self, trace_q=None, local=False):
+        self.queue = queue.Queue() if local else multiprocessing.JoinableQueue()
+        self.local = local
+        self.trace_q = trace_q
+        self.generation = multiprocessing.Value('i', 0)
+        self.cue_generation = multiprocessing.Value('i', 0)
+        self.now_playing = NowPlaying()
+        # The number of the last RELEASE play_sounds() has carried out, and the
+        #   sounds of those it has not, by number (see release()).
+        self.released = multiprocessing.Value('i', 0)
+        self.releasing = collections.deque()
+        self.release_count = 0
+        # Only used in the play_sounds() process (see get(), task_done() and played()).
+        self.unpacked = collections.deque()
+        self.extra_tasks = 0
+        self.key_number = None  # of the last key dequeued, until its sound starts
+
+    def put(self, s_obj):
+        self.send(Command.PLAY, s_obj.id)
+
+    def put_many(self, s_objs):
+        self.send(Command.ENQUEUE_MANY, tuple(s_obj.id for s_obj in s_objs))
+
+    # Load a list of sound_objects as the playlist, and play it from index
+    #   start, starting that sound at frame.
+    def load_playlist(self, s_objs, start=0, frame=0):
+        self.send(Command.LOAD_PLAYLIST, (tuple(s_obj.id for s_obj in s_objs), start, frame))
+
+    def seek(self, index, frame=0):
+        self.send(Command.SEEK, (index, frame))
+
+    def next(self):
+        self.send(Command.NEXT, None)
+
+    def prev(self):
+        self.send(Command.PREV, None)
+
+    # Carry on playing the playlist from where it was stopped (paused).
+    def resume(self):
+        self.send(Command.RESUME, None)
+
+    def cue(self, s_obj):
+        self.send(Command.CUE, s_obj.id)
+
+    # Let go of some sound_objects that are no longer needed (see the top).
+    def release(self, s_objs):
+        self.release_count += 1
+        self.releasing.append((self.release_count, s_objs))
+        self.send(Command.RELEASE, (self.release_count, tuple(s_obj.id for s_obj in s_objs)))
+
+    # Release the sounds of every RELEASE play_sounds() has carried out.
+    def reclaim(self):
+        while self.releasing and self.releasing[0][0] <= self.released.value:
+            number, s_objs = self.releasing.popleft()
+            ks_reg.release(s_objs)
+            for s_obj in s_objs:
+                ks_pcm.release(s_obj.pcm, s_obj.filepath)
+
+    # Carry out a RELEASE, in play_sounds(), once nothing sent before it is
+    #   playing: drop its sounds from the registry (and lazily loaded ones from
+    #   the cache), and tell reclaim() it can free them.
+    def forget(self, arg):
+        number, sound_ids = arg
+        for sound_id in sound_ids:
+            s_obj = ks_reg.lookup(sound_id)
+            if s_obj is not None:
+                ks_reg.release([s_obj])
+                if s_obj.pcm is None:
+                    ks_pcm.release(None, s_obj.filepath)
+        self.released.value = number
+
+    def send(self, command, arg):
+        self.reclaim()
+        # First hand over any sounds loaded since the registry was (see ks_reg.py).
+        sounds = None if self.local else ks_reg.unannounced()
+        if sounds:
+            self.queue.put((self.generation.value, Command.REGISTER, sounds, None))
+        key_number = ks_trace.KEY_NUMBER if self.trace_q else None
+        # (A cue is tagged with the cue channel's generation instead.)
+        generation = self.cue_generation if command == Command.CUE else self.generation
+        self.queue.put((generation.value, command, arg, key_number))
+        ks_trace.stamp(self.trace_q, ks_trace.PUT)
+
+    # Returns a tuple: (generation, command, argument)
+    # Raises queue.Empty if a timeout is given and nothing arrives in time.
+    # Sounds handed over with REGISTER are taken in here, and not returned.
+    # The sounds of an ENQUEUE_MANY are returned one at a time, as PLAYs.
+    # A sound that has been released (see release()) is dropped here, as there
+    #   is nothing left of it to play.
+    def get(self, timeout=None):
+        if self.unpacked:
+            return self.unpacked.popleft()
+        while True:
+            generation, command, arg, key_number = self.queue.get(timeout=timeout)
+            if command == Command.REGISTER:
+                for s_obj in arg:
+                    ks_reg.adopt(s_obj)
+                self.queue.task_done()
+                continue
+            ks_trace.dequeued(self.trace_q, key_number)
+            if key_number is not None:
+                self.key_number = key_number
+            if command == Command.ENQUEUE_MANY:
+                sounds = [s_obj for s_obj in map(ks_reg.lookup, arg) if s_obj is not None]
+                if not sounds:
+                    self.queue.task_done()
+                    continue
+                # One message, but a task_done() for each sound (see task_done()).
+                self.extra_tasks += len(sounds) - 1
+                self.unpacked.extend((generation, Command.PLAY, s_obj) for s_obj in sounds)
+                return self.unpacked.popleft()
+            if command == Command.PLAY or command == Command.CUE:
+                arg = ks_reg.lookup(arg)
+                if arg is None:
+                    self.queue.task_done()
+                    continue
+            return (generation, command, arg)
+
+    # Called by play_sounds() whenever it starts playing a sound, to trace the
+    #   sound of the last key dequeued (see ks_trace.played()).
+    def played(self, at=None):
+        ks_trace.played(self.trace_q, self.key_number, at)
+        self.key_number = None
+
+    # Stop everything: the sound playing now, and everything on the queue.
+    def stop(self):
+        with self.generation.get_lock():
+            self.generation.value += 1
+        # The playlist stops here, so its position stops moving here too.
+        self.now_playing.stop()
+        self.send(Command.STOP, None)
+
+    # Drop everything on the queue, but let the sound playing now finish.
+    def flush(self):
+        self.send(Command.FLUSH, None)
+
+    # Stop the playlist where it is; resume() carries on from there. Sounds
+    #   that are not in the playlist are not stopped.
+    def pause(self):
+        self.now_playing.stop()
+        self.send(Command.PAUSE, None)
+
+    # Stop everything, and end play_sounds().
+    def shutdown(self):
+        self.send(Command.SHUTDOWN, None)
+
+    def is_stale(self, generation):
+        return generation != self.generation.value
+
+    # Stop the cues, like flush() stops everything else.
+    def clear_cues(self):
+        with self.cue_generation.get_lock():
+            self.cue_generation.value += 1
+
+    def is_stale_cue(self, generation):
+        return generation != self.cue_generation.value
+
+    # (Each message put on the queue gets one task_done(), so of the sounds of
+    #   an ENQUEUE_MANY, all but one are only counted off here.)
+    def task_done(self):
+        if self.extra_tasks:
+            self.extra_tasks -= 1
+        else:
+            self.queue.task_done()
+
+    def empty(self):
+        return self.queue.empty()
+
+    def join(self):
+        self.queue.join()
+
+################################################################################
+# Playlist - A list of sounds that play_sounds() plays through, in order.
+# The keystroke process loads the list once, with SoundQueue.load_playlist(),
+#   and then moves around in it with one small message per move (seek(), next()
+#   or prev()), rather than putting the rest of the list back on the queue.
+# Each of these commands starts the playlist playing, in the generation the
+#   command was sent in. A stop (see SoundQueue.stop()) stops the playlist,
+#   like everything else on the queue, and so do a flush and a pause, but the
+#   list and the place in it are kept, so a later next() or prev() carries on
+#   from there, and resume() carries on from the very frame it was stopped at.
+#   (The rest of the sound is played from a zero-copy slice of its decoded
+#   audio: nothing is decoded again.) A move that was stopped before
+#   play_sounds() got to it is not carried out at all.
+# While the playlist is playing, it comes before anything put on the queue
+#   after the command that started it.
+# Only play_sounds() has a Playlist. Positions in it are indexes into the list.
+################################################################################
+class Playlist:
+
+    def __init__(self):
+        self.sound_ids = tuple()
+        self.cursor = 0         # index of the next sound to play
+        self.frame = 0          # frame to start that sound at
+        self.current = None     # index of the last sound played, if any
+        self.generation = None  # generation it is playing in; None if stopped
+
+    # Carry out a playlist command that came off the queue.
+    def apply(self, input_q, generation, command, arg):
+        frame = 0
+        if command == Command.LOAD_PLAYLIST:
+            self.sound_ids, index, frame = arg
+            self.current = None
+            input_q.now_playing.reset()
+        elif input_q.is_stale(generation):
+            return
+        elif command == Command.SEEK:
+            index, frame = arg
+        elif command == Command.NEXT:
+            index = self.position() + 1
+        elif command == Command.PREV:
+            index = self.position() - 1
+        elif command == Command.RESUME:
+            index, frame = self.cursor, self.frame
+            now_playing = input_q.now_playing.read()
+            if now_playing is not None:
+                index, s_obj, frame = now_playing
+                # It was played to the end, so carry on with the next one.
+                if frame >= s_obj.num_frames:
+                    index, frame = index + 1, 0
+        # (An index past the end leaves nothing to play.)
+        self.cursor = max(0, min(index, len(self.sound_ids)))
+        self.frame = frame
+        self.generation = None if input_q.is_stale(generation) else generation
+
+    # The index of the last sound played, or of the next one if none was played.
+    def position(self):
+        return self.cursor if self.current is None else self.current
+
+    # Returns a tuple: (generation, sound_object, frame), for the next sound to
+    #   play and the frame to start it at, or None if the playlist is stopped,
+    #   flushed, or played to the end. (Sounds released since the playlist was
+    #   loaded are skipped.)
+    def peek(self, input_q):
+        while (self.generation is not None and self.cursor < len(self.sound_ids)
+               and ks_reg.lookup(self.sound_ids[self.cursor]) is None):
+            self.cursor += 1
+            self.frame = 0
+        if self.generation is not None and (input_q.is_stale(self.generation)
+                                            or self.cursor >= len(self.sound_ids)):
+            self.generation = None
+        if self.generation is None:
+            return None
+        return (self.generation, ks_reg.lookup(self.sound_ids[self.cursor]), self.frame)
+
+    # The next n sounds the playlist will play (fewer near its end, none if it
+    #   is stopped).
+    def upcoming(self, input_q, n):
+        if self.peek(input_q) is None:
+            return []
+        sounds = (ks_reg.lookup(i) for i in self.sound_ids[self.cursor:self.cursor + n])
+        return [s_obj for s_obj in sounds if s_obj is not None]
+
+    # Stop playing, but keep the list and the place in it (for FLUSH and PAUSE).
+    def stop(self):
+        self.generation = None
+
+    # Move on, once the sound returned by peek() has been started.
+    def advance(self):
+        self.current = self.cursor
+        self.cursor += 1
+        self.frame = 0
+
+################################################################################
+# Prefetcher - Gets the playlist's next sounds ready on a background thread,
+#   while the current one plays, so that moving on to the next sentence never
+#   waits on the disk or on decoding.
+# request() is given the next few sounds of the playlist (see
+#   Playlist.upcoming()). The thread calls prefetch() on each one: a lazily
+#   loaded sound is decoded into this process's PCMCache (see ks_pcm.py), which
+#   is the bounded pool the buffers are kept in; a sound that is already
+#   decoded has its audio read into memory (see ks_pcm.warm()), which matters
+#   for a book played out of its bundle on disk.
+# played() is called as each playlist sound is started, and counts a hit if
+#   it had been prefetched by then, and a miss if not.
+# Only play_sounds() has a Prefetcher, and only if it is given a decode_ahead.
+################################################################################
+class Prefetcher:
+
+    def __init__(self, ahead):
+        self.ahead = ahead
+        self.requests = queue.Queue()
+        self.requested = set()  # ids of the sounds asked for, and not yet played
+        self.ready = set()      # ids of the sounds prefetched, and not yet played
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+
+    # Ask for some sounds to be prefetched (those already asked for are skipped).
+    def request(self, sounds):
+        with self.lock:
+            for s_obj in sounds:
+                if s_obj.id not in self.requested:
+                    self.requested.add(s_obj.id)
+                    self.requests.put(s_obj)
+
+    # Count a sound that is being started as a hit or a miss.
+    def played(self, s_obj):
+        with self.lock:
+            if s_obj.id in self.ready:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.ready.discard(s_obj.id)
+            self.requested.discard(s_obj.id)
+
+    # The background thread.
+    def run(self):
+        while True:
+            s_obj = self.requests.get()
+            s_obj.prefetch()
+            with self.lock:
+                if s_obj.id in self.requested:
+                    self.ready.add(s_obj.id)
+
+################################################################################
+# NowPlaying - Where play_sounds() is in the playlist, shared with the keystroke
+#   process, so that it can pause and later resume at the same place.
+# A small shared-memory array, written only by play_sounds() (and by stop()
+#   and pause(), which stop the clock), and read with read():
+#   index, sound_id: the last playlist sound that started playing
+#   start_frame: the frame of that sound it started playing from
+#   started_at, stopped_at: time.monotonic() times it started and stopped
+#                           playing (stopped_at is 0 while it is playing)
+# Sounds played straight off the queue do not change it: only the playlist's
+#   sounds are being listened through, and need to be resumed.
+# (time.monotonic() is the same clock in every process on the machine.)
+################################################################################
+class NowPlaying:
+
+    INDEX, SOUND_ID, START_FRAME, STARTED_AT, STOPPED_AT = range(5)
+
+    def __init__(self):
+        self.slot = multiprocessing.Array('d', [-1, -1, 0, 0, 0])
+
+    # Called by play_sounds() as a playlist sound starts being heard.
+    def start(self, index, sound_id, start_frame=0, started_at=None):
+        with self.slot.get_lock():
+            self.slot[:] = [index, sound_id, start_frame,
+                            time.monotonic() if started_at is None else started_at, 0]
+
+    # Stop the clock, if a playlist sound is playing.
+    def stop(self):
+        with self.slot.get_lock():
+            if self.slot[self.INDEX] >= 0 and not self.slot[self.STOPPED_AT]:
+                self.slot[self.STOPPED_AT] = time.monotonic()
+
+    # Forget the position, when a new playlist is loaded.
+    def reset(self):
+        with self.slot.get_lock():
+            self.slot[:] = [-1, -1, 0, 0, 0]
+
+    # Returns a tuple: (index, sound_object, frame), the frame being the one
+    #   the sound has played up to (its num_frames if it played to the end),
+    #   or None if no playlist sound has played since the playlist was loaded.
+    def read(self):
+        with self.slot.get_lock():
+            index, sound_id, start_frame, started_at, stopped_at = self.slot[:]
+        if index < 0:
+            return None
+        s_obj = ks_reg.lookup(int(sound_id))
+        if s_obj is None:
+            # Released since it was played (see ks_reg.release()).
+            return None
+        played = (stopped_at or time.monotonic()) - started_at
+        frame = min(int(start_frame + played * s_obj.sample_rate), s_obj.num_frames)
+        return (int(index), s_obj, frame)
+
+# Once a sound has played for its full length, the audio device may still be
+#   finishing its last buffer. This is how long to wait in between checking.
+TAIL_WAIT = 0.002
 
 ################################################################################
 # Function to play sounds
 # This is the "consumer". It runs in a separate thread.
-# Inputs: input_q: a JoinableQueue of sound_objects
-#         input_q: a JoinableQueue for logging
-#         hold_queue_e: a stop-modifying-the-queue multiprocessing.Event
-#         stop_playing_e: a stop-playing-sounds multiprocessing.Event
+# Inputs: input_q: a SoundQueue of sound ids and commands
+#         log_q: a JoinableQueue for logging
+#         sounds: a ks_reg.snapshot() of the sound registry, taken after all
+#                 sounds were loaded (None to keep this process's registry,
+#                 as a thread always does)
+#         prefetch_depth: None to play each sound on its own, as below, or a
+#                         number of sounds to play continuously, through
+#                         play_sounds_continuous().
+#         decode_ahead: how many of the playlist's next sounds to get ready
+#                       while one plays (see Prefetcher); None to not.
+# This is one loop, that carries out the messages on input_q in order. While
+#   a sound plays, it waits on the queue itself, with a timeout of however
+#   long the sound has left to play: so it wakes up as soon as a STOP (or any
+#   other message) comes in, and otherwise only when the sound should be over.
+#   Sounds and playlist commands that come in while a sound plays wait their
+#   turn; STOP, FLUSH, PAUSE and SHUTDOWN are carried out as they come in.
+# Returns once it gets a SHUTDOWN.
+# For each sound played, the CPU time this process used while it played is
+#   logged, as is the time it was stopped at, if it was stopped. With
+#   decode_ahead, the prefetch hits and misses so far are logged too.
 ################################################################################
-def play_sounds(input_q, log_q, hold_queue_e, stop_playing_e):
+def play_sounds(input_q, log_q, sounds=None, prefetch_depth=None, decode_ahead=None):
+
+    # Take over the registry built by the keystroke process, so that the ids
+    #   coming through input_q resolve to the same sounds here. (A thread of
+    #   the keystroke process already has it.)
+    if sounds is not None and not input_q.local:
+        ks_reg.install(sounds)
 
     ks_log.log("SOUNDS: START", log_q)
 
-    # Loop waiting for a sound to appear in the queue.
-    while True:
+    prefetcher = Prefetcher(decode_ahead) if decode_ahead else None
 
-        # Only continue to get the next item from the queue if the keystroke_processor
-        #    is NOT holding the queue to clear it...
-        #   (This could occur if a sound is stopped and it loops back around to here.)
-        if not hold_queue_e.is_set():
+    if prefetch_depth:
+        play_sounds_continuous(input_q, log_q, prefetch_depth, prefetcher)
+        ks_log.log("SOUNDS: END", log_q)
+        return
 
-            ks_log.log("SOUNDS: WAITING for queue item", log_q)
+    playlist = Playlist()
+    pending = collections.deque()  # messages off the queue, waiting their turn
+    playing = None  # the sound playing: (PlayObject, generation, sound_object, index)
 
-            # Wait here for a sound object to get put into the play-queue.
-            sound_obj = input_q.get()  # Get the next sound from the queue.
-            sound_name = sound_obj.name
+    # Done with the sound that is playing: stopped part way, or played through.
+    def finish(stopped):
+        object_playing, generation, sound_obj, index = playing
+        if stopped:
+            # Stop playing the sound.
+            object_playing.stop()
+            ks_log.log("SOUNDS: STOP sounded " + sound_obj.name + " - stop command", log_q)
+        if index is not None:
+            input_q.now_playing.stop()
 
-            # Clear a stop-playing event() if one is hanging around, uncleared.
-            stop_playing_e.clear()
+        ks_log.log("SOUNDS: CPU {:.6f} seconds playing ".format(
+            time.process_time() - cpu_start) + sound_obj.name, log_q)
+        ks_log.log("SOUNDS: STOP sound " + sound_obj.name + " - finished playing", log_q)
 
-            ks_log.log("SOUNDS: got sound " + sound_name + " from queue", log_q)
+        # Signal that this process is done with the sound-object in the queue.
+        if index is None:
+            input_q.task_done()
+            ks_log.log('SOUNDS: "task done" for sound ' + sound_obj.name + " - finished playing", log_q)
 
-            # If the keystroke_processor is holding the queue to clear it...
-            if hold_queue_e.is_set():
+    # Drop every message waiting its turn, without carrying it out. (But not
+    #   a RELEASE: it is not stopped, like the sounds are.)
+    def drop_pending():
+        kept = [message for message in pending if message[1] == Command.RELEASE]
+        for i in range(len(pending) - len(kept)):
+            input_q.task_done()
+        pending.clear()
+        pending.extend(kept)
 
-                # Do nothing with the sound object. It will be cleared after this if-then loop.
-                pass
+    # Loop waiting for a message to appear in the queue.
+    while True:
 
-                ks_log.log("SOUNDS: DUMPING sound " + sound_name + "without playing it", log_q)
+        # Nothing playing: start the next sound, if there is one.
+        while playing is None:
 
-            # Else the keystroke_processor is NOT holding the queue, so proceed...
-            else:
+            # If the playlist is playing, its next sound comes before the queue.
+            next_sound = playlist.peek(input_q)
+            if next_sound is not None:
+                index = playlist.cursor
+                playlist.advance()
+                generation, sound_obj, frame = next_sound
+                ks_log.log("SOUNDS: got sound " + sound_obj.name + " from playlist", log_q)
+                if prefetcher is not None:
+                    prefetcher.played(sound_obj)
+                    prefetcher.request(playlist.upcoming(input_q, prefetcher.ahead))
+                    ks_log.log("SOUNDS: PREFETCH {} hits {} misses".format(
+                        prefetcher.hits, prefetcher.misses), log_q)
 
-                # Start playing the sound.
-                object_playing = sound_obj.waveobject.play()
+            elif pending:
+                generation, command, sound_obj = pending.popleft()
+                index = None
+                frame = 0
 
-                ks_log.log("SOUNDS: START sound " + sound_name, log_q)
+                # Nothing before it is playing, so its sounds can be let go of.
+                if command == Command.RELEASE:
+                    input_q.forget(sound_obj)
+                    input_q.task_done()
+                    ks_log.log("SOUNDS: RELEASE {} sounds".format(len(sound_obj[1])), log_q)
+                    continue
 
-                # Loop here playing the sound until it is done, unless a stop-playing event was set.
-                while object_playing.is_playing():  # and (not input_clear_e.is_set()):
+                # A playlist command: carry it out, and go back for the next sound.
+                # (A cue is played like any other sound here. It is only mixed
+                #   over the other sounds in play_sounds_continuous().)
+                if command != Command.PLAY and command != Command.CUE:
+                    playlist.apply(input_q, generation, command, sound_obj)
+                    input_q.task_done()
+                    ks_log.log("SOUNDS: playlist command {} at {}".format(command,
+                        playlist.cursor), log_q)
+                    continue
 
-                    # ks_log.log("SOUNDS: playing " + sound_name, log_q)
+                ks_log.log("SOUNDS: got sound " + sound_obj.name + " from queue", log_q)
 
-                    # If a stop-playing event was set.
-                    if stop_playing_e.is_set():
-                        # Stop playing the sound.
-                        object_playing.stop()  # Stop playing the sound.
-                        ks_log.log("SOUNDS: STOP sounded " + sound_name + " - stop event", log_q)
-                        # Clear the stop-playing event()
-                        stop_playing_e.clear()
-                        break
+                # If the queue was stopped since this sound was put on it...
+                if (input_q.is_stale_cue(generation) if command == Command.CUE
+                        else input_q.is_stale(generation)):
+                    # Do nothing with the sound object.
+                    ks_log.log("SOUNDS: DUMPING sound " + sound_obj.name + " without playing it", log_q)
+                    input_q.task_done()
+                    continue
+
+            else:
+                break
 
-                    # Wait 1/100 of a second to ease the burden on the CPU.
-                    time.sleep(0.01)
+            # Start playing the sound (part way through, if it is being resumed).
+            playing = (sound_obj.waveobject_from(frame).play(), generation, sound_obj, index)
+            finish_time = time.monotonic() + sound_obj.duration(frame)
+            input_q.played()
+            cpu_start = time.process_time()
+            if index is not None:
+                input_q.now_playing.start(index, sound_obj.id, frame)
 
-                ks_log.log("SOUNDS: STOP sound " + sound_name + " - finished playing", log_q)
+            ks_log.log("SOUNDS: START sound " + sound_obj.name, log_q)
 
-                # End of if-then
+        # Wait for the next message, but only until the sound playing should be over.
+        if playing is None:
+            ks_log.log("SOUNDS: WAITING for queue item", log_q)
+            timeout = None
+        else:
+            timeout = max(finish_time - time.monotonic(), TAIL_WAIT)
+        try:
+            generation, command, arg = input_q.get(timeout=timeout)
+        except queue.Empty:
+            command = None
+
+        if command is None:
+            pass
+
+        # Stop the sound, if it was put on the queue before the STOP.
+        elif command == Command.STOP:
+            if playing is not None and input_q.is_stale(playing[1]):
+                finish(stopped=True)
+                playing = None
+            input_q.task_done()
 
-            # Signal that this process is done with the sound-object in the queue.
-            #   regardless of whether anything was done with the sound-object.
+        # Drop everything queued before the FLUSH, but let the sound finish.
+        elif command == Command.FLUSH:
+            drop_pending()
+            playlist.stop()
             input_q.task_done()
 
-            ks_log.log('SOUNDS: "task done" for sound ' + sound_name + " - finished playing", log_q)
+        # Stop the playlist, and its sound if one is playing.
+        elif command == Command.PAUSE:
+            playlist.stop()
+            if playing is not None and playing[3] is not None:
+                finish(stopped=True)
+                playing = None
+            input_q.task_done()
+
+        elif command == Command.SHUTDOWN:
+            if playing is not None:
+                finish(stopped=True)
+            drop_pending()
+            input_q.task_done()
+            break
+
+        # Anything else waits its turn.
+        else:
+            pending.append((generation, command, arg))
+
+        # The sound has played through.
+        if playing is not None and not playing[0].is_playing():
+            finish(stopped=False)
+            playing = None
 
     ks_log.log("SOUNDS: END", log_q)
-    
+
+################################################################################
+# Function to play sounds continuously, with no gaps in between them.
+# This is the "consumer" when play_sounds() is given a prefetch_depth.
+# Inputs: input_q: a SoundQueue of sound ids and playlist commands
+#         log_q: a JoinableQueue for logging
+#         prefetch_depth: how many sounds to feed to the stream ahead of time
+#         prefetcher: a Prefetcher, to get the playlist's sounds ready before
+#                     they are fed to the stream, or None
+# Rather than playing each sound on its own, this keeps a ks_stream.PCMStream
+#   open and feeds it the sounds as they come off the queue, so the stream
+#   always has the next prefetch_depth sounds lined up. Sounds are only handed
+#   back to the queue (task_done()) once the stream is done with them.
+# The playlist is played just as in play_sounds(), ahead of anything queued
+#   after the command that started it. Its sounds are marked as now playing
+#   by the stream, at the time they are heard.
+# A STOP needs nothing more done here: the stream drops stopped sounds itself
+#   (see ks_stream.py). FLUSH, PAUSE and SHUTDOWN are carried out as they come
+#   off the queue, as in play_sounds(). A new stream is opened only when a
+#   sound comes along in a different format, once the old one has finished
+#   playing.
+# Cues (see SoundQueue.cue()) skip the line: each goes straight to the
+#   stream's cue channel as it comes off the queue, and is mixed in over
+#   whatever the stream is playing. A cue in a different format from the
+#   stream's is converted to the stream's format first (see ks_norm.convert()),
+#   so that it is mixed in all the same. It is converted only the first time it
+#   is cued, and kept for the next (until it is released), so the conversion
+#   is not done again on every key press.
+################################################################################
+def play_sounds_continuous(input_q, log_q, prefetch_depth, prefetcher=None):
+
+    # Imported here, so sounddevice is only needed for continuous playback.
+    import ks_stream
+
+    stream = None
+    playlist = Playlist()
+    pending = collections.deque()  # items off the queue, not yet fed to the stream
+    converted = dict()  # (sound id, stream format) -> the audio of a cue, converted
+
+    # Called by the stream as each sound starts being heard.
+    def started(item, heard_at):
+        input_q.played(heard_at)
+        sound_obj, index, frame = item
+        if index is not None:
+            input_q.now_playing.start(index, sound_obj.id, frame, heard_at)
+
+    def open_stream(sound_format):
+        ks_log.log("SOUNDS: OPEN stream {} channels, {} bytes, {} Hz".format(
+            *sound_format), log_q)
+        return ks_stream.PCMStream(*sound_format, input_q.generation, on_start=started,
+                                   cue_generation=input_q.cue_generation)
+
+    def format_of(sound_obj):
+        return (sound_obj.num_channels, sound_obj.bytes_per_sample, sound_obj.sample_rate)
+
+    while True:
+
+        # Hand back the sounds the stream is done with (played or flushed).
+        # (Only sounds that came off the queue are handed back to it.)
+        if stream is not None:
+            for sound_obj, index, frame in stream.collect():
+                if index is None:
+                    input_q.task_done()
+                    ks_log.log('SOUNDS: "task done" for sound ' + sound_obj.name, log_q)
+
+        # Drop any sounds flushed by stop_sounds() before they reach the stream,
+        #   and send the cues straight to the stream's cue channel.
+        current = collections.deque()
+        for generation, command, arg in pending:
+            if (command == Command.PLAY and input_q.is_stale(generation) or
+                    command == Command.CUE and input_q.is_stale_cue(generation)):
+                input_q.task_done()
+                ks_log.log("SOUNDS: DUMPING sound " + arg.name + " without playing it", log_q)
+            elif command == Command.CUE:
+                if stream is None:
+                    stream = open_stream(format_of(arg))
+                if stream.format == format_of(arg):
+                    audio = arg.audio_data()
+                else:
+                    audio = converted.get((arg.id, stream.format))
+                    if audio is None:
+                        audio = ks_norm.convert(arg.audio_data(), format_of(arg), stream.format)
+                        converted[(arg.id, stream.format)] = audio
+                        ks_log.log("SOUNDS: CONVERT cue " + arg.name, log_q)
+                stream.cue((arg, None, 0), generation, audio)
+                ks_log.log("SOUNDS: CUE sound " + arg.name, log_q)
+            else:
+                current.append((generation, command, arg))
+        pending = current
+
+        # Keep the stream fed, up to prefetch_depth sounds ahead.
+        while stream is None or stream.depth() < prefetch_depth:
+            index = playlist.cursor
+            next_sound = playlist.peek(input_q)
+            if next_sound is None:
+                if not pending:
+                    break
+                generation, command, arg = pending[0]
+                if command == Command.RELEASE:
+                    # Wait for the stream to be done with its sounds.
+                    sound_ids = set(arg[1])
+                    if stream is not None and stream.holds(lambda item: item[0].id in sound_ids):
+                        break
+                    pending.popleft()
+                    input_q.forget(arg)
+                    for key in [key for key in converted if key[0] in sound_ids]:
+                        del converted[key]
+                    input_q.task_done()
+                    ks_log.log("SOUNDS: RELEASE {} sounds".format(len(sound_ids)), log_q)
+                    continue
+                if command != Command.PLAY:
+                    pending.popleft()
+                    playlist.apply(input_q, generation, command, arg)
+                    input_q.task_done()
+                    continue
+                next_sound = (generation, arg, 0)
+                index = None
+            generation, sound_obj, frame = next_sound
+            sound_format = format_of(sound_obj)
+            if stream is None or stream.format != sound_format:
+                # Let the old stream finish before opening one in the new format.
+                if stream is not None and stream.busy():
+                    break
+                if stream is not None:
+                    stream.close()
+                stream = open_stream(sound_format)
+            if index is None:
+                pending.popleft()
+            else:
+                playlist.advance()
+                if prefetcher is not None:
+                    prefetcher.played(sound_obj)
+                    prefetcher.request(playlist.upcoming(input_q, prefetcher.ahead))
+                    ks_log.log("SOUNDS: PREFETCH {} hits {} misses".format(
+                        prefetcher.hits, prefetcher.misses), log_q)
+            stream.feed((sound_obj, index, frame), generation, sound_obj.audio_data(frame))
+            ks_log.log("SOUNDS: START sound " + sound_obj.name, log_q)
+
+        # Wait for the next message, but only until the stream is next done with a sound.
+        try:
+            generation, command, arg = input_q.get(
+                timeout=None if stream is None else stream.next_due())
+        except queue.Empty:
+            continue
+
+        # Drop everything queued before the FLUSH (but a RELEASE), but let the
+        #   sound playing finish.
+        if command == Command.FLUSH or command == Command.SHUTDOWN:
+            kept = collections.deque(message for message in pending
+                                     if message[1] == Command.RELEASE and command == Command.FLUSH)
+            for i in range(len(pending) - len(kept)):
+                input_q.task_done()
+            pending = kept
+            playlist.stop()
+            if stream is not None and command == Command.FLUSH:
+                stream.drop(lambda item: True, keep_playing=True)
+
+        # Stop the playlist, and drop its sounds from the stream.
+        elif command == Command.PAUSE:
+            playlist.stop()
+            if stream is not None:
+                stream.drop(lambda item: item[1] is not None)
+
+        elif command != Command.STOP:
+            pending.append((generation, command, arg))
+            continue
+
+        input_q.task_done()
+        if command == Command.SHUTDOWN:
+            if stream is not None:
+                stream.close()
+            return
@@ -0,0 +1,115 @@
+################################################################################
+# test_ks_launch - The play_sounds() consumer behaves the same, however it is
+#   launched (see ks_launch.py): as a forked process, or as a thread.
+################################################################################
+# Run from this directory with:
+#   python3 -m pytest test_ks_launch.py
+# No audio device is needed: sounds are played by conftest.TimedWave, which
+#   just keeps time. The modules under test are the same in system-1, -2 and -3.
+################################################################################
+
+# Packages
+import multiprocessing
+import os
+import struct
+import time
+import wave
+
+import pytest
+
+# Local imports - "ks" stands for "key_sounds".
+import ks_launch
+import ks_o
+import ks_play
+import ks_reg
+
+# The format of the test sounds: 16-bit mono at RATE Hz, SECONDS long.
+RATE = 8000
+SECONDS = 1.0
+
+# The launch methods to test, of those this platform has.
+METHODS = ["thread"] + (["fork"] if "fork" in multiprocessing.get_all_start_methods() else [])
+
+################################################################################
+# Helpers.
+################################################################################
+
+# Write a wave file of one constant sample, and load it as a sound_object.
+def make_sound(directory, filename, sample):
+    wave_write = wave.open(os.path.join(directory, filename), "wb")
+    wave_write.setnchannels(1)
+    wave_write.setsampwidth(2)
+    wave_write.setframerate(RATE)
+    wave_write.writeframes(struct.pack("<h", sample) * int(SECONDS * RATE))
+    wave_write.close()
+    return ks_o.sound_object(str(directory), filename)
+
+# A consumer launched with each method, playing a play-queue, with a playlist
+#   of three sounds to play: (sound_q, sounds, consumer).
+@pytest.fixture(params=METHODS)
+def launched(request, tmp_path, timed_audio):
+    method = ks_launch.METHOD
+    ks_launch.use(request.param)
+    sounds = [make_sound(tmp_path, "{:03d}.wav".format(i), 1000 * (i + 1)) for i in range(3)]
+    sound_q = ks_launch.sound_queue()
+    consumer = ks_launch.process(ks_play.play_sounds, args=(sound_q, None, ks_reg.snapshot()))
+    consumer.daemon = True
+    consumer.start()
+    yield sound_q, sounds, consumer
+    if consumer.is_alive():
+        sound_q.shutdown()
+        consumer.join(5)
+    ks_launch.use(method)
+
+################################################################################
+# Tests.
+################################################################################
+
+# A paused sound resumes from the frame it was paused at, not from its start.
+def test_pause_and_resume_at_the_same_frame(launched):
+    sound_q, sounds, consumer = launched
+    sent = time.monotonic()
+    sound_q.load_playlist(sounds)
+    time.sleep(0.3)
+    sound_q.pause()
+    paused = time.monotonic()
+    sound_q.join()
+    index, s_obj, paused_at = sound_q.now_playing.read()
+    assert (index, s_obj.id) == (0, sounds[0].id)
+    assert 0 < paused_at <= (paused - sent) * RATE
+
+    # Paused, the position stays put.
+    time.sleep(0.1)
+    assert sound_q.now_playing.read()[2] == paused_at
+
+    sound_q.resume()
+    sound_q.join()
+    time.sleep(0.1)
+    index, s_obj, frame = sound_q.now_playing.read()
+    assert (index, s_obj.id) == (0, sounds[0].id)
+    assert paused_at < frame < paused_at + 0.3 * RATE
+
+# A seek (after a stop, as AudiobookPlayer does it) plays from the sound sought.
+def test_seek(launched):
+    sound_q, sounds, consumer = launched
+    sound_q.load_playlist(sounds)
+    time.sleep(0.1)
+    sound_q.stop()
+    sound_q.seek(2)
+    sound_q.join()
+    time.sleep(0.1)
+    index, s_obj, frame = sound_q.now_playing.read()
+    assert (index, s_obj.id) == (2, sounds[2].id)
+    assert 0 < frame < 0.3 * RATE
+
+# A shutdown stops the consumer part way through a sound, and it can be joined.
+def test_shutdown_and_join(launched):
+    sound_q, sounds, consumer = launched
+    sound_q.load_playlist(sounds)
+    time.sleep(0.1)
+    start = time.monotonic()
+    sound_q.shutdown()
+    consumer.join(5)
+    assert not consumer.is_alive()
+    assert time.monotonic() - start < SECONDS / 2
+    sound_q.join()
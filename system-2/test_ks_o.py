@@ -0,0 +1,113 @@
+################################################################################
+# test_ks_o - The AudiobookPlayer's modes start and stop the narration as the
+#   listener moves between them, with overlay_cues (see ks_o.py).
+################################################################################
+# Run from this directory with:
+#   python3 -m pytest test_ks_o.py
+# Nothing is played: the player's play-queue has no consumer, and the tests
+#   look at the messages the player put on it.
+################################################################################
+
+# Packages
+import os
+import struct
+import wave
+
+import pytest
+
+# Local imports - "ks" stands for "key_sounds".
+import ks_o
+import ks_play
+from ks_o import Button
+from ks_play import Command
+
+# The format of the test book's sounds: 16-bit mono at RATE Hz, SECONDS long.
+RATE = 8000
+SECONDS = 0.1
+
+################################################################################
+# Helpers.
+################################################################################
+
+# Write a wave file of one constant sample.
+def write_wave(path, sample):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    wave_write = wave.open(path, "wb")
+    wave_write.setnchannels(1)
+    wave_write.setsampwidth(2)
+    wave_write.setframerate(RATE)
+    wave_write.writeframes(struct.pack("<h", sample) * int(SECONDS * RATE))
+    wave_write.close()
+
+# Write a book of two chapters, of three sentences each, laid out as
+#   ks_o.Audiobook reads it.
+def write_book(book_path):
+    write_wave(os.path.join(book_path, "Book_Title.wav"), 1)
+    for chapter in (1, 2):
+        write_wave(os.path.join(book_path, "Chapter_Names", "Ch{:02d}.wav".format(chapter)),
+                   10 * chapter)
+        for seq in (1, 2, 3):
+            write_wave(os.path.join(book_path, "Text_Content", "Ch{:02d}".format(chapter),
+                                    "{:03d}_CN_{:02d}.wav".format(seq, seq)), 100 * chapter + seq)
+
+# The (command, argument) of every message put on the play-queue since last time.
+def sent(sound_q):
+    messages = list()
+    while not sound_q.empty():
+        generation, command, arg, key_number = sound_q.queue.get_nowait()
+        messages.append((command, arg))
+    return messages
+
+# The sound ids of each playlist loaded, of some messages.
+def playlists(messages):
+    return [list(arg[0]) for command, arg in messages if command == Command.LOAD_PLAYLIST]
+
+# The sound ids of a chapter of the player's book, in order.
+def chapter_ids(player, number):
+    data = player.book.chapters[number].data
+    return [data[seq].id for seq in sorted(data)]
+
+# An AudiobookPlayer of the test book, with overlay_cues, and its play-queue
+#   (a thread's, so that there is no registry to hand over), in PlayMode,
+#   narrating chapter 1.
+@pytest.fixture
+def playing(tmp_path, monkeypatch):
+    write_book(str(tmp_path / "book"))
+    monkeypatch.chdir(os.path.dirname(os.path.abspath(__file__)))   # for sfx/
+    sound_q = ks_play.SoundQueue(local=True)
+    player = ks_o.AudiobookPlayer([str(tmp_path / "book")], sound_q, overlay_cues=True)
+    player.on_button(Button.PLAYPAUSE)
+    player.on_button(Button.PLAYPAUSE)
+    assert isinstance(player.mode(), ks_o.PlayMode) and player.narrating
+    assert playlists(sent(sound_q)) == [chapter_ids(player, 1)]
+    return player, sound_q
+
+################################################################################
+# Tests.
+################################################################################
+
+# Leaving PlayMode (with ';') stops the narration, and a chapter picked after
+#   that is the one played.
+def test_pop_change_chapter_and_play(playing):
+    player, sound_q = playing
+    player.pop_mode()
+    assert isinstance(player.mode(), ks_o.PausedMode)
+    assert not player.narrating
+    assert (Command.STOP, None) in sent(sound_q)
+
+    player.on_button(Button.SKIPF)
+    assert player.book.state['chapter'] == 2
+    player.on_button(Button.PLAYPAUSE)
+    assert isinstance(player.mode(), ks_o.PlayMode) and player.narrating
+    assert playlists(sent(sound_q)) == [chapter_ids(player, 2)]
+
+# Going into help and back plays over the narration, without stopping it or
+#   loading the chapter again.
+def test_help_leaves_the_narration_playing(playing):
+    player, sound_q = playing
+    player.push_mode(ks_o.InfoMode(player))
+    player.pop_mode()
+    assert isinstance(player.mode(), ks_o.PlayMode) and player.narrating
+    messages = sent(sound_q)
+    assert (Command.STOP, None) not in messages
+    assert playlists(messages) == []
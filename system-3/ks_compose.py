@@ -0,0 +1,108 @@
+################################################################################
+# ks_compose - Joins the sounds of a multi-part announcement into one sound.
+################################################################################
+# Used by ks_main.py and ks_o.py, to play prompts made of several sounds.
+#
+# Many keypresses play the same few sounds one after another, e.g. the help
+#   for selecting a book: SELECT_BOOK, SCROLL_BOOK, PRESS_L, PRESS_SC,
+#   PRESS_SPACE_SELECT_BOOK. Put on the play-queue one by one, each sound
+#   costs its own message, its own lookup, and its own stream start (and, with
+#   simpleaudio, its own gap).
+#
+# compose() instead joins the audio of such a sequence, end to end, into one
+#   buffer, and makes a single sound_object of it, which is played as one item.
+#   The composed sound is kept in a PromptCache, by the ids of the sounds in
+#   it, so the next time the same sequence is played it costs nothing to make.
+#   Once the cache holds CACHE_SIZE sequences, the least-recently-played one
+#   is dropped.
+#
+# The composed audio goes into the PCM arena like any other sound (see
+#   ks_pcm.py), so it pickles to a few bytes and is handed to play_sounds()
+#   like a sound loaded late (see ks_reg.py). A dropped sequence is released
+#   through the play-queue (see SoundQueue.release() in ks_play.py), so that
+#   it is not let go of while play_sounds() may still have it queued, and its
+#   region of the arena is freed once it is not.
+#
+# Sounds can only be joined if they are all in the same format, which they
+#   are if ks_norm.CANONICAL_FORMAT is set. A sequence that is not is played
+#   as separate sounds, as before.
+################################################################################
+
+# Packages
+import collections
+
+# Local imports - "ks" stands for "key_sounds".
+import ks_pcm
+
+# How many composed sequences to keep, or None to play every sequence as
+#   separate sounds.
+CACHE_SIZE = 16
+
+# This process's cache of composed sequences, created by cache().
+CACHE = None
+
+################################################################################
+# PromptCache - The composed sequences, least-recently-played first.
+# get() returns the composed sound of a sequence, making it if need be, or
+#   None if the sounds cannot be joined.
+################################################################################
+class PromptCache:
+
+    def __init__(self, size):
+        self.size = size
+        self.composed = collections.OrderedDict()   # sound ids -> sound_object
+        self.hits = 0
+        self.misses = 0
+
+    # sound_q: the play-queue, to release dropped sequences through.
+    def get(self, sounds, sound_q):
+        # Imported here, as ks_o.py imports this module.
+        import ks_o
+
+        key = tuple(s_obj.id for s_obj in sounds)
+        composed = self.composed.get(key)
+        if composed is not None:
+            self.hits += 1
+            self.composed.move_to_end(key)
+            return composed
+
+        formats = {(s_obj.num_channels, s_obj.bytes_per_sample, s_obj.sample_rate)
+                   for s_obj in sounds}
+        if len(formats) != 1:
+            return None
+        self.misses += 1
+        (num_channels, bytes_per_sample, sample_rate), = formats
+        region = ks_pcm.arena().store(b"".join(s_obj.audio_data() for s_obj in sounds))
+        composed = ks_o.sound_object("", "+".join(s_obj.name for s_obj in sounds), audio=(
+            num_channels, bytes_per_sample, sample_rate,
+            sum(s_obj.num_frames for s_obj in sounds), region))
+        self.composed[key] = composed
+        self.evict(sound_q)
+        return composed
+
+    def evict(self, sound_q):
+        while len(self.composed) > self.size:
+            key, composed = self.composed.popitem(last=False)
+            sound_q.release([composed])
+
+################################################################################
+# cache() - This process's PromptCache, created the first time it is needed.
+################################################################################
+def cache():
+    global CACHE
+    if CACHE is None:
+        CACHE = PromptCache(CACHE_SIZE)
+    return CACHE
+
+################################################################################
+# compose() - The sounds to play for a sequence of sounds: a list of just the
+#   one composed sound, or, if they cannot be joined (or there is nothing to
+#   join), the sounds as they are.
+# sound_q: the play-queue the sounds are to be played on.
+################################################################################
+def compose(sounds, sound_q):
+    sounds = list(sounds)
+    if CACHE_SIZE is None or len(sounds) < 2:
+        return sounds
+    composed = cache().get(sounds, sound_q)
+    return sounds if composed is None else [composed]
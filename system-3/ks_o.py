@@ -8,26 +8,87 @@
 ################################################################################
 
 # Packages
+import bisect
 import simpleaudio # simpleaudio-1.0.2
 import ks_stop
 import ks_log
+import ks_bundle
+import ks_compose
+import ks_manifest
+import ks_pcm
+import ks_reg
 import os
-import re
 ################################################################################
 # A sound_object has the following member variables:
 #   waveobject: a simpleaudio WaveObject, which can get played with play()
 #   name: a string of the filename (including the ".wav" extension)
+#   id: the sound's id in the sound registry (see ks_reg.py)
+#   num_channels, bytes_per_sample, sample_rate, num_frames: the audio format
+#   pcm: the (path, offset, nbytes) region of the PCM arena holding the audio
+#        (None if the sound is lazily loaded)
+#   filepath: the path of the wave file on disk
+# The audio is decoded once into the shared PCM arena (see ks_pcm.py). A
+#   sound_object holds only the region, so it pickles to a few bytes, and the
+#   waveobject plays straight out of the arena without copying.
+# If lazy loading is turned on (ks_pcm.LAZY_BUDGET), only the wave header is
+#   read here, and the audio is decoded on the first play() or prefetch().
+# If the audio is passed in, already decoded (e.g. by ks_pcm.load_waves(), or
+#   from a bundle, see ks_bundle.py), the wave file is not read at all.
 ################################################################################
 
 class sound_object:
 
-    def __init__(self, path, filename, page=None, cc=None):
-        # Create a simpleaudio.WaveObject for playing the sound using the filename.
-        self.waveobject = simpleaudio.WaveObject.from_wave_file(os.path.join(path, filename))
+    def __init__(self, path, filename, page=None, cc=None, audio=None):
+        self.filepath = os.path.join(path, filename)
+        if audio is not None:
+            # Already decoded: (num_channels, bytes_per_sample, sample_rate, num_frames, pcm)
+            (self.num_channels, self.bytes_per_sample, self.sample_rate,
+                self.num_frames, self.pcm) = audio
+        elif ks_pcm.LAZY_BUDGET is None:
+            # Decode the wave file into the shared PCM arena.
+            (self.num_channels, self.bytes_per_sample, self.sample_rate,
+                self.num_frames, self.pcm) = ks_pcm.load_wave(self.filepath)
+        else:
+            # Just read the format; the audio is decoded when it is needed.
+            (self.num_channels, self.bytes_per_sample, self.sample_rate,
+                self.num_frames) = ks_pcm.read_header(self.filepath)
+            self.pcm = None
         # object name
         self.name = filename # For tracing and debugging.
         self.page = page # page chapter, and cc added for filtering capability
         self.cc = cc
+        # Register the sound; only this id gets sent to the play_sounds() process.
+        self.id = ks_reg.register(self)
+
+    # A simpleaudio.WaveObject for playing the sound, straight out of the arena.
+    @property
+    def waveobject(self):
+        return self.waveobject_from(0)
+
+    # A simpleaudio.WaveObject for playing the sound from a frame onwards.
+    def waveobject_from(self, frame):
+        return simpleaudio.WaveObject(self.audio_data(frame), self.num_channels,
+                                      self.bytes_per_sample, self.sample_rate)
+
+    # A zero-copy memoryview of the decoded audio, from a frame onwards.
+    def audio_data(self, frame=0):
+        if self.pcm is None:
+            audio = memoryview(ks_pcm.cache().get(self.filepath))
+        else:
+            audio = ks_pcm.view(*self.pcm)
+        return audio[frame * self.num_channels * self.bytes_per_sample:]
+
+    # Decode a lazily loaded sound ahead of playing it (or, if it is already
+    #   decoded, read its audio into memory, see ks_pcm.warm()).
+    def prefetch(self):
+        if self.pcm is None:
+            ks_pcm.cache().get(self.filepath)
+        else:
+            ks_pcm.warm(*self.pcm)
+
+    # The length of the sound, from a frame onwards, in seconds.
+    def duration(self, frame=0):
+        return (self.num_frames - frame) / self.sample_rate
 
     # define equality operator to enable "in"
     def __eq__(self, other):
@@ -50,8 +111,10 @@ class SFX:
 
     def loaddir(self, path):
         # Load files as attributes of the SFX object; allows for sfx.ascend
-        for f in self.filenames:
-            setattr(self, f, sound_object(path, '{}.wav'.format(f)))
+        # (decoded all at once, in parallel, see ks_pcm.load_waves())
+        audio = ks_pcm.load_waves([os.path.join(path, '{}.wav'.format(f)) for f in self.filenames])
+        for f, a in zip(self.filenames, audio):
+            setattr(self, f, sound_object(path, '{}.wav'.format(f), audio=a))
 
 
 
@@ -79,79 +142,187 @@ class Audiobook:
 
     '''
     Data structure organizing all of the audio files for a particular audiobook.
+    Only the title is loaded when the book is opened. The chapter names are
+    loaded by load_names(), and the sentences of a chapter by load_chapter(),
+    when they are first needed; unload() lets them go again.
     '''
     def __init__(self, path):
         self.path = path
         self.chapters = {}
         self.title=None
-        self._load_files()
+        self._open()
         self.state = {
             'sequence': 0, # The sequence number of the current book segment (e.g. 1 for '001')
+            'frame': 0, # The audio frame within the current book segment to resume at
             'chapter': 0, # The chapter number of the current book segment (e.g. 1 for '001')
             'page': 0, # The page number of the current book segment (e.g. 34)
         }
-        self.state['chapter'] = min(self.chapters.keys())
+        self.state['chapter'] = min(self.catalog['chapters'].keys())
 
     def __repr__(self):
         return 'Audiobook(title={}, chapters={})'.format(self.title, self.chapters)
 
-    # book loader function (reimplemented to support arbitrary book paths)
-    def _load_files(self):
-        # load book title
-        self.title = sound_object(self.path, 'Book_Title.wav')
-
-        # load all files from each chapter
-        tcPath = os.path.join(self.path, 'Text_Content')
-        for chapter in os.listdir(tcPath):
-            # chapterData = {'name': None, 'data': {}}
-            if chapter.startswith('.'):
-                continue
-            # load chapter title audio file
-            chapterNameSound = sound_object(os.path.join(self.path, 'Chapter_Names'), '{}.wav'.format(chapter))
-            chapterData = self.AudiobookChapter(chapterNameSound)
-            # chTitleFile = os.path.join(self.path, 'Chapter_Names', '{}.wav', chapter)
-            mcn = re.search('Ch(\d{2})', chapter)
-            if mcn is not None:
-                ch_num = mcn.groups()[0]
-            else:
-                raise ValueError('Unable to parse chapter number from chapter "{}"'.format(chapter))
-            # else:
-            #     raise ValueError('No chapter title file found for chapter {}'.format(chapter))
-            # load chapter text content
-            chPath = os.path.join(tcPath, chapter)
-            for sentence in os.listdir(chPath):
-                if chapter.startswith('.'):
-                    continue
-                m = re.search('([0-9]{3})_(CN|SH|TS|RP)_([0-9]{2})\.wav', sentence)
-                if m is not None:
-                    # create sound_object with audio data
-                    seq, cc, page = m.groups()
-                    chapterData.data[int(seq)] = sound_object(chPath, sentence, int(page), cc)
-            self.chapters[int(ch_num)] = chapterData
+    # book opener function: finds the book's files without loading them, and
+    #   loads just the title. self.catalog is
+    #   {'title': entry, 'chapters': {number: {'name': entry, 'sentences': [entry, ...]}}}
+    #   with an entry for each file, from the book's bundle index if it has a
+    #   bundle (see ks_bundle.py, which makes it again if it is out of date),
+    #   or else from its manifest (see ks_manifest.py)
+    def _open(self):
+        self.bundle = ks_bundle.bundle_path(self.path)
+        index = ks_bundle.load(self.path)
+        if index is not None:
+            chapters = [(c['number'], c['name'], c['sentences']) for c in index['chapters']]
+        else:
+            self.bundle = None
+            index = ks_manifest.load(self.path)
+            chapters = [(c['chapter'], c['name'], c['sentences']) for c in index['chapters']]
+        self.catalog = {'title': index['title'],
+                        'chapters': {number: {'name': name, 'sentences': sentences}
+                                     for number, name, sentences in chapters}}
+        self.title = self._load([self.catalog['title']])[0]
+
+    # sound loader function: the sound_objects of some catalog entries, in order
+    def _load(self, entries):
+        if self.bundle is not None:
+            # straight out of the bundle, nothing to decode
+            return [sound_object(os.path.join(self.path, e['dir']), e['filename'],
+                                 e.get('page'), e.get('cc'), ks_bundle.audio(self.bundle, e))
+                    for e in entries]
+        # all at once, in parallel (see ks_pcm.load_waves())
+        paths = [os.path.join(self.path, e['path']) for e in entries]
+        audio = ks_pcm.load_waves(paths)
+        return [sound_object(*os.path.split(p), e.get('page'), e.get('cc'), a)
+                for p, e, a in zip(paths, entries, audio)]
+
+    def load_names(self):
+        '''
+        Load the name of every chapter (if they are not loaded already).
+        '''
+        if not self.chapters:
+            numbers = sorted(self.catalog['chapters'].keys())
+            names = self._load([self.catalog['chapters'][n]['name'] for n in numbers])
+            self.chapters = {n: self.AudiobookChapter(name) for n, name in zip(numbers, names)}
+
+    def load_chapter(self, number):
+        '''
+        Load the sentences of a chapter (if they are not loaded already).
+        '''
+        self.load_names()
+        chapter = self.chapters[number]
+        if not chapter.data:
+            sentences = self.catalog['chapters'][number]['sentences']
+            for sentence, sound in zip(sentences, self._load(sentences)):
+                chapter.push(sentence['seq'], sound)
+
+    def unload(self, sound_q):
+        '''
+        Let go of everything but the title; it is loaded again when it is needed.
+        The sounds are released through sound_q, so that their audio is freed
+        once the player process is done with them (see SoundQueue.release()).
+        '''
+        sounds = list()
+        for chapter in self.chapters.values():
+            sounds += [chapter.nameSound] + list(chapter.data.values())
+        if sounds:
+            sound_q.release(sounds)
+        self.chapters = {}
 
 
 class AudiobookPlayer:
     '''
     The main controller class of the system.
     @param books: a list of paths to book audio file directories
+    Opening a book loads only its title (see Audiobook), so the main menu
+    speaks as soon as every title is loaded, however big the library is. A
+    book the listener scrolls away from is unloaded again.
+    @param overlay_cues: if True, every sound the player plays (the prompts
+    and sound effects) is a cue, mixed in over the book's narration rather
+    than stopping it (see SoundQueue.cue()), so that going into help and
+    back leaves the narration playing (any other change of mode stops it,
+    see stop_for()). Needs continuous playback, which mixes them (the
+    simpleaudio player would play each one after the whole narration);
+    without it, leave it False, and the prompts stop the narration.
     '''
-    def __init__(self, books, sound_q, hold_q_e, stop_q_e, log_q=None):
+    def __init__(self, books, sound_q, log_q=None, overlay_cues=False):
         self.mode_stack = [MainMenuMode(self)] # Mode selection is implemented as a stack, to facilitate "back" functionality
         self.books = [Audiobook(b) for b in books]
         self.sound_q = sound_q
         self.log_q = log_q
-        self.hold_q_e = hold_q_e
-        self.stop_q_e = stop_q_e
+        self.overlay_cues = overlay_cues
+        self.narrating = False # True from when a chapter is loaded to play until it is stopped
         self.sfx = SFX('sfx/')
         self.book_index = 0
-        self.book = self.books[0] if 0 < len(self.books) else None
         self.mode().on_enter()
 
+    # the selected book
+    @property
+    def book(self):
+        return self.books[self.book_index] if 0 < len(self.books) else None
+
+    def select_book(self, i):
+        '''
+        Make book i the selected book, and unload the one scrolled away from.
+        '''
+        if i != self.book_index:
+            self.book.unload(self.sound_q)
+            self.book_index = i
+            self.narrating = False
+
     def stop_and_clear(self):
-        ks_stop.stop_sounds(self.sound_q, self.log_q, self.hold_q_e, self.stop_q_e)
+        '''
+        Stop the sounds the player has played. With overlay_cues, those are
+        only the cues, and the narration carries on.
+        '''
+        if self.overlay_cues:
+            self.sound_q.clear_cues()
+        else:
+            self.stop_narration()
+
+    def stop_narration(self):
+        '''
+        Stop everything, the narration included.
+        '''
+        ks_stop.stop_sounds(self.sound_q, self.log_q)
+        self.sound_q.clear_cues()
+        self.narrating = False
+
+    def stop_for(self, mode):
+        '''
+        Stop the sounds played, on the way from the current mode to mode (None
+        to quit). Only help (InfoMode) plays over the narration, so going into
+        help or back out of it stops just the cues; any other change of mode
+        stops the narration too.
+        '''
+        if isinstance(mode, InfoMode) or isinstance(self.mode(), InfoMode):
+            self.stop_and_clear()
+        else:
+            self.stop_narration()
+
+    def pause(self):
+        '''
+        Stop the narration where it is, to be resumed from there.
+        '''
+        self.sound_q.pause()
+        self.narrating = False
 
     def play(self, sound):
-        self.sound_q.put(sound)
+        if self.overlay_cues:
+            self.sound_q.cue(sound)
+        else:
+            self.sound_q.put(sound)
+
+    def play_sequence(self, sounds):
+        '''
+        Play several sounds one after another, joined into one sound if they
+        can be (see ks_compose.py).
+        '''
+        sounds = ks_compose.compose(sounds, self.sound_q)
+        if self.overlay_cues:
+            for sound in sounds:
+                self.sound_q.cue(sound)
+        else:
+            self.sound_q.put_many(sounds)
 
     def mode(self):
         return self.mode_stack[-1]
@@ -163,7 +334,7 @@ class AudiobookPlayer:
         if sound is a sound_object, sound is played.
         '''
         sound = self.sfx.ascend if sound is True else sound
-        self.stop_and_clear()
+        self.stop_for(mode)
         if sound:
             self.play(sound)
         self.mode().on_exit()
@@ -177,7 +348,7 @@ class AudiobookPlayer:
         if sound is a sound_object, sound is played.
         '''
         sound = self.sfx.descend if sound is True else sound
-        self.stop_and_clear()
+        self.stop_for(self.mode_stack[-2] if len(self.mode_stack) > 1 else None)
         if sound:
             self.play(sound)
 
@@ -227,8 +398,7 @@ class AudiobookMode:
 class MainMenuMode(AudiobookMode):
     def on_enter(self):
         ks_log.log('Entered MainMenuMode', self.player.log_q)
-        self.player.play(self.player.sfx.choose_a_book)
-        self.player.play(self.player.sfx.l_for_help)
+        self.player.play_sequence([self.player.sfx.choose_a_book, self.player.sfx.l_for_help])
 
     def on_button(self, b):
         if b is Button.PLAYPAUSE:
@@ -243,7 +413,7 @@ class MainMenuMode(AudiobookMode):
 
             try:
                 next_book_title = self.player.books[next_book].title
-                self.player.book_index = next_book
+                self.player.select_book(next_book)
             except IndexError:
                 if b is Button.SKIPB:
                     next_book_title = self.player.books[cur_book].title
@@ -263,8 +433,8 @@ class PausedMode(AudiobookMode):
     '''
     def on_enter(self):
         ks_log.log('Entered PausedMode', self.player.log_q)
-        self.player.play(self.player.sfx.choose_a_chapter)
-        self.player.play(self.player.sfx.l_for_help)
+        self.player.book.load_names()
+        self.player.play_sequence([self.player.sfx.choose_a_chapter, self.player.sfx.l_for_help])
         # player.sound_q.put() # play pause sound effect
 
     def on_button(self, b):
@@ -280,6 +450,10 @@ class PausedMode(AudiobookMode):
                 # next_ch_sound = self.player.book.chapter_names[next_ch]
                 next_ch_sound = self.player.book.chapters[next_ch].nameSound
                 self.player.book.state['chapter'] = next_ch
+                # A different chapter starts from its beginning.
+                self.player.book.state['sequence'] = 0
+                self.player.book.state['frame'] = 0
+                self.player.narrating = False
             except KeyError:
                 if b is Button.SKIPB:
                     next_ch_sound = self.player.book.chapters[cur_ch].nameSound
@@ -296,24 +470,48 @@ class PausedMode(AudiobookMode):
 class PlayMode(AudiobookMode):
     ''' PlayMode
     The primary mode used to play the bulk of audiobook content.
-    On enter, this mode enqueues all audiobook content past the
-    audiobook's current saved state.
+    On enter, this mode loads the current chapter as the player's
+    playlist, and plays it from the audiobook's current saved state.
+    On exit, it saves the state, so that playing again resumes there.
     '''
     def on_enter(self):
-        ch = self.player.book.state['chapter']
-        for s in sorted(self.player.book.chapters[ch].data.keys()):
-            if s >= self.player.book.state['sequence']:
-                self.player.sound_q.put(self.player.book.chapters[ch].data[s])
-
-    # def on_exit(self):
-    #     ch = self.player.book.state['chapter']
-    #     # print(dir(self.player.sound_q))
-    #     print(self.player.sound_q.qsize())
-    #     # seq = len(self.player.book.chapters[ch].data.keys()) - len(self.player.sound_q._unfinished_tasks)
-    #     # print(seq)
+        # Back from help, with the narration still playing under it.
+        if self.player.narrating:
+            return
+        self.player.book.load_chapter(self.player.book.state['chapter'])
+        chapter = self.player.book.chapters[self.player.book.state['chapter']]
+        sequence = sorted(chapter.data.keys())
+        start = bisect.bisect_left(sequence, self.player.book.state['sequence'])
+        # Resume part way through the segment, if that is where it was left.
+        frame = 0
+        if start < len(sequence) and sequence[start] == self.player.book.state['sequence']:
+            frame = self.player.book.state['frame']
+        self.player.sound_q.load_playlist([chapter.data[s] for s in sequence], start, frame)
+        self.player.narrating = True
+
+    def on_exit(self):
+        '''
+        Save the place the listener got to, as reported by the player process,
+        so that playing again (or returning from help) resumes at the very
+        word they stopped at.
+        '''
+        now_playing = self.player.sound_q.now_playing.read()
+        if now_playing is None:
+            return
+        index, sound, frame = now_playing
+        chapter = self.player.book.chapters[self.player.book.state['chapter']]
+        for seq, sentence in chapter.data.items():
+            if sentence.id == sound.id:
+                # A sentence that was played to the end is not played again.
+                if frame < sound.num_frames:
+                    self.player.book.state['sequence'], self.player.book.state['frame'] = seq, frame
+                else:
+                    self.player.book.state['sequence'], self.player.book.state['frame'] = seq + 1, 0
+                self.player.book.state['page'] = sentence.page
 
     def on_button(self, b):
         if b is Button.PLAYPAUSE:
+            self.player.pause()
             self.player.pop_mode(sound=self.player.sfx.pause)
             if not isinstance(self.player.mode(), PausedMode):
                 raise ValueError('PauseMode should always be directly beneath PlayMode in mode stack; stack ',
@@ -340,10 +538,10 @@ class InfoMode(AudiobookMode):
         elif b is Button.SKIPF:
             # book information
             self.player.stop_and_clear()
-            self.player.play(self.player.sfx.current_book_title)
-            self.player.play(self.player.book.title)
-            self.player.play(self.player.sfx.current_chapter_title)
-            self.player.play(self.player.book.chapters[self.player.book.state['chapter']].nameSound )
+            self.player.book.load_names()
+            self.player.play_sequence([self.player.sfx.current_book_title, self.player.book.title,
+                self.player.sfx.current_chapter_title,
+                self.player.book.chapters[self.player.book.state['chapter']].nameSound])
             pass
         elif b is Button.INFO:
             self.player.stop_and_clear()
@@ -0,0 +1,122 @@
+################################################################################
+# ks_trace - Keystroke-to-sound latency tracing.
+################################################################################
+# Used by ks_main.py, a program that uses keystrokes to play wave files.
+#
+# Each keystroke is timed through every stage on its way to being heard:
+#   KEY       readchar.readkey() returned the key
+#   DISPATCH  the key's handler was chosen (the if-chain in ks_main.py)
+#   PUT       the first message for the key was put on the play-queue
+#   GET       play_sounds() took the first message for the key off the queue
+#   PLAY      the first sound started playing after that
+# Every stage is timed with time.monotonic(), which is the same clock in every
+#   process on the machine, so times taken in the two processes compare.
+#
+# The stamps go on a trace queue, as (key number, stage, time) tuples. The
+#   keystroke process numbers the keys, and the number rides along with every
+#   message it puts on the play-queue (see SoundQueue.send() in ks_play.py), so
+#   that play_sounds() can stamp the GET and PLAY stages with the same number.
+#   play_sounds() keeps the number of the key whose sound is next to start on
+#   its side of the queue (SoundQueue.key_number), not in KEY_NUMBER: with the
+#   "thread" launch method the two run in one interpreter, and would otherwise
+#   overwrite each other's number.
+# When the program ends, summary() prints the 50th, 95th and 99th percentiles
+#   of the time from KEY to each later stage.
+#
+# Tracing is off unless a trace queue is given to the SoundQueue. Like the log
+#   queue, it is turned on in ks_main.py.
+################################################################################
+
+# Packages
+import itertools
+import queue
+import time
+
+# The stages, in order.
+KEY = "key"
+DISPATCH = "dispatch"
+PUT = "put"
+GET = "get"
+PLAY = "play"
+STAGES = (KEY, DISPATCH, PUT, GET, PLAY)
+
+# The number of the key being handled, by the keystroke process. (Only the
+#   keystroke process uses it.)
+KEY_NUMBER = None
+
+# Numbers the keys.
+KEY_COUNTER = itertools.count()
+
+################################################################################
+# stamp() - Time a stage of the current key (or of key_number, if given), now
+#   (or at the time.monotonic() time at, if given).
+# Tracing is off if trace_q is None.
+################################################################################
+def stamp(trace_q, stage, key_number=None, at=None):
+    if trace_q:
+        if key_number is None:
+            key_number = KEY_NUMBER
+        if key_number is not None:
+            trace_q.put((key_number, stage, time.monotonic() if at is None else at))
+
+################################################################################
+# key_pressed() - Start timing a new key. Call it as soon as readkey() returns.
+################################################################################
+def key_pressed(trace_q):
+    global KEY_NUMBER
+    if trace_q:
+        KEY_NUMBER = next(KEY_COUNTER)
+        stamp(trace_q, KEY)
+
+################################################################################
+# dequeued() - Called by play_sounds() for each message it takes off the queue.
+# key_number: the number of the key the message was sent for (None if untraced)
+################################################################################
+def dequeued(trace_q, key_number):
+    if key_number is not None:
+        stamp(trace_q, GET, key_number)
+
+################################################################################
+# played() - Called by play_sounds() whenever it starts playing a sound.
+# Stamps the PLAY stage of key_number, the last key dequeued whose sound has
+#   not already started (None if there is none; see SoundQueue.played()).
+#   at: the time the sound starts being heard, if known; else now.
+################################################################################
+def played(trace_q, key_number, at=None):
+    if key_number is not None:
+        stamp(trace_q, PLAY, key_number, at)
+
+################################################################################
+# percentile() - The pth percentile of a sorted list (nearest rank).
+################################################################################
+def percentile(times, p):
+    return times[min(len(times) - 1, max(0, int(round(p / 100 * len(times))) - 1))]
+
+################################################################################
+# summary() - Print the latency of each stage, from KEY, over all the keys.
+# Called from the main process when the program ends. Takes everything off
+#   the trace queue; only the first stamp of each stage, for each key, counts.
+################################################################################
+def summary(trace_q, timeout=0.5):
+    if not trace_q:
+        return
+
+    keys = dict()  # key number -> {stage: time}
+    while True:
+        try:
+            key_number, stage, t = trace_q.get(timeout=timeout)
+        except queue.Empty:
+            break
+        keys.setdefault(key_number, dict()).setdefault(stage, t)
+
+    print("Keystroke latency, over {} keys (ms):       p50       p95       p99".format(len(keys)))
+    for stage in STAGES[1:]:
+        times = sorted(stamps[stage] - stamps[KEY] for stamps in keys.values()
+                       if KEY in stamps and stage in stamps)
+        if not times:
+            print("  {:<38} (no samples)".format("key to " + stage))
+            continue
+        print("  {:<38} {:8.3f}  {:8.3f}  {:8.3f}".format(
+            "key to {} ({} keys)".format(stage, len(times)),
+            percentile(times, 50) * 1000, percentile(times, 95) * 1000,
+            percentile(times, 99) * 1000))
@@ -0,0 +1,176 @@
+################################################################################
+# ks_trim - Trims the silence off the start and end of each sound.
+################################################################################
+# Used by ks_pcm.py, whenever it decodes a wave file.
+#
+# The recorded sentences (e.g. in Text_Content/Ch02/) have dead air at the
+#   start and end of each file. Played one after another, that adds up to a
+#   lot of listening to nothing, and to a lot of memory holding nothing.
+#
+# The silence is found offline, once, by running:
+#   python3 ks_trim.py <directory> [threshold in dBFS]
+# which goes through every wave file in the directory (and in the directories
+#   under it), and saves where the sound of each one starts and ends in a
+#   sidecar file, SIDECAR_NAME, in the file's directory. Only files that are
+#   new, or have changed, since the last run are analysed again.
+#
+# The sidecar, in JSON:
+#   "threshold": the threshold it was made with, in dBFS
+#   "files": for each wave file, by name, its "size" and "mtime" (to tell if
+#            it has changed since), and the "start" and "end" frames of the
+#            part of it that is kept
+#
+# When a wave file is decoded (see ks_pcm.decode()), its trim points are
+#   looked up in its directory's sidecar, and only the frames between them are
+#   kept: they are sliced out of the decoded audio as a memoryview, without
+#   copying, before the audio goes into the arena. Every sound_object then
+#   simply is the trimmed sound (its num_frames, duration() and frame offsets
+#   all count from the trimmed start). A file with no up-to-date entry in a
+#   sidecar is not trimmed.
+#
+# The analysis needs NumPy; playing trimmed sounds does not.
+################################################################################
+
+# Packages
+import json
+import os
+import sys
+import threading
+import wave
+
+# Local imports - "ks" stands for "key_sounds".
+import ks_norm
+
+# Set to False to play every sound untrimmed, whatever the sidecars say.
+TRIM_SILENCE = True
+
+# The name of the sidecar file, in each directory of wave files.
+SIDECAR_NAME = "trim.json"
+
+# Audio quieter than this, in dBFS, is silence.
+THRESHOLD_DB = -50.0
+
+# The loudness is measured over blocks of this many seconds.
+BLOCK_SECONDS = 0.01
+
+# How much of the silence to keep before and after the sound, in seconds, so
+#   that quiet starts and ends of words are not clipped.
+PAD_SECONDS = 0.05
+
+# The sidecars read so far, by directory (None if a directory has none).
+SIDECARS = dict()
+SIDECARS_LOCK = threading.Lock()
+
+################################################################################
+# points() - The trim points of a wave file, as (start, end) frames, or None if
+#   it is not to be trimmed.
+################################################################################
+def points(filename):
+    if not TRIM_SILENCE:
+        return None
+    directory, name = os.path.split(filename)
+    with SIDECARS_LOCK:
+        if directory not in SIDECARS:
+            SIDECARS[directory] = read_sidecar(directory)
+        sidecar = SIDECARS[directory]
+    entry = sidecar and sidecar["files"].get(name)
+    if entry is None or not unchanged(filename, entry):
+        return None
+    return entry["start"], entry["end"]
+
+# True if a file is still the one a sidecar entry was made for.
+def unchanged(filename, entry):
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return False
+    return st.st_size == entry["size"] and st.st_mtime_ns == entry["mtime"]
+
+# A directory's sidecar, or None if it has none (or it cannot be read).
+def read_sidecar(directory):
+    try:
+        with open(os.path.join(directory, SIDECAR_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+################################################################################
+# analyse() - Find the trim points of a wave file.
+# The file is cut into blocks of BLOCK_SECONDS, and the RMS level of every
+#   block is worked out at once, with NumPy. The sound starts at the first
+#   block above threshold_db, and ends after the last one, with PAD_SECONDS
+#   of silence kept on either side.
+# Returns (start, end) frames; a file that is all silence is kept whole.
+################################################################################
+def analyse(filename, threshold_db=THRESHOLD_DB):
+    import numpy
+
+    wave_read = wave.open(filename, "rb")
+    try:
+        num_channels = wave_read.getnchannels()
+        bytes_per_sample = wave_read.getsampwidth()
+        sample_rate = wave_read.getframerate()
+        frames = wave_read.readframes(wave_read.getnframes())
+    finally:
+        wave_read.close()
+
+    samples = ks_norm.to_float(numpy, frames, bytes_per_sample).reshape(-1, num_channels)
+    num_frames = len(samples)
+    block = max(1, int(sample_rate * BLOCK_SECONDS))
+    num_blocks = -(-num_frames // block)
+    padded = numpy.zeros((num_blocks * block, num_channels), numpy.float32)
+    padded[:num_frames] = samples
+    rms = numpy.sqrt(numpy.square(padded.reshape(num_blocks, -1)).mean(axis=1))
+
+    loud = numpy.flatnonzero(rms >= 10 ** (threshold_db / 20))
+    if len(loud) == 0:
+        return 0, num_frames
+    pad = int(sample_rate * PAD_SECONDS)
+    return (max(0, int(loud[0]) * block - pad),
+            min(num_frames, (int(loud[-1]) + 1) * block + pad))
+
+################################################################################
+# index() - Analyse the wave files in a directory, and the directories under
+#   it, and save their trim points in a sidecar in each directory.
+# Files already in a sidecar, unchanged, with the same threshold, are skipped.
+# Returns the number of files analysed.
+################################################################################
+def index(top, threshold_db=THRESHOLD_DB):
+    analysed = 0
+    for directory, dirnames, filenames in os.walk(top):
+        names = sorted(f for f in filenames if f.endswith(".wav"))
+        if not names:
+            continue
+        old = read_sidecar(directory)
+        if old is None or old.get("threshold") != threshold_db:
+            old = {"files": dict()}
+        files = dict()
+        for name in names:
+            filename = os.path.join(directory, name)
+            entry = old["files"].get(name)
+            if entry is None or not unchanged(filename, entry):
+                st = os.stat(filename)
+                start, end = analyse(filename, threshold_db)
+                entry = {"size": st.st_size, "mtime": st.st_mtime_ns,
+                         "start": start, "end": end}
+                analysed += 1
+            files[name] = entry
+
+        path = os.path.join(directory, SIDECAR_NAME)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"threshold": threshold_db, "files": files}, f, indent=1)
+        os.replace(path + ".tmp", path)
+    with SIDECARS_LOCK:
+        SIDECARS.clear()
+    return analysed
+
+################################################################################
+# Index a directory, as asked on the command line.
+################################################################################
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python3 ks_trim.py <directory> [threshold in dBFS]")
+        sys.exit(1)
+    threshold = float(sys.argv[2]) if len(sys.argv) == 3 else THRESHOLD_DB
+    print("Analysed", index(sys.argv[1], threshold), "files")